@@ -1,15 +1,75 @@
 from flask import Flask, render_template, jsonify, request, session, redirect, url_for
 from flask_cors import CORS
+from flask.helpers import get_debug_flag
+import os
 import json
-import threading
+import sys
 import time
 from datetime import datetime
+from pathlib import Path
+
+# Jobbkön finns i backend/ och importeras därifrån, oberoende av procurement_monitor
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'backend'))
+from job_queue import JobQueue
 from procurement_monitor import get_monitor, ProcurementMonitor
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here-change-in-production'
 CORS(app)
 
+# Bakgrundsjobb körs av en begränsad arbetarpool; en arbetare som standard
+# så att bara ett jobb åt gången skriver till databasen
+MONITOR_JOB_WORKERS = int(os.environ.get('MONITOR_JOB_WORKERS', 1))
+job_queue = JobQueue(get_monitor().db_manager.pool, max_workers=MONITOR_JOB_WORKERS)
+
+def update_job(payload):
+    """Datauppdatering med förlopp per kommun"""
+    monitor = get_monitor()
+    monitor.daily_update(job_queue.reporter())
+    return {'municipalities': len(monitor.municipalities)}
+
+def analysis_job(payload):
+    """Veckoanalys; rapporten sparas som jobbets resultat"""
+    report = get_monitor().weekly_analysis()
+    if report is None:
+        raise RuntimeError('Veckoanalysen misslyckades')
+    return {'report': report}
+
+def full_cycle_job(payload):
+    """Datauppdatering följd av veckoanalys"""
+    report = get_monitor().run_full_cycle(job_queue.reporter())
+    if report is None:
+        raise RuntimeError('Veckoanalysen misslyckades')
+    return {'report': report}
+
+job_queue.register('procurement_update', update_job)
+job_queue.register('procurement_analysis', analysis_job)
+job_queue.register('procurement_full_cycle', full_cycle_job)
+
+def start_job_workers():
+    """
+    Starta köns arbetare vid uppstart, så att jobb som väntar sedan en omstart körs direkt.
+    Reloaderns övervakningsprocess (python app.py, flask run --debug) tar inga förfrågningar
+    och startar inga arbetare; det gör barnprocessen den startar (WERKZEUG_RUN_MAIN).
+    """
+    reloader_parent = os.environ.get('WERKZEUG_RUN_MAIN') != 'true' and (
+        __name__ == '__main__' or (os.environ.get('FLASK_RUN_FROM_CLI') == 'true' and get_debug_flag()))
+    if not reloader_parent:
+        job_queue.start()
+
+start_job_workers()
+
+def start_job(name, message):
+    """Lägg ett jobb i kön; ett likadant jobb som redan väntar eller körs återanvänds"""
+    job_id, coalesced = job_queue.submit(name)
+    return jsonify({
+        'success': True,
+        'message': message,
+        'job_id': job_id,
+        'coalesced': coalesced,
+        'status_url': url_for('get_job', job_id=job_id)
+    }), 202
+
 # Admin credentials
 ADMIN_CREDENTIALS = {
     'username': 'admin',
@@ -66,17 +126,7 @@ def run_procurement_update():
         return jsonify({'error': 'Ej autentiserad'}), 401
     
     try:
-        monitor = get_monitor()
-        
-        # Kör uppdatering i bakgrunden
-        def update_worker():
-            monitor.daily_update()
-        
-        thread = threading.Thread(target=update_worker)
-        thread.daemon = True
-        thread.start()
-        
-        return jsonify({'success': True, 'message': 'Datauppdatering startad'})
+        return start_job('procurement_update', 'Datauppdatering startad')
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -87,17 +137,7 @@ def run_procurement_analysis():
         return jsonify({'error': 'Ej autentiserad'}), 401
     
     try:
-        monitor = get_monitor()
-        
-        # Kör analys i bakgrunden
-        def analysis_worker():
-            return monitor.weekly_analysis()
-        
-        thread = threading.Thread(target=analysis_worker)
-        thread.daemon = True
-        thread.start()
-        
-        return jsonify({'success': True, 'message': 'Analys startad'})
+        return start_job('procurement_analysis', 'Analys startad')
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -108,16 +148,34 @@ def run_full_cycle():
         return jsonify({'error': 'Ej autentiserad'}), 401
     
     try:
-        monitor = get_monitor()
-        
-        def full_cycle_worker():
-            return monitor.run_full_cycle()
-        
-        thread = threading.Thread(target=full_cycle_worker)
-        thread.daemon = True
-        thread.start()
-        
-        return jsonify({'success': True, 'message': 'Fullständig cykel startad'})
+        return start_job('procurement_full_cycle', 'Fullständig cykel startad')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/procurement/jobs')
+def list_jobs():
+    """API endpoint för senaste bakgrundsjobb och köstatistik"""
+    if not session.get('authenticated'):
+        return jsonify({'error': 'Ej autentiserad'}), 401
+    
+    try:
+        limit = request.args.get('limit', 20, type=int)
+        jobs = job_queue.recent(limit, name=request.args.get('name'))
+        return jsonify({'jobs': jobs, 'stats': job_queue.stats()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/procurement/jobs/<int:job_id>')
+def get_job(job_id):
+    """API endpoint för status, förlopp och tid för ett bakgrundsjobb"""
+    if not session.get('authenticated'):
+        return jsonify({'error': 'Ej autentiserad'}), 401
+    
+    try:
+        job = job_queue.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Jobbet finns inte'}), 404
+        return jsonify(job)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
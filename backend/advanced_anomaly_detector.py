@@ -10,19 +10,39 @@ from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
 from sklearn.cluster import DBSCAN
 from datetime import datetime, timedelta
-import sqlite3
 import logging
-from typing import List, Dict, Tuple
+from typing import Callable, List, Dict, Tuple, Optional
 import json
+import os
 import re
+from db_pool import get_pool
+from migrations import BUMP_CACHE_GENERATION
+from incremental_state import IncrementalState
+from analysis_context import AnalysisContext, date_strings
+from price_outliers import group_value_stats, z_scores, iqr_or_z_outliers, group_order
+from detector_runner import DetectorRunner
+from model_store import ModelStore, data_fingerprint
+from procurement_snapshot import get_snapshot, default_snapshot_dir, snapshot_enabled
+from supplier_graph import SupplierGraph
+from shared_directors import SharedDirectorDetector
 
 logger = logging.getLogger(__name__)
 
+# Nollpunkt för tidsfeaturen i ML-detektionen
+ML_EPOCH = pd.Timestamp('2020-01-01')
+ML_MODEL_NAME = 'isolation_forest'
+
 class AdvancedAnomalyDetector:
     """Avancerad anomalidetektor med ML och statistisk analys"""
     
-    def __init__(self, db_path: str = 'nyhetsportalen.db'):
+    def __init__(self, db_path: str = 'nyhetsportalen.db', runner: Optional[DetectorRunner] = None):
         self.db_path = db_path
+        self.pool = get_pool(db_path)
+        self.state = IncrementalState(self.pool)
+        self.runner = runner or DetectorRunner()
+        self.model_store = ModelStore(self.pool, self._model_dir())
+        self.snapshot = get_snapshot(self.pool, default_snapshot_dir(db_path)) if snapshot_enabled() else None
+        self.last_run_timings: Dict = {}
         self.scaler = StandardScaler()
         self.isolation_forest = IsolationForest(
             contamination=0.1,  # 10% förväntas vara anomalier
@@ -30,332 +50,397 @@ class AdvancedAnomalyDetector:
             n_estimators=100
         )
         
-    def detect_all_anomalies(self) -> List[Dict]:
+    def __getstate__(self):
+        """Detektorn skickas till detektorprocesserna utan pool och sidotabellstillstånd"""
+        state = self.__dict__.copy()
+        del state['pool'], state['state'], state['runner'], state['model_store'], state['snapshot']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.pool = get_pool(self.db_path)
+        self.state = IncrementalState(self.pool)
+        self.runner = DetectorRunner(executor='serial')
+        self.model_store = ModelStore(self.pool, self._model_dir())
+        self.snapshot = get_snapshot(self.pool, default_snapshot_dir(self.db_path)) if snapshot_enabled() else None
+    
+    def _model_dir(self) -> str:
+        """Katalog för sparade modeller, som standard bredvid databasen"""
+        return os.environ.get('ML_MODEL_DIR') or os.path.join(
+            os.path.dirname(os.path.abspath(self.db_path)), 'models')
+    
+    def load_context(self, authorities: Optional[List[str]] = None) -> AnalysisContext:
+        """Läs upphandlingsdata en gång för alla detektorer, från snapshoten om den finns"""
+        if self.snapshot is not None:
+            try:
+                self.snapshot.refresh()
+                return AnalysisContext.from_snapshot(self.snapshot, authorities=authorities)
+            except Exception as e:
+                logger.warning(f"Snapshot unavailable, reading from SQLite: {e}")
+        return AnalysisContext.load(self.pool, authorities=authorities)
+    
+    def detectors(self) -> List[Tuple[str, Callable]]:
+        """Alla detektorer i den ordning deras anomalier rapporteras"""
+        return [
+            ('price', self.detect_price_anomalies),                 # Statistiska prisoutliers
+            ('market_concentration', self.detect_market_concentration),
+            ('time_clustering', self.detect_time_clustering),
+            ('geographical', self.detect_geographical_anomalies),
+            ('ml', self.detect_ml_anomalies),                       # Machine Learning-baserade anomalier
+            ('network', self.detect_network_anomalies),             # Företag-myndighet kopplingar
+            ('shared_directors', self.detect_shared_directors)      # Konkurrenter med gemensam styrelse
+        ]
+    
+    def detect_all_anomalies(self, ctx: Optional[AnalysisContext] = None) -> List[Dict]:
         """Kör all anomalidetektion och returnera alla upptäckta anomalier"""
-        all_anomalies = []
-        
         try:
-            # 1. Prisanomalier (statistiska outliers)
-            price_anomalies = self.detect_price_anomalies()
-            all_anomalies.extend(price_anomalies)
-            
-            # 2. Marknadskoncentration
-            market_anomalies = self.detect_market_concentration()
-            all_anomalies.extend(market_anomalies)
-            
-            # 3. Tidsanomalier (clustering)
-            time_anomalies = self.detect_time_clustering()
-            all_anomalies.extend(time_anomalies)
+            # Läs tabellen en gång och dela ramen mellan detektorerna
+            ctx = ctx or self.load_context()
             
-            # 4. Geografiska anomalier
-            geo_anomalies = self.detect_geographical_anomalies()
-            all_anomalies.extend(geo_anomalies)
+            # Detektorerna är oberoende av varandra och körs samtidigt
+            all_anomalies, self.last_run_timings = self.runner.run(self.detectors(), ctx)
             
-            # 5. Machine Learning-baserade anomalier
-            ml_anomalies = self.detect_ml_anomalies()
-            all_anomalies.extend(ml_anomalies)
-            
-            # 6. Nätverksanomalier (företag-myndighet kopplingar)
-            network_anomalies = self.detect_network_anomalies()
-            all_anomalies.extend(network_anomalies)
-            
-            logger.info(f"Detected {len(all_anomalies)} total anomalies")
+            logger.info(f"Detected {len(all_anomalies)} total anomalies in "
+                        f"{self.last_run_timings['wall_seconds']:.2f} seconds ({self.runner.executor})")
             return all_anomalies
             
         except Exception as e:
             logger.error(f"Error in anomaly detection: {e}")
             return []
     
-    def detect_price_anomalies(self) -> List[Dict]:
+    def _price_anomaly(self, procurement_id, value: float, mean_val: float,
+                       std_val: float, z_score: float) -> Dict:
+        """Bygg en prisavvikelse"""
+        risk_score = min(10, max(1, z_score))
+        deviation_pct = ((value - mean_val) / mean_val) * 100
+        
+        return {
+            'procurement_id': procurement_id,
+            'anomaly_type': 'Prisavvikelse',
+            'description': f'Kontraktsvärde {value:,.0f} SEK avviker {deviation_pct:.0f}% från medel för kategorin ({mean_val:,.0f} SEK)',
+            'risk_score': risk_score,
+            'detected_at': datetime.now().isoformat(),
+            'details': {
+                'z_score': z_score,
+                'category_mean': mean_val,
+                'category_std': std_val,
+                'deviation_percent': deviation_pct
+            }
+        }
+    
+    def _price_anomalies_from(self, rows: pd.DataFrame, stats: pd.DataFrame, z: pd.Series) -> List[Dict]:
+        """Bygg prisavvikelser för redan flaggade rader"""
+        return [
+            self._price_anomaly(procurement_id, value, mean_val, std_val, z_score)
+            for procurement_id, value, mean_val, std_val, z_score in zip(
+                rows['id'].tolist(), rows['value'].tolist(), stats['mean'].tolist(),
+                stats['std'].tolist(), z.tolist()
+            )
+        ]
+    
+    def _time_cluster_anomaly(self, award_date: str, authority: str, contracts_count: int,
+                              winners: str, total_value: float, mean_contracts: float) -> Dict:
+        """Bygg ett tidskluster"""
+        # Kontrollera om samma företag vinner flera
+        winners = winners.split(',') if winners else []
+        unique_winners = len(set(winners))
+        winner_concentration = (contracts_count - unique_winners + 1) / contracts_count
+        
+        risk_score = min(10, (contracts_count / mean_contracts) * 2)
+        if winner_concentration > 0.5:  # Samma vinnare för över 50%
+            risk_score += 2
+        
+        return {
+            'procurement_id': None,
+            'anomaly_type': 'Tidskluster',
+            'description': f'{contracts_count} kontrakt tilldelade samma dag ({award_date}) av {authority}',
+            'risk_score': min(10, risk_score),
+            'detected_at': datetime.now().isoformat(),
+            'details': {
+                'date': award_date,
+                'authority': authority,
+                'contracts_count': contracts_count,
+                'unique_winners': unique_winners,
+                'winner_concentration': winner_concentration,
+                'total_value': total_value
+            }
+        }
+    
+    def _network_anomaly(self, company: str, authority: str, strength: int, total_value: float,
+                         first_contract: str, last_contract: str) -> Dict:
+        """Bygg en nätverksanomali"""
+        # Beräkna tidsperiod
+        first = pd.to_datetime(first_contract)
+        last = pd.to_datetime(last_contract)
+        period_days = (last - first).days
+        
+        # Beräkna risk baserat på frekvens och koncentration
+        if period_days > 0:
+            contracts_per_year = (strength / period_days) * 365
+            risk_score = min(10, contracts_per_year * 2)
+        else:
+            risk_score = 8  # Många kontrakt samma dag = högrisk
+        
+        return {
+            'procurement_id': None,
+            'anomaly_type': 'Nätverksanomali',
+            'description': f'Stark koppling: {company} har {strength} kontrakt med {authority} under {period_days} dagar',
+            'risk_score': risk_score,
+            'detected_at': datetime.now().isoformat(),
+            'details': {
+                'company': company,
+                'authority': authority,
+                'connection_strength': strength,
+                'total_value': total_value,
+                'period_days': period_days,
+                'first_contract': first_contract,
+                'last_contract': last_contract
+            }
+        }
+    
+    def detect_price_anomalies(self, ctx: Optional[AnalysisContext] = None) -> List[Dict]:
         """Upptäck prisanomalier inom samma kategori"""
         anomalies = []
+        ctx = ctx or self.load_context()
         
-        with sqlite3.connect(self.db_path) as conn:
-            # Hämta alla kontrakt med CPV-koder
-            df = pd.read_sql_query('''
-                SELECT id, title, contracting_authority, winner_name, 
-                       value, cpv_codes, award_date, municipality
-                FROM procurements 
-                WHERE value > 0 AND cpv_codes IS NOT NULL
-                ORDER BY award_date DESC
-            ''', conn)
-            
-            if df.empty:
-                return anomalies
-            
-            # Gruppera per CPV-kategori
-            for cpv_group in df['cpv_codes'].unique():
-                if not cpv_group:
-                    continue
-                    
-                group_data = df[df['cpv_codes'] == cpv_group]
-                if len(group_data) < 3:  # Behöver minst 3 för statistik
-                    continue
-                
-                # Beräkna statistik
-                values = group_data['value']
-                mean_val = values.mean()
-                std_val = values.std()
-                q1 = values.quantile(0.25)
-                q3 = values.quantile(0.75)
-                iqr = q3 - q1
-                
-                # IQR-metoden för outliers
-                upper_bound = q3 + 1.5 * iqr
-                lower_bound = q1 - 1.5 * iqr
-                
-                # Z-score för extrema outliers
-                z_threshold = 2.5
-                
-                for _, row in group_data.iterrows():
-                    value = row['value']
-                    z_score = abs(value - mean_val) / std_val if std_val > 0 else 0
-                    
-                    # Kontrollera om det är en outlier
-                    is_outlier = (value > upper_bound or value < lower_bound) or z_score > z_threshold
-                    
-                    if is_outlier and value > mean_val * 1.5:  # Fokus på höga priser
-                        risk_score = min(10, max(1, z_score))
-                        deviation_pct = ((value - mean_val) / mean_val) * 100
-                        
-                        anomaly = {
-                            'procurement_id': row['id'],
-                            'anomaly_type': 'Prisavvikelse',
-                            'description': f'Kontraktsvärde {value:,.0f} SEK avviker {deviation_pct:.0f}% från medel för kategorin ({mean_val:,.0f} SEK)',
-                            'risk_score': risk_score,
-                            'detected_at': datetime.now().isoformat(),
-                            'details': {
-                                'z_score': z_score,
-                                'category_mean': mean_val,
-                                'category_std': std_val,
-                                'deviation_percent': deviation_pct
-                            }
-                        }
-                        anomalies.append(anomaly)
+        # Alla kontrakt med CPV-koder
+        frame = ctx.frame
+        df = frame[(frame['value'] > 0) & frame['cpv_codes'].notna() & (frame['cpv_codes'] != '')]
+        
+        if df.empty:
+            return anomalies
+        
+        # Statistik per CPV-kategori för varje rad
+        stats = group_value_stats(df, 'cpv_codes')
+        z = z_scores(df['value'], stats)
+        
+        # Minst 3 för statistik, IQR- eller z-outlier och fokus på höga priser
+        flagged = ((stats['count'] >= 3)
+                   & iqr_or_z_outliers(df['value'], stats, z, iqr_factor=1.5, z_threshold=2.5)
+                   & (df['value'] > stats['mean'] * 1.5))
+        
+        # Samma ordning som tidigare loop per kategori
+        order = group_order(df, 'cpv_codes')
+        flagged = flagged.iloc[order]
+        rows = df.iloc[order][flagged]
+        anomalies.extend(self._price_anomalies_from(rows, stats.loc[rows.index], z.loc[rows.index]))
         
         logger.info(f"Detected {len(anomalies)} price anomalies")
         return anomalies
     
-    def detect_market_concentration(self) -> List[Dict]:
+    def detect_market_concentration(self, ctx: Optional[AnalysisContext] = None) -> List[Dict]:
         """Upptäck marknadskoncentration (få företag vinner många kontrakt)"""
         anomalies = []
+        ctx = ctx or self.load_context()
         
-        with sqlite3.connect(self.db_path) as conn:
-            # Analysera marknadsandelar per myndighet och kategori
-            df = pd.read_sql_query('''
-                SELECT contracting_authority, winner_name, cpv_codes,
-                       COUNT(*) as contract_count,
-                       SUM(value) as total_value,
-                       AVG(value) as avg_value
-                FROM procurements 
-                WHERE award_date >= date('now', '-365 days')
-                GROUP BY contracting_authority, winner_name, cpv_codes
-                HAVING contract_count >= 2
-            ''', conn)
-            
-            if df.empty:
-                return anomalies
+        # Analysera marknadsandelar per myndighet och kategori
+        df = ctx.since(365).groupby(
+            ['contracting_authority', 'winner_name', 'cpv_codes'], observed=True, dropna=False
+        ).agg(
+            contract_count=('id', 'size'),
+            total_value=('value', 'sum'),
+            avg_value=('value', 'mean')
+        ).reset_index()
+        df = df[df['contract_count'] >= 2]
+        
+        if df.empty:
+            return anomalies
+        
+        # Marknadsandelar mot myndighetens totaler, för alla myndigheter på en gång
+        df = df[df['contracting_authority'].notna()]
+        by_authority = df.groupby('contracting_authority', observed=True)
+        total_contracts = by_authority['contract_count'].transform('sum')
+        total_value = by_authority['total_value'].transform('sum')
+        df = df.assign(
+            contract_share=df['contract_count'] / total_contracts * 100,
+            value_share=(df['total_value'] / total_value.where(total_value > 0) * 100).fillna(0)
+        )
+        
+        # Flagga om företaget har över 40% av kontrakten eller värdet
+        flagged = df[(df['contract_share'] > 40) | (df['value_share'] > 40)]
+        
+        for company, authority, company_contracts, contract_share, value_share in zip(
+            flagged['winner_name'].tolist(), flagged['contracting_authority'].tolist(),
+            flagged['contract_count'].tolist(), flagged['contract_share'].tolist(), flagged['value_share'].tolist()
+        ):
+            risk_score = min(10, (contract_share + value_share) / 10)
             
-            # Analysera per myndighet
-            for authority in df['contracting_authority'].unique():
-                authority_data = df[df['contracting_authority'] == authority]
-                
-                total_contracts = authority_data['contract_count'].sum()
-                total_value = authority_data['total_value'].sum()
-                
-                for _, row in authority_data.iterrows():
-                    company = row['winner_name']
-                    company_contracts = row['contract_count']
-                    company_value = row['total_value']
-                    
-                    # Beräkna marknadsandel
-                    contract_share = (company_contracts / total_contracts) * 100
-                    value_share = (company_value / total_value) * 100 if total_value > 0 else 0
-                    
-                    # Flagga om företaget har över 40% av kontrakten eller värdet
-                    if contract_share > 40 or value_share > 40:
-                        risk_score = min(10, (contract_share + value_share) / 10)
-                        
-                        anomaly = {
-                            'procurement_id': None,  # Gäller flera kontrakt
-                            'anomaly_type': 'Marknadskoncentration',
-                            'description': f'{company} vinner {contract_share:.1f}% av kontrakten hos {authority} (värde: {value_share:.1f}%)',
-                            'risk_score': risk_score,
-                            'detected_at': datetime.now().isoformat(),
-                            'details': {
-                                'company': company,
-                                'authority': authority,
-                                'contract_share': contract_share,
-                                'value_share': value_share,
-                                'total_contracts': company_contracts
-                            }
-                        }
-                        anomalies.append(anomaly)
+            anomaly = {
+                'procurement_id': None,  # Gäller flera kontrakt
+                'anomaly_type': 'Marknadskoncentration',
+                'description': f'{company} vinner {contract_share:.1f}% av kontrakten hos {authority} (värde: {value_share:.1f}%)',
+                'risk_score': risk_score,
+                'detected_at': datetime.now().isoformat(),
+                'details': {
+                    'company': company,
+                    'authority': authority,
+                    'contract_share': contract_share,
+                    'value_share': value_share,
+                    'total_contracts': company_contracts
+                }
+            }
+            anomalies.append(anomaly)
         
         logger.info(f"Detected {len(anomalies)} market concentration anomalies")
         return anomalies
     
-    def detect_time_clustering(self) -> List[Dict]:
+    def detect_time_clustering(self, ctx: Optional[AnalysisContext] = None) -> List[Dict]:
         """Upptäck misstänkta tidskluster (många kontrakt samma dag/period)"""
         anomalies = []
+        ctx = ctx or self.load_context()
         
-        with sqlite3.connect(self.db_path) as conn:
-            # Hämta kontrakt grupperade per dag
-            df = pd.read_sql_query('''
-                SELECT award_date, contracting_authority,
-                       COUNT(*) as contracts_per_day,
-                       SUM(value) as total_value_per_day,
-                       GROUP_CONCAT(winner_name) as winners
-                FROM procurements 
-                WHERE award_date IS NOT NULL
-                GROUP BY award_date, contracting_authority
-                HAVING contracts_per_day >= 3
-                ORDER BY contracts_per_day DESC
-            ''', conn)
-            
-            if df.empty:
-                return anomalies
-            
-            # Analysera statistik för att hitta outliers
-            contracts_per_day = df['contracts_per_day']
-            mean_contracts = contracts_per_day.mean()
-            std_contracts = contracts_per_day.std()
-            
-            threshold = mean_contracts + 2 * std_contracts  # 2 standardavvikelser
-            
-            for _, row in df.iterrows():
-                contracts_count = row['contracts_per_day']
-                
-                if contracts_count > threshold and contracts_count >= 5:
-                    # Kontrollera om samma företag vinner flera
-                    winners = row['winners'].split(',') if row['winners'] else []
-                    unique_winners = len(set(winners))
-                    winner_concentration = (contracts_count - unique_winners + 1) / contracts_count
-                    
-                    risk_score = min(10, (contracts_count / mean_contracts) * 2)
-                    if winner_concentration > 0.5:  # Samma vinnare för över 50%
-                        risk_score += 2
-                    
-                    anomaly = {
-                        'procurement_id': None,
-                        'anomaly_type': 'Tidskluster',
-                        'description': f'{contracts_count} kontrakt tilldelade samma dag ({row["award_date"]}) av {row["contracting_authority"]}',
-                        'risk_score': min(10, risk_score),
-                        'detected_at': datetime.now().isoformat(),
-                        'details': {
-                            'date': row['award_date'],
-                            'authority': row['contracting_authority'],
-                            'contracts_count': contracts_count,
-                            'unique_winners': unique_winners,
-                            'winner_concentration': winner_concentration,
-                            'total_value': row['total_value_per_day']
-                        }
-                    }
-                    anomalies.append(anomaly)
+        # Kontrakt grupperade per dag och myndighet
+        keys = ['award_date', 'contracting_authority']
+        dated = ctx.frame[ctx.frame['award_date'].notna()]
+        df = dated.groupby(keys, observed=True, dropna=False).agg(
+            contracts_per_day=('id', 'size'),
+            total_value_per_day=('value', 'sum')
+        ).reset_index()
+        df = df[df['contracts_per_day'] >= 3].sort_values('contracts_per_day', ascending=False)
+        
+        if df.empty:
+            return anomalies
+        
+        # Analysera statistik för att hitta outliers
+        contracts_per_day = df['contracts_per_day']
+        mean_contracts = contracts_per_day.mean()
+        std_contracts = contracts_per_day.std()
+        
+        threshold = mean_contracts + 2 * std_contracts  # 2 standardavvikelser
+        flagged = df[(df['contracts_per_day'] > threshold) & (df['contracts_per_day'] >= 5)]
+        
+        # Vinnarlistor behövs bara för flaggade grupper
+        winners = dated.merge(flagged[keys], on=keys).groupby(keys, observed=True, dropna=False)['winner_name'].agg(
+            lambda names: ','.join(names.dropna().astype(str))
+        ).rename('winners').reset_index()
+        flagged = flagged.merge(winners, on=keys, how='left')
+        flagged['award_date'] = date_strings(flagged['award_date'])
+        
+        for _, row in flagged.iterrows():
+            anomalies.append(self._time_cluster_anomaly(
+                row['award_date'], row['contracting_authority'], row['contracts_per_day'],
+                row['winners'], row['total_value_per_day'], mean_contracts
+            ))
         
         logger.info(f"Detected {len(anomalies)} time clustering anomalies")
         return anomalies
     
-    def detect_geographical_anomalies(self) -> List[Dict]:
+    def detect_geographical_anomalies(self, ctx: Optional[AnalysisContext] = None) -> List[Dict]:
         """Upptäck geografiska anomalier (företag vinner utanför hemregion)"""
         anomalies = []
+        ctx = ctx or self.load_context()
         
         # Denna funktion kan utökas med mer sofistikerad geografisk analys
         # För nu fokuserar vi på uppenbara geografiska avvikelser
         
-        with sqlite3.connect(self.db_path) as conn:
-            df = pd.read_sql_query('''
-                SELECT id, title, contracting_authority, winner_name, 
-                       value, municipality, award_date
-                FROM procurements 
-                WHERE municipality IS NOT NULL
-            ''', conn)
-            
-            if df.empty:
-                return anomalies
+        df = ctx.frame[ctx.frame['municipality'].notna()]
+        
+        if df.empty:
+            return anomalies
+        
+        # Kontrollera om företagsnamn antyder annan geografisk hemvist
+        geographic_indicators = {
+            'stockholm': ['stockholm', 'södermalm', 'östermalm'],
+            'göteborg': ['göteborg', 'göteborgs', 'west', 'väst'],
+            'malmö': ['malmö', 'skåne', 'south', 'syd'],
+            'uppsala': ['uppsala'],
+            'linköping': ['linköping', 'östergötland']
+        }
+        
+        # Enkla geografiska regler (kan utökas)
+        for row in df[['municipality', 'winner_name']].itertuples(index=False):
+            municipality = row.municipality.lower()
+            winner = str(row.winner_name).lower()
             
-            # Enkla geografiska regler (kan utökas)
-            for _, row in df.iterrows():
-                municipality = row['municipality'].lower()
-                winner = row['winner_name'].lower()
-                
-                # Kontrollera om företagsnamn antyder annan geografisk hemvist
-                geographic_indicators = {
-                    'stockholm': ['stockholm', 'södermalm', 'östermalm'],
-                    'göteborg': ['göteborg', 'göteborgs', 'west', 'väst'],
-                    'malmö': ['malmö', 'skåne', 'south', 'syd'],
-                    'uppsala': ['uppsala'],
-                    'linköping': ['linköping', 'östergötland']
-                }
-                
-                # Enkel heuristik för geografisk matchning
-                # Detta kan göras mycket mer sofistikerat med riktiga adressdatabaser
+            # Enkel heuristik för geografisk matchning
+            # Detta kan göras mycket mer sofistikerat med riktiga adressdatabaser
                 
         logger.info(f"Detected {len(anomalies)} geographical anomalies")
         return anomalies
     
-    def detect_ml_anomalies(self) -> List[Dict]:
+    def _ml_features(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Features för ML-detektionen (df filtrerad på value > 0)"""
+        # Numeriska features
+        X = pd.DataFrame({
+            'value': df['value'],
+            'days_since_epoch': (df['award_date'] - ML_EPOCH) / pd.Timedelta(days=1),
+            'title_length': df['title_length']
+        }).fillna(0)
+        
+        # Kategoriska features (frequency encoding)
+        for column, feature in (('contracting_authority', 'authority_frequency'),
+                                ('winner_name', 'winner_frequency')):
+            X[feature] = df.groupby(column, observed=True)['id'].transform('size').fillna(0)
+        return X
+    
+    def detect_ml_anomalies(self, ctx: Optional[AnalysisContext] = None) -> List[Dict]:
         """Machine Learning-baserad anomalidetektion"""
         anomalies = []
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                df = pd.read_sql_query('''
-                    SELECT id, value, contracting_authority, winner_name,
-                           julianday(award_date) - julianday('2020-01-01') as days_since_epoch,
-                           length(title) as title_length
-                    FROM procurements 
-                    WHERE value > 0
-                ''', conn)
-                
-                if len(df) < 10:  # Behöver tillräckligt med data
-                    return anomalies
-                
-                # Förbered features för ML
-                features = []
-                
-                # Numeriska features
-                feature_columns = ['value', 'days_since_epoch', 'title_length']
-                X = df[feature_columns].fillna(0)
-                
-                # Kategoriska features (frequency encoding)
-                authority_counts = df['contracting_authority'].value_counts()
-                winner_counts = df['winner_name'].value_counts()
-                
-                X['authority_frequency'] = df['contracting_authority'].map(authority_counts)
-                X['winner_frequency'] = df['winner_name'].map(winner_counts)
-                
-                # Normalisera data
+            ctx = ctx or self.load_context()
+            df = ctx.frame[ctx.frame['value'] > 0].reset_index(drop=True)
+            
+            if len(df) < 10:  # Behöver tillräckligt med data
+                return anomalies
+            
+            X = self._ml_features(df)
+            
+            # Sparad modell återanvänds tills schema, tillväxt eller drift kräver omträning
+            stored = self.model_store.load(ML_MODEL_NAME)
+            scored_max_id = stored.metadata['scored_max_id'] if stored else 0
+            new_mask = (df['id'] > scored_max_id).to_numpy()
+            # Tid och frekvenser förskjuts alltid när tabellen växer (fångas av tillväxtregeln);
+            # drift mäts på radens egna features
+            reason = self.model_store.refit_reason(
+                stored, list(X.columns), df, X[new_mask],
+                drift_exclude=['days_since_epoch', 'authority_frequency', 'winner_frequency']
+            )
+            
+            if reason:
+                # Normalisera data och träna Isolation Forest på hela tabellen
                 X_scaled = self.scaler.fit_transform(X)
-                
-                # Träna Isolation Forest
-                outlier_predictions = self.isolation_forest.fit_predict(X_scaled)
+                self.isolation_forest.fit(X_scaled)
+                stored = self.model_store.save(
+                    ML_MODEL_NAME, self.scaler, self.isolation_forest, data_fingerprint(df),
+                    list(X.columns), len(df), df['id'].max(), reason
+                )
+                scored = df
                 outlier_scores = self.isolation_forest.decision_function(X_scaled)
+            else:
+                # Endast nya rader poängsätts mot den sparade modellen
+                scored = df[new_mask]
+                outlier_scores = stored.score(X[new_mask]) if len(scored) else np.array([])
+                if len(scored):
+                    self.model_store.mark_scored(ML_MODEL_NAME, scored['id'].max())
+            
+            # Hitta outliers (negativ decision_function motsvarar prediction = -1)
+            outlier_indices = np.where(outlier_scores < 0)[0]
+            
+            for idx in outlier_indices:
+                row = scored.iloc[idx]
+                score = outlier_scores[idx]
                 
-                # Hitta outliers (prediction = -1)
-                outlier_indices = np.where(outlier_predictions == -1)[0]
+                # Konvertera score till risk score (0-10)
+                risk_score = min(10, max(1, abs(score) * 10))
                 
-                for idx in outlier_indices:
-                    row = df.iloc[idx]
-                    score = outlier_scores[idx]
-                    
-                    # Konvertera score till risk score (0-10)
-                    risk_score = min(10, max(1, abs(score) * 10))
-                    
-                    anomaly = {
-                        'procurement_id': row['id'],
-                        'anomaly_type': 'ML-Anomali',
-                        'description': f'Machine Learning algoritm flaggade detta kontrakt som avvikande baserat på kombination av värde, timing och frekvenser',
-                        'risk_score': risk_score,
-                        'detected_at': datetime.now().isoformat(),
-                        'details': {
-                            'ml_score': score,
-                            'value': row['value'],
-                            'authority': row['contracting_authority'],
-                            'winner': row['winner_name']
-                        }
+                anomaly = {
+                    'procurement_id': row['id'],
+                    'anomaly_type': 'ML-Anomali',
+                    'description': f'Machine Learning algoritm flaggade detta kontrakt som avvikande baserat på kombination av värde, timing och frekvenser',
+                    'risk_score': risk_score,
+                    'detected_at': datetime.now().isoformat(),
+                    'details': {
+                        'ml_score': score,
+                        'value': row['value'],
+                        'authority': row['contracting_authority'],
+                        'winner': row['winner_name']
                     }
-                    anomalies.append(anomaly)
+                }
+                anomalies.append(anomaly)
+            
+            logger.info(f"ML model {ML_MODEL_NAME} v{stored.metadata['version']}: "
+                        f"{'refit (' + reason + ')' if reason else 'reused'}, scored {len(scored)} rows")
                     
         except Exception as e:
             logger.error(f"Error in ML anomaly detection: {e}")
@@ -363,65 +448,29 @@ class AdvancedAnomalyDetector:
         logger.info(f"Detected {len(anomalies)} ML-based anomalies")
         return anomalies
     
-    def detect_network_anomalies(self) -> List[Dict]:
+    def detect_network_anomalies(self, ctx: Optional[AnalysisContext] = None) -> List[Dict]:
         """Upptäck nätverksanomalier baserat på kopplingar mellan aktörer"""
         anomalies = []
         
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                # Analysera företag-myndighet nätverk
-                df = pd.read_sql_query('''
-                    SELECT contracting_authority, winner_name, 
-                           COUNT(*) as connection_strength,
-                           SUM(value) as total_value,
-                           MIN(award_date) as first_contract,
-                           MAX(award_date) as last_contract
-                    FROM procurements 
-                    GROUP BY contracting_authority, winner_name
-                    HAVING connection_strength >= 3
-                    ORDER BY connection_strength DESC
-                ''', conn)
-                
-                if df.empty:
-                    return anomalies
-                
-                # Analysera "starka kopplingar"
-                for _, row in df.iterrows():
-                    strength = row['connection_strength']
-                    authority = row['contracting_authority']
-                    company = row['winner_name']
-                    
-                    # Flagga mycket starka kopplingar
-                    if strength >= 10:  # Många kontrakt mellan samma aktörer
-                        # Beräkna tidsperiod
-                        first = pd.to_datetime(row['first_contract'])
-                        last = pd.to_datetime(row['last_contract'])
-                        period_days = (last - first).days
-                        
-                        # Beräkna risk baserat på frekvens och koncentration
-                        if period_days > 0:
-                            contracts_per_year = (strength / period_days) * 365
-                            risk_score = min(10, contracts_per_year * 2)
-                        else:
-                            risk_score = 8  # Många kontrakt samma dag = högrisk
-                        
-                        anomaly = {
-                            'procurement_id': None,
-                            'anomaly_type': 'Nätverksanomali',
-                            'description': f'Stark koppling: {company} har {strength} kontrakt med {authority} under {period_days} dagar',
-                            'risk_score': risk_score,
-                            'detected_at': datetime.now().isoformat(),
-                            'details': {
-                                'company': company,
-                                'authority': authority,
-                                'connection_strength': strength,
-                                'total_value': row['total_value'],
-                                'period_days': period_days,
-                                'first_contract': row['first_contract'],
-                                'last_contract': row['last_contract']
-                            }
-                        }
-                        anomalies.append(anomaly)
+            ctx = ctx or self.load_context()
+            
+            # Företag-myndighet-nätverket som gles bipartit graf
+            graph = SupplierGraph.from_frame(ctx.frame)
+            
+            # Flagga mycket starka kopplingar (många kontrakt mellan samma aktörer)
+            edges = graph.edges_frame(min_contracts=10)
+            for edge in edges.itertuples(index=False):
+                anomaly = self._network_anomaly(
+                    edge.supplier, edge.authority, edge.contracts, edge.total_value,
+                    edge.first_contract, edge.last_contract
+                )
+                anomaly['details'].update({
+                    'authority_share': edge.authority_share,
+                    'supplier_dependency': edge.supplier_dependency,
+                    'supplier_value_dependency': edge.supplier_value_dependency
+                })
+                anomalies.append(anomaly)
                         
         except Exception as e:
             logger.error(f"Error in network anomaly detection: {e}")
@@ -429,32 +478,59 @@ class AdvancedAnomalyDetector:
         logger.info(f"Detected {len(anomalies)} network anomalies")
         return anomalies
     
+    def detect_shared_directors(self, ctx: Optional[AnalysisContext] = None) -> List[Dict]:
+        """
+        Konkurrerande leverantörer som delar styrelseledamöter och vinner hos samma myndighet.
+        Läser personindex och vinster per org.nr direkt ur databasen (ramen saknar båda).
+        """
+        anomalies = []
+        
+        try:
+            anomalies = SharedDirectorDetector(self.pool).detect()
+        except Exception as e:
+            logger.error(f"Error in shared director detection: {e}")
+        
+        logger.info(f"Detected {len(anomalies)} shared director anomalies")
+        return anomalies
+    
+    @staticmethod
+    def _procurement_id(value) -> Optional[int]:
+        """numpy-heltal lagras annars som BLOB i SQLite"""
+        return None if value is None or pd.isna(value) else int(value)
+    
+    @staticmethod
+    def _json_value(value):
+        """numpy-skalärer och datum i details som JSON-värden"""
+        return value.item() if isinstance(value, np.generic) else str(value)
+    
     def store_anomalies(self, anomalies: List[Dict]) -> int:
         """Lagra upptäckta anomalier i databas"""
         stored_count = 0
         
-        with sqlite3.connect(self.db_path) as conn:
+        with self.pool.connection() as conn:
             cursor = conn.cursor()
             
             for anomaly in anomalies:
                 try:
                     cursor.execute('''
                         INSERT OR REPLACE INTO anomalies 
-                        (procurement_id, anomaly_type, description, risk_score, detected_at)
-                        VALUES (?, ?, ?, ?, ?)
+                        (procurement_id, anomaly_type, description, risk_score, detected_at, details)
+                        VALUES (?, ?, ?, ?, ?, ?)
                     ''', (
-                        anomaly.get('procurement_id'),
+                        self._procurement_id(anomaly.get('procurement_id')),
                         anomaly['anomaly_type'],
                         anomaly['description'],
                         anomaly['risk_score'],
-                        anomaly['detected_at']
+                        anomaly['detected_at'],
+                        json.dumps(anomaly['details'], ensure_ascii=False, default=self._json_value)
+                        if anomaly.get('details') else None
                     ))
                     stored_count += 1
                 except Exception as e:
                     logger.error(f"Error storing anomaly: {e}")
                     continue
-            
-            conn.commit()
+            if stored_count:
+                conn.execute(BUMP_CACHE_GENERATION)
         
         logger.info(f"Stored {stored_count} anomalies in database")
         return stored_count
@@ -471,6 +547,9 @@ class AdvancedAnomalyDetector:
         # Lagra i databas
         stored_count = self.store_anomalies(all_anomalies)
         
+        # Utgångsläge för kommande inkrementella körningar
+        self.state.rebuild()
+        
         end_time = datetime.now()
         analysis_time = (end_time - start_time).total_seconds()
         
@@ -488,11 +567,141 @@ class AdvancedAnomalyDetector:
             'total_anomalies': len(all_anomalies),
             'stored_anomalies': stored_count,
             'anomaly_types': anomaly_summary,
+            'detector_timings': self.last_run_timings,
             'timestamp': end_time.isoformat()
         }
         
         logger.info(f"Anomaly analysis completed: {len(all_anomalies)} anomalies found in {analysis_time:.2f} seconds")
         return result
 
+    def run_incremental_analysis(self) -> Dict:
+        """
+        Analysera endast rader som tillkommit eller uppdaterats sedan senaste körning.
+        Sidotabellerna räknas om för de CPV-grupper, myndigheter och dagar som
+        berörs av dessa rader, och endast dessa grupper söks igenom.
+        """
+        logger.info("Starting incremental anomaly analysis")
+        
+        start_time = datetime.now()
+        mark = self.state.get_high_water_mark()
+        new_rows = self.state.load_new_rows(mark)
+        
+        all_anomalies = []
+        touched = {'cpv_groups': 0, 'authorities': 0, 'authority_days': 0}
+        
+        if not new_rows.empty:
+            cpv_groups = sorted(set(new_rows['cpv_codes'].dropna()) - {''})
+            authorities = sorted(set(new_rows['contracting_authority'].dropna()))
+            dated = new_rows.dropna(subset=['contracting_authority', 'award_date'])
+            authority_days = sorted(set(zip(dated['contracting_authority'], dated['award_date'])))
+            paired = new_rows.dropna(subset=['contracting_authority', 'winner_name'])
+            pairs = sorted(set(zip(paired['contracting_authority'], paired['winner_name'])))
+            touched = {
+                'cpv_groups': len(cpv_groups),
+                'authorities': len(authorities),
+                'authority_days': len(authority_days)
+            }
+            
+            with self.pool.connection():
+                self.state.refresh_cpv_group_stats(cpv_groups)
+                self.state.refresh_authority_winner_stats(authorities)
+                self.state.refresh_authority_day_stats(authority_days)
+            
+            all_anomalies.extend(self._incremental_price_anomalies(new_rows, cpv_groups))
+            all_anomalies.extend(self.detect_market_concentration(
+                self.load_context(authorities=authorities)
+            ))
+            all_anomalies.extend(self._incremental_time_clustering(authority_days))
+            all_anomalies.extend(self._incremental_network_anomalies(pairs))
+            
+            with self.pool.connection():
+                stored_count = self.store_anomalies(all_anomalies)
+                self.state.set_high_water_mark(self.state.mark_of(new_rows, mark))
+        else:
+            stored_count = 0
+        
+        end_time = datetime.now()
+        analysis_time = (end_time - start_time).total_seconds()
+        
+        anomaly_summary = {}
+        for anomaly in all_anomalies:
+            anomaly_summary[anomaly['anomaly_type']] = anomaly_summary.get(anomaly['anomaly_type'], 0) + 1
+        
+        result = {
+            'success': True,
+            'mode': 'incremental',
+            'analysis_time_seconds': analysis_time,
+            'new_rows': len(new_rows),
+            'touched_groups': touched,
+            'total_anomalies': len(all_anomalies),
+            'stored_anomalies': stored_count,
+            'anomaly_types': anomaly_summary,
+            'timestamp': end_time.isoformat()
+        }
+        
+        logger.info(f"Incremental analysis completed: {len(new_rows)} new rows, "
+                    f"{len(all_anomalies)} anomalies in {analysis_time:.2f} seconds")
+        return result
+    
+    def _incremental_price_anomalies(self, new_rows: pd.DataFrame, cpv_groups: List[str]) -> List[Dict]:
+        """Prisavvikelser bland nya rader mot lagrad gruppstatistik"""
+        anomalies = []
+        stats = self.state.cpv_stats_for(cpv_groups)
+        if stats.empty:
+            return anomalies
+        
+        df = new_rows[new_rows['value'] > 0].merge(stats, on='cpv_codes')
+        group_stats = df[['contract_count', 'mean_value', 'std_value', 'q1_value', 'q3_value']].rename(columns={
+            'contract_count': 'count', 'mean_value': 'mean', 'std_value': 'std',
+            'q1_value': 'q1', 'q3_value': 'q3'
+        }).astype('float64')
+        z = z_scores(df['value'], group_stats)
+        
+        flagged = ((group_stats['count'] >= 3)
+                   & iqr_or_z_outliers(df['value'], group_stats, z, iqr_factor=1.5, z_threshold=2.5)
+                   & (df['value'] > group_stats['mean'] * 1.5))
+        
+        anomalies.extend(self._price_anomalies_from(df[flagged], group_stats[flagged], z[flagged]))
+        
+        logger.info(f"Detected {len(anomalies)} incremental price anomalies")
+        return anomalies
+    
+    def _incremental_time_clustering(self, authority_days: List[Tuple[str, str]]) -> List[Dict]:
+        """Tidskluster för berörda (myndighet, dag) mot lagrad fördelning"""
+        anomalies = []
+        mean_contracts, std_contracts = self.state.day_count_distribution()
+        if not authority_days or not mean_contracts:
+            return anomalies
+        
+        threshold = mean_contracts + 2 * std_contracts  # 2 standardavvikelser
+        df = self.state.authority_day_stats_for(authority_days)
+        
+        for _, row in df.iterrows():
+            contracts_count = row['contract_count']
+            if contracts_count >= 3 and contracts_count > threshold and contracts_count >= 5:
+                anomalies.append(self._time_cluster_anomaly(
+                    row['award_date'], row['contracting_authority'], contracts_count,
+                    row['winners'], row['total_value'], mean_contracts
+                ))
+        
+        logger.info(f"Detected {len(anomalies)} incremental time clustering anomalies")
+        return anomalies
+    
+    def _incremental_network_anomalies(self, pairs: List[Tuple[str, str]]) -> List[Dict]:
+        """Nätverksanomalier för par som fått nya kontrakt"""
+        anomalies = []
+        if not pairs:
+            return anomalies
+        
+        df = self.state.authority_winner_stats_for(pairs)
+        for _, row in df[df['contract_count'] >= 10].iterrows():
+            anomalies.append(self._network_anomaly(
+                row['winner_name'], row['contracting_authority'], row['contract_count'],
+                row['total_value'], row['first_contract'], row['last_contract']
+            ))
+        
+        logger.info(f"Detected {len(anomalies)} incremental network anomalies")
+        return anomalies
+
 # Skapa global instans
 advanced_detector = AdvancedAnomalyDetector()
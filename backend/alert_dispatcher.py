@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Asynkron larmutskick till Slack/Discord för Nyhetsportalen
+Larm läggs i en intern kö och skickas av en arbetartråd, så att en webhook som
+hänger aldrig blockerar schemaläggaren. Larm inom samma fönster slås ihop till
+ett sammanfattningsmeddelande; misslyckade anrop görs om med exponentiell backoff.
+"""
+
+import os
+import time
+import queue
+import random
+import logging
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+ALERT_DIGEST_SECONDS = float(os.environ.get('ALERT_DIGEST_SECONDS', 60))
+ALERT_TIMEOUT_SECONDS = float(os.environ.get('ALERT_TIMEOUT_SECONDS', 10))
+ALERT_MAX_RETRIES = int(os.environ.get('ALERT_MAX_RETRIES', 4))
+ALERT_QUEUE_SIZE = int(os.environ.get('ALERT_QUEUE_SIZE', 1000))
+
+# Backoff: 1, 2, 4 ... sekunder (med jitter), högst BACKOFF_MAX_SECONDS
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+ALERT_PREFIX = '🚨 Nyhetsportalen Alert'
+
+# Fält för meddelandetexten och maxlängd per webhooktyp
+WEBHOOK_FORMATS = {
+    'slack': ('text', 4000),
+    'discord': ('content', 2000)
+}
+
+# Markerar att arbetaren ska skicka det som väntar och avsluta
+_STOP = object()
+
+
+def format_digest(messages: List[str], max_length: int) -> str:
+    """Ett meddelande för alla larm i fönstret; upprepade larm räknas i stället för att listas"""
+    counts = Counter(messages)
+    if len(counts) == 1:
+        message, count = next(iter(counts.items()))
+        text = f'{ALERT_PREFIX}: {message}' + (f' (×{count})' if count > 1 else '')
+        return text if len(text) <= max_length else text[:max_length - 1] + '…'
+
+    header = f'{ALERT_PREFIX}: {len(messages)} händelser'
+    lines = [header]
+    length = len(header)
+    for index, (message, count) in enumerate(counts.items()):
+        line = f'• {message}' + (f' (×{count})' if count > 1 else '')
+        remaining = len(counts) - index
+        more = f'… och {remaining} till'
+        if length + 1 + len(line) + 1 + len(more) > max_length:
+            lines.append(more)
+            break
+        lines.append(line)
+        length += 1 + len(line)
+    return '\n'.join(lines)
+
+
+class AlertDispatcher:
+    """Köad, sammanfattande larmutskick till en eller flera webhooks"""
+
+    def __init__(self, webhooks: Dict[str, str], digest_seconds: float = ALERT_DIGEST_SECONDS,
+                 timeout: float = ALERT_TIMEOUT_SECONDS, max_retries: int = ALERT_MAX_RETRIES,
+                 queue_size: int = ALERT_QUEUE_SIZE):
+        """webhooks: webhooktyp ('slack'/'discord') -> URL"""
+        unknown = set(webhooks) - set(WEBHOOK_FORMATS)
+        if unknown:
+            raise ValueError(f"Unknown webhook type(s): {', '.join(sorted(unknown))}")
+        self.webhooks = webhooks
+        self.digest_seconds = digest_seconds
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._stats = {'alerts_received': 0, 'alerts_dropped': 0, 'digests_sent': 0,
+                       'deliveries_failed': 0, 'retries': 0, 'last_error': None}
+
+    @classmethod
+    def from_env(cls) -> 'AlertDispatcher':
+        """Webhooks från SLACK_WEBHOOK_URL och DISCORD_WEBHOOK_URL"""
+        webhooks = {}
+        for kind in WEBHOOK_FORMATS:
+            url = os.getenv(f'{kind.upper()}_WEBHOOK_URL')
+            if url and url.startswith(('http://', 'https://')):
+                webhooks[kind] = url
+            elif url:
+                logger.warning(f"Ignoring {kind.upper()}_WEBHOOK_URL: not an http(s) URL")
+        return cls(webhooks)
+
+    def _count(self, name: str, value=1):
+        with self._lock:
+            self._stats[name] += value
+
+    def start(self):
+        """Starta arbetartråden (gör inget om den redan körs)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._worker, name='alert-dispatcher', daemon=True)
+            self._thread.start()
+
+    def send(self, message: str) -> bool:
+        """Lägg ett larm i kön utan att vänta; False om kön är full eller utskicket stoppat"""
+        if self._stopping.is_set():
+            logger.warning(f"Alert dispatcher stopped, dropping alert: {message}")
+            self._count('alerts_dropped')
+            return False
+        self.start()
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            logger.error(f"Alert queue full, dropping alert: {message}")
+            self._count('alerts_dropped')
+            return False
+        self._count('alerts_received')
+        return True
+
+    def stop(self, timeout: Optional[float] = None):
+        """Skicka väntande larm direkt och stoppa arbetaren"""
+        self._stopping.set()
+        thread = self._thread
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def _worker(self):
+        while True:
+            message = self._queue.get()
+            if message is _STOP:
+                return
+            # Fönstret räknas från första larmet; allt som kommer inom det skickas tillsammans
+            batch = [message]
+            deadline = time.monotonic() + self.digest_seconds
+            stopping = False
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    message = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if message is _STOP:
+                    stopping = True
+                    break
+                batch.append(message)
+            self._dispatch(batch)
+            if stopping:
+                return
+
+    def _dispatch(self, messages: List[str]):
+        if not self.webhooks:
+            logger.info(f"Alert (no webhook configured): {' | '.join(messages)}")
+            return
+        for kind, url in self.webhooks.items():
+            field, max_length = WEBHOOK_FORMATS[kind]
+            if self._deliver(kind, url, {field: format_digest(messages, max_length)}):
+                self._count('digests_sent')
+                logger.info(f"Alert digest with {len(messages)} alerts sent to {kind}")
+            else:
+                self._count('deliveries_failed')
+
+    def _deliver(self, kind: str, url: str, payload: Dict) -> bool:
+        """POST med timeout; nätverksfel, 408, 429 och 5xx görs om med backoff"""
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                response = self.session.post(url, json=payload, timeout=self.timeout)
+                if response.status_code < 300:
+                    return True
+                error = f"HTTP {response.status_code}"
+                if response.status_code < 500 and response.status_code not in (408, 429):
+                    # Fel i anropet blir inte bättre av att göras om
+                    self._record_error(kind, error)
+                    return False
+                retry_after = response.headers.get('Retry-After')
+            except requests.RequestException as e:
+                error = str(e)
+
+            self._record_error(kind, error)
+            if attempt == self.max_retries:
+                break
+            delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.0)
+            try:
+                delay = max(delay, min(BACKOFF_MAX_SECONDS, float(retry_after))) if retry_after else delay
+            except ValueError:
+                pass
+            self._count('retries')
+            # Vid avslut görs inga fler försök
+            if self._stopping.wait(delay):
+                break
+        logger.error(f"Giving up on {kind} alert after {attempt + 1} attempts")
+        return False
+
+    def _record_error(self, kind: str, error: str):
+        logger.warning(f"Alert delivery to {kind} failed: {error}")
+        with self._lock:
+            self._stats['last_error'] = f'{kind}: {error}'
+
+    def stats(self) -> Dict:
+        """Statistik för övervakning"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queued'] = self._queue.qsize()
+        stats['webhooks'] = sorted(self.webhooks)
+        stats['digest_seconds'] = self.digest_seconds
+        return stats
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Kontroll av larmutskicket mot en lokal stubbwebhook
+Stubben svarar per sökväg: /ok tar emot, /slow svarar först efter timeouten, /busy ger
+429 med Retry-After innan den tar emot, /down ger 503 innan den tar emot och /bad ger 400.
+Kontrollerar timeout, omförsök med backoff och Retry-After, sammanslagning till ett
+sammanfattningsmeddelande och att send inte väntar på en hängande webhook.
+
+Körs manuellt: python alert_stub.py
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SLOW_SECONDS = 2.0
+RETRY_AFTER_SECONDS = 2
+
+
+class StubWebhook(BaseHTTPRequestHandler):
+    """POST /<läge>; failures anger hur många anrop per sökväg som fallerar först"""
+    received = []
+    failures = {}
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.lock:
+            self.received.append((self.path, time.monotonic(), body))
+            failing = self.failures.get(self.path, 0) > 0
+            if failing:
+                self.failures[self.path] -= 1
+
+        if self.path == '/slow':
+            time.sleep(SLOW_SECONDS)
+            status = 200
+        elif self.path == '/bad':
+            status = 400
+        elif failing:
+            status = 429 if self.path == '/busy' else 503
+        else:
+            status = 200
+        self.send_response(status)
+        if status == 429:
+            self.send_header('Retry-After', str(RETRY_AFTER_SECONDS))
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def posts(path: str):
+    """(tid, innehåll) för anropen till en sökväg"""
+    with StubWebhook.lock:
+        return [(at, body) for seen, at, body in StubWebhook.received if seen == path]
+
+
+def check(name: str, ok: bool, detail=''):
+    print(f"{'PASS' if ok else 'FAIL'}  {name} {detail}")
+    return ok
+
+
+def main() -> int:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubWebhook)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from alert_dispatcher import AlertDispatcher, BACKOFF_BASE_SECONDS
+    results = []
+
+    # Timeout: ett försök mot /slow ger upp efter timeout, inte efter serverns svar
+    dispatcher = AlertDispatcher({'slack': f'{base}/slow'}, timeout=0.5, max_retries=0)
+    started = time.monotonic()
+    delivered = dispatcher._deliver('slack', f'{base}/slow', {'text': 'timeout'})
+    elapsed = time.monotonic() - started
+    results.append(check('gives up at timeout', not delivered and elapsed < SLOW_SECONDS, f'{elapsed:.2f}s'))
+
+    # Retry-After: andra försöket väntar minst så länge servern begärt
+    StubWebhook.failures['/busy'] = 1
+    dispatcher = AlertDispatcher({'discord': f'{base}/busy'}, max_retries=2)
+    delivered = dispatcher._deliver('discord', f'{base}/busy', {'content': 'retry-after'})
+    attempts = posts('/busy')
+    gap = attempts[1][0] - attempts[0][0] if len(attempts) == 2 else None
+    results.append(check('retries 429 after Retry-After',
+                         delivered and gap is not None and gap >= RETRY_AFTER_SECONDS - 0.1,
+                         f'{len(attempts)} attempts, gap {gap or 0:.2f}s'))
+
+    # Backoff: 503 görs om med växande väntan, sedan lyckas anropet
+    StubWebhook.failures['/down'] = 2
+    dispatcher = AlertDispatcher({'slack': f'{base}/down'}, max_retries=3)
+    delivered = dispatcher._deliver('slack', f'{base}/down', {'text': 'backoff'})
+    attempts = [at for at, _ in posts('/down')]
+    gaps = [later - earlier for earlier, later in zip(attempts, attempts[1:])]
+    results.append(check('retries 503 with backoff',
+                         delivered and len(attempts) == 3 and gaps[0] >= BACKOFF_BASE_SECONDS * 0.5 - 0.05
+                         and gaps[1] >= BACKOFF_BASE_SECONDS - 0.05,
+                         f"gaps {', '.join(f'{gap:.2f}' for gap in gaps)}s"))
+    retries = dispatcher.stats()['retries']
+    results.append(check('counts retries', retries == 2, retries))
+
+    # 400 görs inte om
+    delivered = dispatcher._deliver('slack', f'{base}/bad', {'text': 'bad request'})
+    results.append(check('no retry on 400', not delivered and len(posts('/bad')) == 1, len(posts('/bad'))))
+
+    # Sammanslagning: alla larm inom fönstret blir ett meddelande, upprepningar räknas
+    dispatcher = AlertDispatcher({'slack': f'{base}/ok'}, digest_seconds=0.5)
+    for message in ['Prisavvikelse A', 'Prisavvikelse A', 'Prisavvikelse A', 'Delad styrelse B', 'Ny vinnare C']:
+        dispatcher.send(message)
+    time.sleep(1.5)
+    digests = posts('/ok')
+    text = digests[0][1]['text'] if digests else ''
+    results.append(check('folds window into one digest',
+                         len(digests) == 1 and '5 händelser' in text and 'Prisavvikelse A (×3)' in text, text))
+    dispatcher.stop(5)
+
+    # send väntar inte på en hängande webhook, och en full kö släpper larm i stället för att blockera
+    dispatcher = AlertDispatcher({'slack': f'{base}/slow'}, digest_seconds=0, timeout=SLOW_SECONDS * 2,
+                                 max_retries=0, queue_size=3)
+    dispatcher.send('first')
+    time.sleep(0.2)
+    started = time.monotonic()
+    accepted = [dispatcher.send(f'alert {n}') for n in range(5)]
+    elapsed = time.monotonic() - started
+    results.append(check('send does not block', elapsed < 0.1, f'{elapsed * 1000:.1f} ms'))
+    results.append(check('full queue drops alerts', accepted == [True] * 3 + [False] * 2, accepted))
+    dispatcher.stop(0)
+
+    server.shutdown()
+    return 0 if all(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Delad analyskontext för Nyhetsportalens anomalidetektorer
+Läser upphandlingstabellen en gång med kompakta datatyper och delar den mellan detektorerna
+"""
+
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from db_pool import chunked, placeholders
+
+logger = logging.getLogger(__name__)
+
+# Kolumner som delas av alla detektorer; titeln behövs bara som längd
+PROCUREMENT_FRAME_SQL = '''
+    SELECT id, contracting_authority, winner_name, value, cpv_codes,
+           award_date, municipality, length(title) AS title_length
+    FROM procurements
+'''
+
+CATEGORICAL_COLUMNS = ['contracting_authority', 'winner_name', 'cpv_codes', 'municipality']
+
+# Ramens kolumner i samma ordning som PROCUREMENT_FRAME_SQL
+FRAME_COLUMNS = ['id', 'contracting_authority', 'winner_name', 'value', 'cpv_codes',
+                 'award_date', 'municipality', 'title_length']
+
+# Rader per läst chunk; håller toppminnet nära den kompakta ramens storlek
+LOAD_CHUNK_SIZE = 100000
+
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Konvertera en rå upphandlingsram till kompakta datatyper"""
+    df = df.copy()
+    df['id'] = df['id'].astype('int64')
+    for column in CATEGORICAL_COLUMNS:
+        df[column] = df[column].astype('category')
+    # float64: float32 kan inte återge belopp över ~16,7 MSEK exakt
+    df['value'] = pd.to_numeric(df['value'], errors='coerce').astype('float64')
+    df['award_date'] = pd.to_datetime(df['award_date'], errors='coerce', format='ISO8601')
+    df['title_length'] = pd.to_numeric(df['title_length'], errors='coerce').astype('float32')
+    return df
+
+
+def concat_compact(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """Slå ihop kompakta chunkar utan att kategorierna faller tillbaka till object"""
+    if len(frames) == 1:
+        return frames[0]
+    df = pd.concat(frames, ignore_index=True)
+    for column in CATEGORICAL_COLUMNS:
+        df[column] = union_categoricals([frame[column] for frame in frames])
+    return df
+
+
+class AnalysisContext:
+    """Upphandlingsdata inläst en gång för en hel analyskörning"""
+
+    def __init__(self, frame: pd.DataFrame, now: Optional[datetime] = None):
+        self.frame = frame
+        self.now = now or datetime.now()
+
+    @classmethod
+    def load(cls, pool, authorities: Optional[List[str]] = None) -> 'AnalysisContext':
+        """
+        Läs procurements i chunkar från en anslutningspool.
+        Med authorities läses endast de angivna myndigheternas rader.
+        """
+        if authorities is None:
+            queries = [(PROCUREMENT_FRAME_SQL, None)]
+        else:
+            queries = [(PROCUREMENT_FRAME_SQL + f' WHERE contracting_authority IN ({placeholders(batch)})', batch)
+                       for batch in chunked(authorities)]
+
+        frames = []
+        with pool.connection() as conn:
+            for sql, params in queries:
+                for chunk in pd.read_sql_query(sql, conn, params=params, chunksize=LOAD_CHUNK_SIZE):
+                    frames.append(compact_frame(chunk))
+
+        if frames:
+            frame = concat_compact(frames)
+        else:
+            frame = compact_frame(pd.DataFrame(columns=FRAME_COLUMNS))
+
+        context = cls(frame)
+        logger.info(f"Loaded analysis context: {len(frame)} rows, "
+                    f"{context.memory_bytes() / 1e6:.1f} MB")
+        return context
+
+    @classmethod
+    def from_snapshot(cls, snapshot, authorities: Optional[List[str]] = None) -> 'AnalysisContext':
+        """Läs samma ram från den kolumnära snapshoten (minnesmappade Arrow-filer)"""
+        frame = compact_frame(snapshot.load(columns=FRAME_COLUMNS, authorities=authorities))
+
+        context = cls(frame)
+        logger.info(f"Loaded analysis context from snapshot: {len(frame)} rows, "
+                    f"{context.memory_bytes() / 1e6:.1f} MB")
+        return context
+
+    @property
+    def today(self) -> pd.Timestamp:
+        """Dagens datum (utan klockslag), motsvarar SQLites date('now')"""
+        return pd.Timestamp(self.now).normalize()
+
+    def since(self, days: int) -> pd.DataFrame:
+        """Rader med award_date inom de senaste days dagarna"""
+        return self.frame[self.frame['award_date'] >= self.today - pd.Timedelta(days=days)]
+
+    def memory_bytes(self) -> int:
+        """Ramens minnesanvändning"""
+        return int(self.frame.memory_usage(deep=True).sum())
+
+
+def date_strings(dates: pd.Series) -> pd.Series:
+    """Datum som 'YYYY-MM-DD' (None för saknade)"""
+    return dates.dt.strftime('%Y-%m-%d').where(dates.notna(), None)
+
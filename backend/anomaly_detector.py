@@ -4,7 +4,6 @@ Anomalidetektering för verkliga upphandlingar
 Använder maskininlärning och statistisk analys
 """
 
-import sqlite3
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
@@ -12,6 +11,11 @@ from typing import List, Dict, Tuple
 import logging
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
+from db_pool import get_pool
+from migrations import apply_migrations, BUMP_CACHE_GENERATION
+from price_outliers import group_value_stats, sigma_outliers, group_order
+from concentration import buyer_concentration
+from timing_clusters import TIMING_WINDOWS, TIMING_WINDOW_NAMES, timing_clusters
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -22,6 +26,8 @@ class RealAnomalyDetector:
     
     def __init__(self, db_path: str = 'nyhetsportalen.db'):
         self.db_path = db_path
+        self.pool = get_pool(db_path)
+        apply_migrations(self.pool)
         self.scaler = StandardScaler()
         self.isolation_forest = IsolationForest(contamination=0.1, random_state=42)
         
@@ -36,7 +42,7 @@ class RealAnomalyDetector:
     def detect_price_anomalies(self) -> List[Dict]:
         """Upptäck prisanomalier i upphandlingar"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connection() as conn:
                 df = pd.read_sql_query('''
                     SELECT id, title, contracting_authority, winner_name, 
                            value, currency, award_date, municipality, cpv_codes
@@ -52,43 +58,40 @@ class RealAnomalyDetector:
             
             # Gruppera per CPV-kod (kategori)
             df['cpv_main'] = df['cpv_codes'].str.split(',').str[0]
+            df = df[df['cpv_main'].notna()]
             
-            for cpv_code in df['cpv_main'].unique():
-                if pd.isna(cpv_code):
-                    continue
-                
-                cpv_df = df[df['cpv_main'] == cpv_code].copy()
-                if len(cpv_df) < 5:  # Behöver minst 5 kontrakt för analys
-                    continue
-                
-                # Statistisk analys
-                mean_value = cpv_df['value'].mean()
-                std_value = cpv_df['value'].std()
+            # Statistik per kategori för varje rad; minst 5 kontrakt för analys
+            stats = group_value_stats(df, 'cpv_main', quantiles=False)
+            
+            # Hitta outliers (> 3 standardavvikelser)
+            flagged = (stats['count'] >= 5) & sigma_outliers(df['value'], stats, sigmas=3.0)
+            
+            order = group_order(df, 'cpv_main')
+            outliers = df.iloc[order][flagged.iloc[order]]
+            outlier_stats = stats.loc[outliers.index]
+            deviations = (outliers['value'] - outlier_stats['mean']).abs() / outlier_stats['std']
+            
+            for procurement_id, value, cpv_code, mean_value, standard_deviations in zip(
+                outliers['id'].tolist(), outliers['value'].tolist(), outliers['cpv_main'].tolist(),
+                outlier_stats['mean'].tolist(), deviations.tolist()
+            ):
+                anomaly_type = "Prisavvikelse"
+                risk_score = min(10, standard_deviations)
                 
-                # Hitta outliers (> 3 standardavvikelser)
-                outliers = cpv_df[
-                    (cpv_df['value'] > mean_value + 3 * std_value) |
-                    (cpv_df['value'] < mean_value - 3 * std_value)
-                ]
+                description = f"Kontraktsvärde {value:,.0f} SEK avviker från medel {mean_value:,.0f} SEK"
                 
-                for _, row in outliers.iterrows():
-                    anomaly_type = "Prisavvikelse"
-                    risk_score = min(10, abs(row['value'] - mean_value) / std_value)
-                    
-                    description = f"Kontraktsvärde {row['value']:,.0f} SEK avviker från medel {mean_value:,.0f} SEK"
-                    
-                    anomalies.append({
-                        'procurement_id': row['id'],
-                        'anomaly_type': anomaly_type,
-                        'description': description,
-                        'risk_score': risk_score,
-                        'details': {
-                            'contract_value': row['value'],
-                            'category_mean': mean_value,
-                            'standard_deviations': abs(row['value'] - mean_value) / std_value,
-                            'cpv_code': cpv_code
-                        }
-                    })
+                anomalies.append({
+                    'procurement_id': procurement_id,
+                    'anomaly_type': anomaly_type,
+                    'description': description,
+                    'risk_score': risk_score,
+                    'details': {
+                        'contract_value': value,
+                        'category_mean': mean_value,
+                        'standard_deviations': standard_deviations,
+                        'cpv_code': cpv_code
+                    }
+                })
             
             return anomalies
             
@@ -99,7 +102,7 @@ class RealAnomalyDetector:
     def detect_winner_concentration(self) -> List[Dict]:
         """Upptäck onormal koncentration av vinnare"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connection() as conn:
                 df = pd.read_sql_query('''
                     SELECT id, title, contracting_authority, winner_name, 
                            value, municipality, award_date
@@ -112,44 +115,40 @@ class RealAnomalyDetector:
             
             anomalies = []
             
-            # Analysera per kommun
-            for municipality in df['municipality'].unique():
-                muni_df = df[df['municipality'] == municipality].copy()
-                
-                if len(muni_df) < 10:  # Behöver minst 10 kontrakt
-                    continue
-                
-                # Beräkna marknadskoncentration
-                winner_counts = muni_df['winner_name'].value_counts()
-                total_contracts = len(muni_df)
-                
-                # Herfindahl-Hirschman Index (HHI)
-                hhi = sum((count / total_contracts) ** 2 for count in winner_counts) * 10000
-                
-                # HHI > 2500 indikerar hög koncentration
-                if hhi > 2500:
-                    top_winner = winner_counts.index[0]
-                    win_rate = winner_counts.iloc[0] / total_contracts
-                    
-                    # Kolla om det är ett känt stort företag (mindre misstänkt)
-                    if top_winner not in self.major_contractors and win_rate > 0.4:
-                        # Hämta kontrakt från denna vinnare
-                        winner_contracts = muni_df[muni_df['winner_name'] == top_winner]
-                        
-                        for _, contract in winner_contracts.iterrows():
-                            anomalies.append({
-                                'procurement_id': contract['id'],
-                                'anomaly_type': 'Marknadskoncentration',
-                                'description': f"{top_winner} vinner {win_rate:.1%} av kontrakt i {municipality}",
-                                'risk_score': min(10, (win_rate - 0.3) * 20),  # Risk ökar över 30%
-                                'details': {
-                                    'winner_name': top_winner,
-                                    'win_rate': win_rate,
-                                    'hhi_score': hhi,
-                                    'total_contracts': total_contracts,
-                                    'municipality': municipality
-                                }
-                            })
+            # HHI och största vinnare för alla kommuner i en gruppering
+            stats = buyer_concentration(df, 'municipality').set_index('buyer')
+            
+            # Minst 10 kontrakt; HHI > 2500 indikerar hög koncentration. Kända stora
+            # företag är mindre misstänkta, och vinnaren måste ta över 40 % av kontrakten
+            flagged = stats[(stats['contracts'] >= 10) & (stats['hhi'] > 2500)
+                            & ~stats['top_supplier'].isin(self.major_contractors)
+                            & (stats['top_share'] > 0.4)]
+            if flagged.empty:
+                return anomalies
+            
+            # Den dominerande vinnarens kontrakt, kommun för kommun i förekomstordning
+            order = group_order(df, 'municipality')
+            ordered = df.iloc[order]
+            top_winner = ordered['municipality'].map(flagged['top_supplier'])
+            winner_contracts = ordered[top_winner.notna() & (ordered['winner_name'] == top_winner)]
+            
+            for procurement_id, municipality in zip(winner_contracts['id'].tolist(),
+                                                    winner_contracts['municipality'].tolist()):
+                row = flagged.loc[municipality]
+                win_rate = row['top_share']
+                anomalies.append({
+                    'procurement_id': procurement_id,
+                    'anomaly_type': 'Marknadskoncentration',
+                    'description': f"{row['top_supplier']} vinner {win_rate:.1%} av kontrakt i {municipality}",
+                    'risk_score': min(10, (win_rate - 0.3) * 20),  # Risk ökar över 30%
+                    'details': {
+                        'winner_name': row['top_supplier'],
+                        'win_rate': win_rate,
+                        'hhi_score': row['hhi'],
+                        'total_contracts': int(row['contracts']),
+                        'municipality': municipality
+                    }
+                })
             
             return anomalies
             
@@ -158,12 +157,11 @@ class RealAnomalyDetector:
             return []
     
     def detect_timing_anomalies(self) -> List[Dict]:
-        """Upptäck misstänkta tidsmönster"""
+        """Upptäck misstänkta tidsmönster (fönster enligt TIMING_WINDOWS)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connection() as conn:
                 df = pd.read_sql_query('''
-                    SELECT id, title, contracting_authority, winner_name, 
-                           value, award_date, municipality
+                    SELECT id, contracting_authority, winner_name, award_date
                     FROM procurements 
                     WHERE award_date >= date('now', '-1 year')
                 ''', conn)
@@ -171,37 +169,32 @@ class RealAnomalyDetector:
             if df.empty:
                 return []
             
-            df['award_date'] = pd.to_datetime(df['award_date'])
-            df['month'] = df['award_date'].dt.month
-            df['day_of_week'] = df['award_date'].dt.dayofweek
-            
             anomalies = []
+            ids = df['id'].tolist()
             
-            # Kolla efter kluster av kontrakt samma dag
-            date_counts = df['award_date'].dt.date.value_counts()
-            suspicious_dates = date_counts[date_counts > 5]  # Fler än 5 kontrakt samma dag
-            
-            for date, count in suspicious_dates.items():
-                contracts_on_date = df[df['award_date'].dt.date == date]
-                
-                # Extra misstänkt om samma vinnare eller myndighet
-                winner_concentration = contracts_on_date['winner_name'].value_counts()
-                authority_concentration = contracts_on_date['contracting_authority'].value_counts()
-                
-                if winner_concentration.iloc[0] > 2 or authority_concentration.iloc[0] > 3:
-                    for _, contract in contracts_on_date.iterrows():
-                        anomalies.append({
-                            'procurement_id': contract['id'],
-                            'anomaly_type': 'Tidskluster',
-                            'description': f"{count} kontrakt tilldelade samma dag ({date})",
-                            'risk_score': min(10, count * 1.5),
-                            'details': {
-                                'award_date': str(date),
-                                'contracts_same_day': count,
-                                'same_winner_count': winner_concentration.get(contract['winner_name'], 0),
-                                'same_authority_count': authority_concentration.get(contract['contracting_authority'], 0)
-                            }
-                        })
+            # Kluster av kontrakt inom samma dag/vecka, extra misstänkt om samma vinnare eller myndighet
+            for name in TIMING_WINDOW_NAMES:
+                window = TIMING_WINDOWS[name]
+                clusters = timing_clusters(df, window['days'], window['contracts'],
+                                           window['same_winner'], window['same_authority'])
+                if clusters.empty:
+                    continue
+                for position, start, count, same_winner, same_authority in zip(
+                        clusters['position'].tolist(), clusters['period_start'].dt.date.tolist(),
+                        clusters['contracts'].tolist(), clusters['same_winner'].tolist(),
+                        clusters['same_authority'].tolist()):
+                    anomalies.append({
+                        'procurement_id': ids[position],
+                        'anomaly_type': 'Tidskluster',
+                        'description': f"{count} kontrakt tilldelade {window['label']} ({start})",
+                        'risk_score': min(10, count * 1.5 / window['days']),
+                        'details': {
+                            window['date_key']: str(start),
+                            window['count_key']: count,
+                            'same_winner_count': same_winner,
+                            'same_authority_count': same_authority
+                        }
+                    })
             
             return anomalies
             
@@ -214,7 +207,7 @@ class RealAnomalyDetector:
         try:
             anomalies = []
             
-            with sqlite3.connect(self.db_path) as conn:
+            with self.pool.connection() as conn:
                 # Hämta företagsinformation för att bedöma storlek
                 df = pd.read_sql_query('''
                     SELECT p.id, p.title, p.contracting_authority, p.winner_name, 
@@ -278,7 +271,7 @@ class RealAnomalyDetector:
         
         # Lagra i databas
         stored_count = 0
-        with sqlite3.connect(self.db_path) as conn:
+        with self.pool.connection() as conn:
             cursor = conn.cursor()
             
             for anomaly in all_anomalies:
@@ -297,6 +290,8 @@ class RealAnomalyDetector:
                 except Exception as e:
                     logger.error(f"Error storing anomaly: {e}")
                     continue
+            if stored_count:
+                conn.execute(BUMP_CACHE_GENERATION)
             
             conn.commit()
         
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Ändringsflöde för Nyhetsportalens anomalier
+Varje ny eller ändrad anomali får ett monotont sekvensnummer (seq, migrering 5).
+Konsumenter läser bara rader efter sin senaste position i stället för hela tabellen,
+och kan spara positionen i feed_cursors mellan körningar.
+"""
+
+import os
+import json
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from migrations import apply_migrations
+
+logger = logging.getLogger(__name__)
+
+
+def decode_details(rows: List[Dict]) -> List[Dict]:
+    """Detektorernas details (lagrat som JSON) som objekt i API-svaren"""
+    for row in rows:
+        if row.get('details'):
+            row['details'] = json.loads(row['details'])
+    return rows
+
+FEED_PAGE_SIZE = int(os.environ.get('FEED_PAGE_SIZE', 500))
+
+# En upprepad detektion har samma procurement, typ och beskrivning som en tidigare rad
+# (punktuppslag i idx_anomalies_repeat)
+REPEAT_CONDITION = '''
+    EXISTS (SELECT 1 FROM anomalies e
+            WHERE e.procurement_id IS a.procurement_id AND e.anomaly_type = a.anomaly_type
+              AND e.description IS a.description AND e.seq < a.seq)
+'''
+
+
+def changes_query(since: int, head: int, limit: int, min_risk: Optional[float] = None,
+                  repeats: bool = True) -> Tuple[str, List]:
+    """SQL för flödessidan efter since upp till head (även plan_check.py)"""
+    where, params = ['a.seq > ?', 'a.seq <= ?'], [since, head]
+    if min_risk is not None:
+        where.append('a.risk_score > ?')
+        params.append(min_risk)
+    if not repeats:
+        where.append(f'NOT {REPEAT_CONDITION}')
+    return f'''
+        SELECT a.*, p.title, p.contracting_authority, p.winner_name, p.value
+        FROM anomalies a
+        LEFT JOIN procurements p ON a.procurement_id = p.id
+        WHERE {' AND '.join(where)}
+        ORDER BY a.seq LIMIT ?
+    ''', [*params, limit]
+
+
+class AnomalyFeed:
+    """Läser anomalier i sekvensordning och håller konsumenters läsposition"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        apply_migrations(pool)
+
+    def latest_seq(self) -> int:
+        """Högsta sekvensnummer i flödet (0 om tomt)"""
+        with self.pool.connection() as conn:
+            return conn.execute('SELECT COALESCE(MAX(seq), 0) FROM anomalies').fetchone()[0]
+
+    def changes(self, since: int = 0, limit: int = FEED_PAGE_SIZE, min_risk: Optional[float] = None,
+                repeats: bool = True) -> Dict:
+        """
+        Anomalier med seq > since i sekvensordning. next_since är positionen att fortsätta
+        från; när has_more är falskt pekar den på flödets slut även om filter uteslutit rader.
+        Med repeats=False utelämnas detektioner som redan finns tidigare i flödet.
+        """
+        with self.pool.connection() as conn:
+            head = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM anomalies').fetchone()[0]
+            cursor = conn.execute(*changes_query(since, head, limit, min_risk, repeats))
+            columns = [description[0] for description in cursor.description]
+            rows = decode_details([dict(zip(columns, row)) for row in cursor.fetchall()])
+
+        has_more = len(rows) == limit
+        return {
+            'changes': rows,
+            'since': since,
+            'next_since': rows[-1]['seq'] if has_more else max(since, head),
+            'has_more': has_more
+        }
+
+    def read_all(self, since: int = 0, **filters) -> Dict:
+        """Alla ändringar efter since, hämtade sida för sida, och positionen efter dem"""
+        rows = []
+        while True:
+            page = self.changes(since, **filters)
+            rows.extend(page['changes'])
+            since = page['next_since']
+            if not page['has_more']:
+                return {'changes': rows, 'next_since': since}
+
+    def position(self, name: str) -> Optional[int]:
+        """Sparad läsposition för en konsument, None om den aldrig läst"""
+        with self.pool.connection() as conn:
+            row = conn.execute('SELECT seq FROM feed_cursors WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def advance(self, name: str, seq: int):
+        """Spara konsumentens läsposition"""
+        with self.pool.connection() as conn:
+            conn.execute('''
+                INSERT INTO feed_cursors (name, seq, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(name) DO UPDATE SET seq = excluded.seq, updated_at = CURRENT_TIMESTAMP
+            ''', (name, seq))
+
+    def stats(self) -> Dict:
+        """Flödets position och konsumenternas eftersläpning"""
+        head = self.latest_seq()
+        with self.pool.connection() as conn:
+            cursors = conn.execute('SELECT name, seq, updated_at FROM feed_cursors ORDER BY name').fetchall()
+        return {
+            'latest_seq': head,
+            'consumers': {name: {'seq': seq, 'behind': head - seq, 'updated_at': updated_at}
+                          for name, seq, updated_at in cursors}
+        }
@@ -4,17 +4,33 @@ Nyhetsportalen Backend - Produktionsversion
 Riktiga datakällor för svensk offentlig sektor övervakning
 """
 
-from flask import Flask, jsonify, request, render_template
+from flask import Flask, Response, jsonify, request, render_template
+from flask.helpers import get_debug_flag
 from flask_cors import CORS
 import requests
-import sqlite3
 import os
 import random  # Lägg till denna import!
 from datetime import datetime, timedelta
 import logging
 from dataclasses import dataclass
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterable, Iterator, Tuple
+from itertools import islice
 import json
+from db_pool import get_pool, all_pool_stats
+from ted_harvester import TEDHarvester
+from fetch_engine import fetch_engine
+from response_cache import response_cache
+from migrations import apply_migrations, BUMP_CACHE_GENERATION
+from pagination import keyset_query, decode_cursor, page_cursor, paginated_response
+from company_cache import CompanyCache, clean_org_nr, format_org_nr
+from company_enrichment import CompanyEnrichment
+from person_index import PersonIndex, PERSON_WINS_LIMIT, PERSON_MATCH_LIMIT
+from job_queue import JobQueue
+from anomaly_feed import AnomalyFeed, FEED_PAGE_SIZE, decode_details
+from concentration import ConcentrationEngine, CONCENTRATION_WINDOWS
+from supplier_graph import SupplierGraph, NODE_ORDER, EDGE_ORDER
+from procurement_snapshot import get_snapshot, default_snapshot_dir, snapshot_enabled
+from export_stream import EXPORT_DATASETS, EXPORT_FORMATS, export_query, iter_batches, ndjson_stream, csv_stream
 
 # Konfiguration
 app = Flask(__name__)
@@ -24,6 +40,11 @@ CORS(app)
 TED_API_KEY = os.environ.get('TED_API_KEY', '')
 BOLAGSVERKET_API_KEY = os.environ.get('BOLAGSVERKET_API_KEY', '')
 
+# Bas-URL kan pekas om, t.ex. mot en lokal stubbserver vid test
+TED_API_URL = os.environ.get('TED_API_URL', 'https://ted.europa.eu/api/v3.0')
+TED_PAGE_SIZE = 100
+TED_SLICE_DAYS = 7  # Datumskivor som hämtas parallellt
+
 # Utveckling vs Produktion
 IS_PRODUCTION = os.environ.get('FLASK_ENV') == 'production'
 
@@ -37,6 +58,41 @@ logger = logging.getLogger(__name__)
 # Databas
 DATABASE = 'nyhetsportalen.db'
 
+# Antal kontrakt per transaktion vid bulkimport
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', 1000))
+
+INSERT_PROCUREMENT_SQL = '''
+    INSERT INTO procurements
+    (ted_id, title, contracting_authority, winner_name, winner_org_nr,
+     value, currency, award_date, municipality, cpv_codes, source)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Uppdatera bara om något faktiskt ändrats, så att rowcount räknar verkliga uppdateringar
+UPSERT_PROCUREMENT_SQL = INSERT_PROCUREMENT_SQL + '''
+    ON CONFLICT(ted_id) DO UPDATE SET
+        title = excluded.title,
+        contracting_authority = excluded.contracting_authority,
+        winner_name = excluded.winner_name,
+        winner_org_nr = excluded.winner_org_nr,
+        value = excluded.value,
+        currency = excluded.currency,
+        award_date = excluded.award_date,
+        municipality = excluded.municipality,
+        cpv_codes = excluded.cpv_codes,
+        source = excluded.source
+    WHERE title IS NOT excluded.title
+       OR contracting_authority IS NOT excluded.contracting_authority
+       OR winner_name IS NOT excluded.winner_name
+       OR winner_org_nr IS NOT excluded.winner_org_nr
+       OR value IS NOT excluded.value
+       OR currency IS NOT excluded.currency
+       OR award_date IS NOT excluded.award_date
+       OR municipality IS NOT excluded.municipality
+       OR cpv_codes IS NOT excluded.cpv_codes
+       OR source IS NOT excluded.source
+'''
+
 @dataclass
 class ProcurementContract:
     """Upphandlingskontrakt från riktiga källor"""
@@ -55,7 +111,7 @@ class RealDataCollector:
     """Samlar riktig data från svenska offentliga källor"""
     
     def __init__(self):
-        self.ted_base_url = "https://ted.europa.eu/api/v3.0"
+        self.ted_base_url = TED_API_URL
         self.bolagsverket_url = "https://data.bolagsverket.se/api"
         self.session = requests.Session()
         
@@ -71,6 +127,50 @@ class RealDataCollector:
             })
             logger.warning("TED_API_KEY not set - using public access")
     
+    def _ted_params(self, start_date: datetime, end_date: datetime, page: int) -> Dict:
+        """Sökparametrar för en sida av TED-notiser"""
+        return {
+            'country': 'SE',  # Sverige
+            'publication-date-from': start_date.strftime('%Y-%m-%d'),
+            'publication-date-to': end_date.strftime('%Y-%m-%d'),
+            'document-type': 'contract-award',  # Tilldelade kontrakt
+            'scope': 3,  # EU-omfattning
+            'page': page,
+            'page-size': TED_PAGE_SIZE,
+            'format': 'json'
+        }
+    
+    def iter_ted_pages(self, start_date: datetime, end_date: datetime,
+                       start_page: int = 1) -> Iterator[Tuple[int, List[Dict]]]:
+        """
+        Generator över alla TED-sidor i ett datumintervall.
+        Ger (sidnummer, kontrakt) per sida; HTTP-fel kastas vidare.
+        """
+        page = start_page
+        while True:
+            response = fetch_engine.get(self.session, f"{self.ted_base_url}/notices",
+                                        params=self._ted_params(start_date, end_date, page),
+                                        timeout=30)
+            response.raise_for_status()
+            
+            results = response.json().get('results', [])
+            if not results:
+                return
+            
+            yield page, self.parse_ted_contracts(results)
+            
+            # En ofullständig sida är den sista
+            if len(results) < TED_PAGE_SIZE:
+                return
+            page += 1
+    
+    def fetch_ted_window(self, start_date: datetime, end_date: datetime) -> List[Dict]:
+        """Hämta alla sidor för ett datumintervall"""
+        contracts = []
+        for _, page_contracts in self.iter_ted_pages(start_date, end_date):
+            contracts.extend(page_contracts)
+        return contracts
+    
     def get_swedish_procurements(self, days_back: int = 30) -> List[Dict]:
         """Hämta svenska upphandlingar från TED (Tenders Electronic Daily)"""
         try:
@@ -78,36 +178,34 @@ class RealDataCollector:
             end_date = datetime.now()
             start_date = end_date - timedelta(days=days_back)
             
-            # Realistiska parametrar för TED API
-            params = {
-                'country': 'SE',  # Sverige
-                'publication-date-from': start_date.strftime('%Y-%m-%d'),
-                'publication-date-to': end_date.strftime('%Y-%m-%d'),
-                'document-type': 'contract-award',  # Tilldelade kontrakt
-                'scope': 3,  # EU-omfattning
-                'page-size': 100,
-                'format': 'json'
-            }
-            
             # Om vi inte har API-nyckel, använd fallback metod
             if not TED_API_KEY:
                 logger.info("Using fallback procurement data generation")
                 return self.generate_realistic_fallback_data(days_back)
             
-            response = self.session.get(f"{self.ted_base_url}/notices", params=params, timeout=30)
+            # Datumskivor hämtas parallellt, sidorna inom en skiva i ordning
+            slices = []
+            slice_from = start_date
+            while slice_from <= end_date:
+                slice_to = min(slice_from + timedelta(days=TED_SLICE_DAYS - 1), end_date)
+                slices.append((slice_from, slice_to))
+                slice_from = slice_to + timedelta(days=1)
             
-            if response.status_code == 200:
-                data = response.json()
-                contracts = self.parse_ted_contracts(data.get('results', []))
-                logger.info(f"Fetched {len(contracts)} contracts from TED API")
-                return contracts
-            elif response.status_code == 401:
+            contracts = []
+            for result in fetch_engine.map(lambda window: self.fetch_ted_window(*window), slices):
+                if isinstance(result, Exception):
+                    raise result
+                contracts.extend(result)
+            
+            logger.info(f"Fetched {len(contracts)} contracts from TED API")
+            return contracts
+                
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 401:
                 logger.error("TED API authentication failed - check API key")
-                return self.generate_realistic_fallback_data(days_back)
             else:
-                logger.error(f"TED API error: {response.status_code}")
-                return self.generate_realistic_fallback_data(days_back)
-                
+                logger.error(f"TED API error: {e}")
+            return self.generate_realistic_fallback_data(days_back)
         except Exception as e:
             logger.error(f"Error fetching TED data: {e}")
             return self.generate_realistic_fallback_data(days_back)
@@ -286,9 +384,10 @@ class RealDataCollector:
 class CompanyDataCollector:
     """Samlar företagsdata från Bolagsverket och andra källor"""
     
-    def __init__(self):
+    def __init__(self, cache: Optional[CompanyCache] = None):
         self.base_url = "https://data.bolagsverket.se/api/v1"
         self.session = requests.Session()
+        self.cache = cache
         
         # Sätt API-nyckel om tillgänglig
         if BOLAGSVERKET_API_KEY:
@@ -302,30 +401,53 @@ class CompanyDataCollector:
             })
             logger.warning("BOLAGSVERKET_API_KEY not set - using public access")
     
+    def fetch_company(self, org_nr: str) -> Optional[Tuple[Dict, List[Dict]]]:
+        """Hämta företag och styrelse från Bolagsverket; None om företaget inte finns"""
+        clean = clean_org_nr(org_nr)
+        response = fetch_engine.get(self.session, f"{self.base_url}/company/{clean}", timeout=15)
+        if response.status_code == 404:
+            return None
+        if response.status_code == 401:
+            logger.error("Bolagsverket API authentication failed")
+        response.raise_for_status()
+        company = response.json()
+        
+        response = fetch_engine.get(self.session, f"{self.base_url}/company/{clean}/board", timeout=15)
+        if response.status_code == 404:
+            return company, []
+        response.raise_for_status()
+        return company, response.json().get('board_members', [])
+    
     def get_company_info(self, org_nr: str) -> Dict:
-        """Hämta företagsinformation från Bolagsverket"""
+        """Hämta företagsinformation via cachen (LRU, databas, Bolagsverket)"""
+        clean = clean_org_nr(org_nr)
         try:
-            # Normalisera organisationsnummer
-            clean_org_nr = org_nr.replace('-', '').replace(' ', '')
-            
-            # Om vi inte har API-nyckel, använd fallback
-            if not BOLAGSVERKET_API_KEY:
-                return self.generate_company_fallback(clean_org_nr)
-            
-            response = self.session.get(f"{self.base_url}/company/{clean_org_nr}", timeout=15)
-            
-            if response.status_code == 200:
-                return response.json()
-            elif response.status_code == 401:
-                logger.error("Bolagsverket API authentication failed")
-                return self.generate_company_fallback(clean_org_nr)
+            # Utan API-nyckel används bara redan sparade företag
+            fetch = self.fetch_company if BOLAGSVERKET_API_KEY else None
+            if self.cache is not None:
+                company = self.cache.get(format_org_nr(org_nr), fetch)
+            elif fetch:
+                result = fetch(org_nr)
+                company = dict(result[0], board_members=result[1]) if result else None
             else:
+                company = None
+            
+            if company:
+                return company
+            if fetch:
                 logger.warning(f"Company not found in Bolagsverket: {org_nr}")
-                return self.generate_company_fallback(clean_org_nr)
+            return self.generate_company_fallback(clean)
                 
         except Exception as e:
             logger.error(f"Error fetching company data: {e}")
-            return self.generate_company_fallback(clean_org_nr)
+            return self.generate_company_fallback(clean)
+    
+    def get_companies_info(self, org_nrs: Iterable[str]) -> Dict[str, Dict]:
+        """Hämta flera företag parallellt inom Bolagsverkets hastighetsgränser"""
+        org_nrs = list(dict.fromkeys(org_nrs))
+        results = fetch_engine.map(self.get_company_info, org_nrs)
+        return {org_nr: info for org_nr, info in zip(org_nrs, results)
+                if not isinstance(info, Exception)}
     
     def generate_company_fallback(self, org_nr: str) -> Dict:
         """Generera fallback företagsdata"""
@@ -377,7 +499,7 @@ class CompanyDataCollector:
         """Hämta styrelseledamöter"""
         try:
             clean_org_nr = org_nr.replace('-', '').replace(' ', '')
-            response = self.session.get(f"{self.base_url}/company/{clean_org_nr}/board")
+            response = fetch_engine.get(self.session, f"{self.base_url}/company/{clean_org_nr}/board", timeout=15)
             
             if response.status_code == 200:
                 return response.json().get('board_members', [])
@@ -392,11 +514,18 @@ class DatabaseManager:
     
     def __init__(self, db_path: str = DATABASE):
         self.db_path = db_path
+        self.pool = get_pool(db_path)
         self.init_database()
+        self.concentration = ConcentrationEngine(self.pool)
+        self.supplier_graph = SupplierGraph(self.pool)
+    
+    def connection(self):
+        """Låna en poolad anslutning (context manager)"""
+        return self.pool.connection()
     
     def init_database(self):
         """Skapa databasschema"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self.connection() as conn:
             cursor = conn.cursor()
             
             # Upphandlingar
@@ -459,38 +588,191 @@ class DatabaseManager:
                 )
             ''')
             
+            # Återupptagbara skördemarkörer (TED-backfill m.m.)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS harvest_cursors (
+                    name TEXT PRIMARY KEY,
+                    window_from TEXT NOT NULL,
+                    window_to TEXT NOT NULL,
+                    slice_from TEXT NOT NULL,
+                    next_page INTEGER NOT NULL DEFAULT 1,
+                    contracts_seen INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL DEFAULT 'running',
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
             conn.commit()
+        
+        # Index och schemaändringar
+        apply_migrations(self.pool)
+    
+    @staticmethod
+    def _procurement_row(contract: Dict) -> tuple:
+        """Kontrakt som parametertupel i kolumnordningen för INSERT_PROCUREMENT_SQL"""
+        return (
+            contract.get('ted_id'),
+            contract.get('title'),
+            contract.get('contracting_authority'),
+            contract.get('winner_name'),
+            format_org_nr(contract['winner_org_nr']) if contract.get('winner_org_nr') else None,
+            contract.get('value'),
+            contract.get('currency', 'SEK'),
+            contract.get('award_date'),
+            contract.get('municipality'),
+            ','.join(contract.get('cpv_codes', [])),
+            contract.get('source', 'TED')
+        )
     
     def store_procurement(self, contract: Dict) -> int:
-        """Lagra upphandling i databas"""
-        with sqlite3.connect(self.db_path) as conn:
+        """Lagra upphandling i databas; befintligt ted_id uppdateras på plats (id behålls)"""
+        with self.connection() as conn:
             cursor = conn.cursor()
             
-            cursor.execute('''
-                INSERT OR REPLACE INTO procurements 
-                (ted_id, title, contracting_authority, winner_name, winner_org_nr, 
-                 value, currency, award_date, municipality, cpv_codes, source)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                contract.get('ted_id'),
-                contract.get('title'),
-                contract.get('contracting_authority'),
-                contract.get('winner_name'),
-                contract.get('winner_org_nr'),
-                contract.get('value'),
-                contract.get('currency', 'SEK'),
-                contract.get('award_date'),
-                contract.get('municipality'),
-                ','.join(contract.get('cpv_codes', [])),
-                contract.get('source', 'TED')
-            ))
-            
-            return cursor.lastrowid
+            # UPSERT i stället för REPLACE: en ersatt rad skulle annars tas bort utan att
+            # DELETE-triggers (snapshot, leverantörsgraf) körs
+            cursor.execute(UPSERT_PROCUREMENT_SQL, self._procurement_row(contract))
+            if cursor.rowcount:
+                conn.execute(BUMP_CACHE_GENERATION)
+            
+            if not contract.get('ted_id'):
+                return cursor.lastrowid
+            return conn.execute('SELECT id FROM procurements WHERE ted_id = ?',
+                                (contract['ted_id'],)).fetchone()[0]
+    
+    def store_procurements(self, contracts: Iterable[Dict], chunk_size: int = BULK_CHUNK_SIZE) -> Dict:
+        """
+        Lagra många upphandlingar med executemany, en transaktion per chunk.
+        Befintliga ted_id uppdateras på plats (id behålls) och oförändrade
+        eller ogiltiga rader hoppas över.
+        """
+        totals = {'inserted': 0, 'updated': 0, 'skipped': 0, 'chunks': []}
+        contracts = iter(contracts)
+        
+        while True:
+            chunk = list(islice(contracts, chunk_size))
+            if not chunk:
+                break
+            
+            # Ogiltiga rader och dubbletter inom chunken (sista vinner)
+            keyed, unkeyed, skipped = {}, [], 0
+            for contract in chunk:
+                if not contract or not contract.get('title'):
+                    skipped += 1
+                elif contract.get('ted_id'):
+                    if contract['ted_id'] in keyed:
+                        skipped += 1
+                    keyed[contract['ted_id']] = self._procurement_row(contract)
+                else:
+                    unkeyed.append(self._procurement_row(contract))
+            
+            with self.connection() as conn:
+                existing = set()
+                ted_ids = list(keyed)
+                # Håll oss under SQLites gräns för antal parametrar
+                for start in range(0, len(ted_ids), 500):
+                    batch = ted_ids[start:start + 500]
+                    rows = conn.execute(
+                        f"SELECT ted_id FROM procurements WHERE ted_id IN ({','.join('?' * len(batch))})",
+                        batch
+                    ).fetchall()
+                    existing.update(row[0] for row in rows)
+                
+                # rowcount räknar, till skillnad från total_changes, inte rader som triggers skriver
+                changed = conn.executemany(UPSERT_PROCUREMENT_SQL, keyed.values()).rowcount
+                changed += conn.executemany(INSERT_PROCUREMENT_SQL, unkeyed).rowcount
+                # Svarscachen blir inaktuell en gång per chunk, inte per rad
+                if changed:
+                    conn.execute(BUMP_CACHE_GENERATION)
+            
+            inserted = len(keyed) - len(existing) + len(unkeyed)
+            updated = changed - inserted
+            skipped += len(existing) - updated
+            
+            totals['chunks'].append({'inserted': inserted, 'updated': updated, 'skipped': skipped})
+            totals['inserted'] += inserted
+            totals['updated'] += updated
+            totals['skipped'] += skipped
+        
+        logger.info(f"Bulk stored procurements: {totals['inserted']} inserted, "
+                    f"{totals['updated']} updated, {totals['skipped']} skipped "
+                    f"in {len(totals['chunks'])} chunks")
+        return totals
+    
+    def refresh_snapshot(self) -> Optional[Dict]:
+        """Skriv om snapshot-partitioner för månader som ändrats vid import"""
+        if not snapshot_enabled():
+            return None
+        try:
+            return get_snapshot(self.pool, default_snapshot_dir(self.db_path)).refresh()
+        except Exception as e:
+            logger.error(f"Error refreshing procurement snapshot: {e}")
+            return None
+    
+    def refresh_concentration(self) -> Optional[Dict]:
+        """Räkna om marknadskoncentration för köpare som fått nya kontrakt"""
+        try:
+            return self.concentration.refresh()
+        except Exception as e:
+            logger.error(f"Error refreshing market concentration: {e}")
+            return None
+    
+    def refresh_supplier_graph(self):
+        """Be grafens bakgrundstråd läsa in nya kontrakt; importen väntar inte på den"""
+        self.supplier_graph.request_refresh()
+    
+    def get_harvest_cursor(self, name: str) -> Optional[Dict]:
+        """Hämta sparad skördemarkör"""
+        with self.connection() as conn:
+            cursor = conn.execute('SELECT * FROM harvest_cursors WHERE name = ?', (name,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            columns = [description[0] for description in cursor.description]
+            return dict(zip(columns, row))
+    
+    def save_harvest_cursor(self, name: str, window_from: str, window_to: str, slice_from: str,
+                            next_page: int, contracts_seen: int, status: str = 'running'):
+        """Spara skördemarkör (körs i anroparens transaktion om en sådan finns)"""
+        with self.connection() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO harvest_cursors
+                (name, window_from, window_to, slice_from, next_page, contracts_seen, status, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (name, window_from, window_to, slice_from, next_page, contracts_seen, status))
 
 # Globala instanser
 data_collector = RealDataCollector()
-company_collector = CompanyDataCollector()
 db_manager = DatabaseManager()
+response_cache.bind(db_manager.pool)
+company_collector = CompanyDataCollector(CompanyCache(db_manager.pool))
+company_enrichment = CompanyEnrichment(db_manager.pool, company_collector.cache, company_collector.fetch_company)
+anomaly_feed = AnomalyFeed(db_manager.pool)
+person_index = PersonIndex(db_manager.pool)
+ted_harvester = TEDHarvester(data_collector, db_manager)
+
+# Persistent jobbkö; webbprocessen kör sina egna jobb (berikning), scheduler.py resten
+job_queue = JobQueue(db_manager.pool)
+
+def enrich_companies_job(payload: Dict) -> Dict:
+    """Berika upphandlingsvinnare med företagsdata, med förlopp per batch"""
+    return company_enrichment.run(limit=payload.get('limit'), progress=job_queue.reporter())
+
+job_queue.register('enrich_companies', enrich_companies_job)
+
+def start_job_workers():
+    """
+    Starta köns arbetare vid uppstart, så att berikningsjobb körs även utan scheduler.py.
+    Reloaderns övervakningsprocess (python app.py i debugläge, flask run --debug) tar inga
+    förfrågningar och startar inga arbetare; det gör barnprocessen den startar (WERKZEUG_RUN_MAIN).
+    """
+    reloader_parent = os.environ.get('WERKZEUG_RUN_MAIN') != 'true' and (
+        (__name__ == '__main__' and not IS_PRODUCTION) or
+        (os.environ.get('FLASK_RUN_FROM_CLI') == 'true' and get_debug_flag()))
+    if not reloader_parent:
+        job_queue.start()
+
+start_job_workers()
 
 # Importera avancerad anomalidetektor
 try:
@@ -512,68 +794,95 @@ def index():
         'endpoints': [
             '/api/procurements',
             '/api/companies/<org_nr>',
+            '/api/people',
             '/api/update-data',
-            '/api/anomalies'
+            '/api/harvest',
+            '/api/enrich-companies',
+            '/api/anomalies',
+            '/api/anomalies/changes',
+            '/api/concentration',
+            '/api/network',
+            '/api/network/nodes',
+            '/api/network/edges',
+            '/api/export/<dataset>',
+            '/api/db-stats',
+            '/api/fetch-stats',
+            '/api/cache-stats',
+            '/api/snapshot-stats',
+            '/api/company-cache-stats',
+            '/api/job-stats',
+            '/api/feed-stats',
+            '/api/ml-models'
         ]
     })
 
+def procurement_page_query(municipality: Optional[str], cursor_key: Optional[List],
+                           limit: int) -> Tuple[str, List]:
+    """SQL för en sida upphandlingar, nyast först (även plan_check.py)"""
+    where, params = (['municipality = ?'], [municipality]) if municipality else ([], [])
+    return keyset_query('SELECT * FROM procurements', where, params,
+                        ['award_date', 'id'], cursor_key, limit, nullable_first=True)
+
+def anomaly_page_query(anomaly_type: Optional[str], cursor_key: Optional[List],
+                       limit: int) -> Tuple[str, List]:
+    """SQL för en sida anomalier, senaste och högst risk först (även plan_check.py)"""
+    where, params = (['a.anomaly_type = ?'], [anomaly_type]) if anomaly_type else ([], [])
+    return keyset_query('''
+        SELECT a.*, p.title, p.contracting_authority, p.winner_name, p.value
+        FROM anomalies a
+        LEFT JOIN procurements p ON a.procurement_id = p.id
+    ''', where, params, ['a.detected_at', 'COALESCE(a.risk_score, 0)', 'a.id'], cursor_key, limit)
+
+# Frågorna bakom /api/anomaly-stats
+ANOMALY_STATS_SQL = {
+    'total': 'SELECT COUNT(*) FROM anomalies',
+    'types': '''
+        SELECT anomaly_type, COUNT(*) as count, AVG(risk_score) as avg_risk
+        FROM anomalies 
+        GROUP BY anomaly_type
+        ORDER BY count DESC
+    ''',
+    'recent': '''
+        SELECT COUNT(*) FROM anomalies 
+        WHERE detected_at >= date('now', '-30 days')
+    ''',
+    'high_risk': '''
+        SELECT COUNT(*) FROM anomalies 
+        WHERE risk_score > 7
+    ''',
+    'last': '''
+        SELECT detected_at FROM anomalies 
+        ORDER BY detected_at DESC LIMIT 1
+    '''
+}
+
 @app.route('/api/procurements')
+@response_cache.cached
 def get_procurements():
-    """Hämta upphandlingar"""
+    """Hämta upphandlingar (nyast först, sidor via cursor)"""
     limit = request.args.get('limit', 50, type=int)
     municipality = request.args.get('municipality')
     
-    with sqlite3.connect(DATABASE) as conn:
+    try:
+        cursor_key = decode_cursor(page_cursor(), 2) if page_cursor() else None
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    sql, params = procurement_page_query(municipality, cursor_key, limit)
+    
+    with db_manager.connection() as conn:
         cursor = conn.cursor()
-        
-        if municipality:
-            cursor.execute('''
-                SELECT * FROM procurements 
-                WHERE municipality = ? 
-                ORDER BY award_date DESC 
-                LIMIT ?
-            ''', (municipality, limit))
-        else:
-            cursor.execute('''
-                SELECT * FROM procurements 
-                ORDER BY award_date DESC 
-                LIMIT ?
-            ''', (limit,))
+        cursor.execute(sql, params)
         
         columns = [description[0] for description in cursor.description]
         results = [dict(zip(columns, row)) for row in cursor.fetchall()]
         
-        return jsonify(results)
+        return paginated_response(results, ['award_date', 'id'], limit)
 
 @app.route('/api/companies/<org_nr>')
 def get_company(org_nr):
-    """Hämta företagsinformation"""
+    """Hämta företagsinformation (cache, databas, sedan Bolagsverket)"""
     try:
-        # Först kolla i vår databas
-        with sqlite3.connect(DATABASE) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT * FROM companies WHERE org_nr = ?
-            ''', (org_nr,))
-            
-            result = cursor.fetchone()
-            
-            if result:
-                columns = [description[0] for description in cursor.description]
-                company_data = dict(zip(columns, result))
-                
-                # Hämta styrelseledamöter
-                cursor.execute('''
-                    SELECT * FROM board_members WHERE company_org_nr = ?
-                ''', (org_nr,))
-                
-                board_columns = [description[0] for description in cursor.description]
-                board_members = [dict(zip(board_columns, row)) for row in cursor.fetchall()]
-                
-                company_data['board_members'] = board_members
-                return jsonify(company_data)
-        
-        # Om inte i databas, hämta från Bolagsverket
         company_info = company_collector.get_company_info(org_nr)
         if company_info:
             return jsonify(company_info)
@@ -584,7 +893,23 @@ def get_company(org_nr):
         logger.error(f"Error fetching company {org_nr}: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/people')
+def get_people():
+    """Alla företag, roller och upphandlingsvinster kopplade till en person (namn, personnummer eller nyckel)"""
+    wins_limit = min(request.args.get('wins_limit', PERSON_WINS_LIMIT, type=int), 500)
+    match_limit = min(request.args.get('limit', PERSON_MATCH_LIMIT, type=int), 100)
+    try:
+        people = person_index.lookup(name=request.args.get('name'),
+                                     personal_nr=request.args.get('personal_nr'),
+                                     key=request.args.get('key'), wins_limit=wins_limit,
+                                     match_limit=match_limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({'count': len(people), 'people': people})
+
 @app.route('/api/update-data', methods=['POST'])
+@response_cache.invalidates
 def update_data():
     """Uppdatera data från externa källor"""
     try:
@@ -595,21 +920,22 @@ def update_data():
         # Hämta nya upphandlingar
         contracts = data_collector.get_swedish_procurements(days_back)
         
-        stored_count = 0
-        for contract in contracts:
-            try:
-                db_manager.store_procurement(contract)
-                stored_count += 1
-            except Exception as e:
-                logger.error(f"Error storing contract: {e}")
-                continue
+        ingest = db_manager.store_procurements(contracts)
+        stored_count = ingest['inserted'] + ingest['updated']
         
         logger.info(f"Stored {stored_count} new contracts")
+        db_manager.refresh_snapshot()
+        db_manager.refresh_concentration()
+        db_manager.refresh_supplier_graph()
         
         return jsonify({
             'status': 'success',
             'contracts_found': len(contracts),
             'contracts_stored': stored_count,
+            'contracts_inserted': ingest['inserted'],
+            'contracts_updated': ingest['updated'],
+            'contracts_skipped': ingest['skipped'],
+            'chunks': ingest['chunks'],
             'timestamp': datetime.now().isoformat()
         })
         
@@ -617,39 +943,140 @@ def update_data():
         logger.error(f"Error updating data: {e}")
         return jsonify({'error': 'Update failed'}), 500
 
+def _positive_int(value) -> bool:
+    """Heltal större än noll från JSON (bool räknas inte som heltal)"""
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+@app.route('/api/harvest', methods=['POST'])
+@response_cache.invalidates
+def harvest_data():
+    """Skörda alla TED-sidor för ett datumintervall (återupptagbart)"""
+    params = request.get_json(silent=True) or {}
+    if not isinstance(params, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    days_back, max_pages, resume = params.get('days_back', 30), params.get('max_pages'), params.get('resume', True)
+    if not _positive_int(days_back) or not (max_pages is None or _positive_int(max_pages)) \
+            or not isinstance(resume, bool):
+        return jsonify({'error': 'days_back and max_pages must be positive integers, resume a boolean'}), 400
+    
+    try:
+        end_date = datetime.strptime(params['to'], '%Y-%m-%d') if params.get('to') else datetime.now()
+        if params.get('from'):
+            start_date = datetime.strptime(params['from'], '%Y-%m-%d')
+        else:
+            start_date = end_date - timedelta(days=days_back)
+        if start_date > end_date:
+            raise ValueError("'from' is after 'to'")
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': 'Invalid date', 'details': str(e)}), 400
+    
+    try:
+        logger.info(f"Starting TED harvest {start_date:%Y-%m-%d} - {end_date:%Y-%m-%d}")
+        result = ted_harvester.harvest(start_date, end_date, resume=resume, max_pages=max_pages)
+        db_manager.refresh_snapshot()
+        db_manager.refresh_concentration()
+        db_manager.refresh_supplier_graph()
+        return jsonify(result)
+        
+    except Exception as e:
+        logger.error(f"Error harvesting TED data: {e}")
+        return jsonify({'error': 'Harvest failed', 'details': str(e)}), 500
+
+@app.route('/api/enrich-companies', methods=['GET', 'POST'])
+def enrich_companies():
+    """
+    Lägg batchberikning av upphandlingsvinnare i jobbkön (POST) eller visa backlogg
+    och senaste jobbet (GET). Ett jobb som redan väntar eller körs återanvänds.
+    """
+    try:
+        if request.method == 'GET':
+            jobs = job_queue.recent(1, name='enrich_companies')
+            status = dict(company_enrichment.status(), job=jobs[0] if jobs else None,
+                          workers_alive=job_queue.workers_alive())
+            if not status['workers_alive']:
+                status['warning'] = 'No job worker is running; queued enrichment jobs will not start'
+            return jsonify(status)
+        
+        if not BOLAGSVERKET_API_KEY:
+            return jsonify({'error': 'BOLAGSVERKET_API_KEY not set'}), 503
+        params = request.get_json(silent=True) or {}
+        limit = params.get('limit') if isinstance(params, dict) else None
+        if limit is not None and not _positive_int(limit):
+            return jsonify({'error': 'limit must be a positive integer'}), 400
+        job_id, coalesced = job_queue.submit('enrich_companies', {'limit': limit})
+        return jsonify({
+            'status': 'queued',
+            'job_id': job_id,
+            'coalesced': coalesced,
+            'backlog': company_enrichment.backlog_size(),
+            'workers_alive': job_queue.workers_alive()
+        }), 202
+        
+    except Exception as e:
+        logger.error(f"Error starting company enrichment: {e}")
+        return jsonify({'error': 'Enrichment failed', 'details': str(e)}), 500
+
 @app.route('/api/anomalies')
+@response_cache.cached
 def get_anomalies():
-    """Hämta upptäckta anomalier"""
+    """Hämta upptäckta anomalier (senaste och högst risk först, sidor via cursor)"""
     limit = request.args.get('limit', 100, type=int)
     anomaly_type = request.args.get('type')
     
-    with sqlite3.connect(DATABASE) as conn:
+    try:
+        cursor_key = decode_cursor(page_cursor(), 3) if page_cursor() else None
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    if cursor_key is not None and cursor_key[1] is None:
+        # Anomalier utan riskpoäng sorteras som 0, annars faller de bort ur radjämförelsen
+        cursor_key[1] = 0
+    
+    sql, params = anomaly_page_query(anomaly_type, cursor_key, limit)
+    
+    with db_manager.connection() as conn:
         cursor = conn.cursor()
-        
-        if anomaly_type:
-            cursor.execute('''
-                SELECT a.*, p.title, p.contracting_authority, p.winner_name, p.value
-                FROM anomalies a
-                LEFT JOIN procurements p ON a.procurement_id = p.id
-                WHERE a.anomaly_type = ?
-                ORDER BY a.detected_at DESC, a.risk_score DESC
-                LIMIT ?
-            ''', (anomaly_type, limit))
-        else:
-            cursor.execute('''
-                SELECT a.*, p.title, p.contracting_authority, p.winner_name, p.value
-                FROM anomalies a
-                LEFT JOIN procurements p ON a.procurement_id = p.id
-                ORDER BY a.detected_at DESC, a.risk_score DESC
-                LIMIT ?
-            ''', (limit,))
+        cursor.execute(sql, params)
         
         columns = [description[0] for description in cursor.description]
-        results = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        results = decode_details([dict(zip(columns, row)) for row in cursor.fetchall()])
         
-        return jsonify(results)
+        return paginated_response(results, ['detected_at', 'risk_score', 'id'], limit)
+
+@app.route('/api/anomalies/changes')
+def get_anomaly_changes():
+    """Nya och ändrade anomalier efter sekvensnummer since, i sekvensordning"""
+    since = request.args.get('since', 0, type=int)
+    limit = min(request.args.get('limit', FEED_PAGE_SIZE, type=int), FEED_PAGE_SIZE)
+    min_risk = request.args.get('min_risk', type=float)
+    repeats = request.args.get('repeats', 'true').lower() in ('1', 'true', 'yes')
+    
+    try:
+        return jsonify(anomaly_feed.changes(since, limit, min_risk=min_risk, repeats=repeats))
+    except Exception as e:
+        logger.error(f"Error reading anomaly changes: {e}")
+        return jsonify({'error': 'Change feed failed', 'details': str(e)}), 500
+
+@app.route('/api/export/<dataset>')
+def export_data(dataset):
+    """Strömmande export av hela tabellen (?format=ndjson eller csv)"""
+    export_format = request.args.get('format', 'ndjson')
+    if dataset not in EXPORT_DATASETS or export_format not in EXPORT_FORMATS:
+        return jsonify({
+            'error': 'Unknown dataset or format',
+            'datasets': list(EXPORT_DATASETS),
+            'formats': list(EXPORT_FORMATS)
+        }), 400
+    
+    sql, params = export_query(dataset, request.args)
+    batches = iter_batches(db_manager.pool, sql, params)
+    stream = ndjson_stream(batches) if export_format == 'ndjson' else csv_stream(batches)
+    filename = f"{dataset}-{datetime.now():%Y%m%d}.{export_format}"
+    
+    return Response(stream, mimetype=EXPORT_FORMATS[export_format],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 @app.route('/api/run-analysis', methods=['POST'])
+@response_cache.invalidates
 def run_advanced_analysis():
     """Kör avancerad anomalianalys"""
     try:
@@ -659,8 +1086,14 @@ def run_advanced_analysis():
                 'message': 'Missing required ML libraries (scikit-learn, pandas, numpy)'
             }), 503
         
-        logger.info("Starting advanced anomaly analysis")
-        result = advanced_detector.run_full_analysis()
+        incremental = (request.get_json(silent=True) or {}).get('incremental', False)
+        
+        if incremental:
+            logger.info("Starting incremental anomaly analysis")
+            result = advanced_detector.run_incremental_analysis()
+        else:
+            logger.info("Starting advanced anomaly analysis")
+            result = advanced_detector.run_full_analysis()
         
         return jsonify(result)
         
@@ -668,45 +1101,112 @@ def run_advanced_analysis():
         logger.error(f"Error running advanced analysis: {e}")
         return jsonify({'error': 'Analysis failed', 'details': str(e)}), 500
 
+@app.route('/api/concentration')
+@response_cache.cached
+def get_concentration():
+    """Mest koncentrerade köpare (HHI, toppandelar) per fönster, med trend mellan fönstren"""
+    scope = request.args.get('scope', 'authority')
+    window = request.args.get('window', 365, type=int)
+    limit = request.args.get('limit', 50, type=int)
+    min_contracts = request.args.get('min_contracts', 10, type=int)
+    order_by = request.args.get('sort', 'hhi')
+    
+    try:
+        results = db_manager.concentration.top(scope, window, limit, min_contracts, order_by)
+    except ValueError as e:
+        return jsonify({'error': str(e), 'scopes': ['authority', 'municipality'],
+                        'windows': list(CONCENTRATION_WINDOWS), 'sort': ['hhi', 'value_hhi', 'top_share']}), 400
+    
+    return jsonify({'scope': scope, 'window_days': window, 'results': results})
+
+def network_graph():
+    """
+    Myndighet–leverantörsgrafen som den är just nu. Den byggs och hålls aktuell av en
+    bakgrundstråd (startas vid första läsningen); None tills första bygget är klart.
+    """
+    graph = db_manager.supplier_graph
+    graph.start()
+    return graph if graph.ready else None
+
+def graph_building():
+    return jsonify({'status': 'building', 'message': 'Supplier graph is being built'}), 503, {'Retry-After': '5'}
+
+def frame_records(df) -> List[Dict]:
+    """DataFrame som JSON-poster (NaN blir null)"""
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+@app.route('/api/network')
+def get_network():
+    """Myndighet–leverantörsgrafens storlek och största sammanhängande komponenter"""
+    limit = request.args.get('limit', 10, type=int)
+    graph = network_graph()
+    if graph is None:
+        return graph_building()
+    return jsonify(graph.summary(limit))
+
+@app.route('/api/network/nodes')
+def get_network_nodes():
+    """Grad och koncentration per myndighet eller leverantör"""
+    side = request.args.get('side', 'authority')
+    order_by = request.args.get('sort', 'contracts')
+    limit = min(request.args.get('limit', 50, type=int), 1000)
+    min_contracts = request.args.get('min_contracts', 1, type=int)
+    
+    graph = network_graph()
+    if graph is None:
+        return graph_building()
+    try:
+        df = graph.nodes_frame(side, min_contracts, order_by, limit)
+    except ValueError as e:
+        return jsonify({'error': str(e), 'sides': ['authority', 'supplier'], 'sort': list(NODE_ORDER)}), 400
+    
+    return jsonify({'side': side, 'results': frame_records(df)})
+
+@app.route('/api/network/edges')
+def get_network_edges():
+    """Kopplingar med beroendegrad, valfritt för en myndighet och/eller leverantör"""
+    authority = request.args.get('authority')
+    supplier = request.args.get('supplier')
+    order_by = request.args.get('sort', 'contracts')
+    limit = min(request.args.get('limit', 50, type=int), 1000)
+    min_contracts = request.args.get('min_contracts', 1, type=int)
+    
+    graph = network_graph()
+    if graph is None:
+        return graph_building()
+    try:
+        df = graph.edges_frame(authority, supplier, min_contracts, order_by, limit)
+    except ValueError as e:
+        return jsonify({'error': str(e), 'sort': list(EDGE_ORDER)}), 400
+    
+    return jsonify({'authority': authority, 'supplier': supplier, 'results': frame_records(df)})
+
 @app.route('/api/anomaly-stats')
+@response_cache.cached
 def get_anomaly_stats():
     """Hämta statistik över anomalier"""
     try:
-        with sqlite3.connect(DATABASE) as conn:
+        with db_manager.connection() as conn:
             cursor = conn.cursor()
             
             # Totalt antal anomalier
-            cursor.execute('SELECT COUNT(*) FROM anomalies')
+            cursor.execute(ANOMALY_STATS_SQL['total'])
             total_anomalies = cursor.fetchone()[0]
             
             # Anomalier per typ
-            cursor.execute('''
-                SELECT anomaly_type, COUNT(*) as count, AVG(risk_score) as avg_risk
-                FROM anomalies 
-                GROUP BY anomaly_type
-                ORDER BY count DESC
-            ''')
+            cursor.execute(ANOMALY_STATS_SQL['types'])
             types_data = cursor.fetchall()
             
             # Anomalier senaste 30 dagarna
-            cursor.execute('''
-                SELECT COUNT(*) FROM anomalies 
-                WHERE detected_at >= date('now', '-30 days')
-            ''')
+            cursor.execute(ANOMALY_STATS_SQL['recent'])
             recent_anomalies = cursor.fetchone()[0]
             
             # Högriskanomálier (risk_score > 7)
-            cursor.execute('''
-                SELECT COUNT(*) FROM anomalies 
-                WHERE risk_score > 7
-            ''')
+            cursor.execute(ANOMALY_STATS_SQL['high_risk'])
             high_risk_anomalies = cursor.fetchone()[0]
             
             # Senaste analys
-            cursor.execute('''
-                SELECT detected_at FROM anomalies 
-                ORDER BY detected_at DESC LIMIT 1
-            ''')
+            cursor.execute(ANOMALY_STATS_SQL['last'])
             last_analysis = cursor.fetchone()
             last_analysis_date = last_analysis[0] if last_analysis else None
             
@@ -729,6 +1229,50 @@ def get_anomaly_stats():
         logger.error(f"Error getting anomaly stats: {e}")
         return jsonify({'error': 'Failed to get stats'}), 500
 
+@app.route('/api/db-stats')
+def get_db_stats():
+    """Statistik för databasanslutningspooler"""
+    return jsonify(all_pool_stats())
+
+@app.route('/api/fetch-stats')
+def get_fetch_stats():
+    """Statistik för den parallella hämtmotorn"""
+    return jsonify(fetch_engine.stats())
+
+@app.route('/api/cache-stats')
+def get_cache_stats():
+    """Statistik för svarscachen"""
+    return jsonify(response_cache.stats())
+
+@app.route('/api/snapshot-stats')
+def get_snapshot_stats():
+    """Status för den kolumnära upphandlingssnapshoten"""
+    if not snapshot_enabled():
+        return jsonify({'error': 'Snapshot not available'}), 503
+    return jsonify(get_snapshot(db_manager.pool, default_snapshot_dir(db_manager.db_path)).stats())
+
+@app.route('/api/company-cache-stats')
+def get_company_cache_stats():
+    """Statistik för företagscachen och personindexet"""
+    return jsonify(dict(company_collector.cache.stats(), person_index=person_index.stats()))
+
+@app.route('/api/job-stats')
+def get_job_stats():
+    """Kö och latens för jobbkön (körs i webbprocessen och scheduler.py)"""
+    return jsonify(job_queue.stats())
+
+@app.route('/api/feed-stats')
+def get_feed_stats():
+    """Anomaliflödets position och konsumenternas eftersläpning"""
+    return jsonify(anomaly_feed.stats())
+
+@app.route('/api/ml-models')
+def get_ml_models():
+    """Metadata för sparade ML-modeller"""
+    if not ADVANCED_ANOMALY_DETECTION:
+        return jsonify({'error': 'Advanced anomaly detection not available'}), 503
+    return jsonify(advanced_detector.model_store.stats())
+
 if __name__ == '__main__':
     # Produktionsmiljö med automatisk port detection
     port = int(os.environ.get('PORT', 5000))
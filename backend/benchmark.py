@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Prestandamätning för Nyhetsportalens anomalidetektering
+Jämför de tidigare looparna (per CPV-grupp och per misstänkt datum) med den
+vektoriserade prisavvikelsemotorn och tidsklustringen på en syntetisk upphandlingstabell.
+
+Körs manuellt: python benchmark.py --rows 1000000
+"""
+
+import argparse
+import time
+from typing import Callable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from price_outliers import group_value_stats, z_scores, iqr_or_z_outliers, sigma_outliers, group_order
+from timing_clusters import timing_clusters
+
+
+def synthetic_procurements(rows: int, groups: int = 400, seed: int = 42, days: int = 365) -> pd.DataFrame:
+    """
+    Syntetisk tabell med lognormalfördelade kontraktsvärden per CPV-grupp,
+    tilldelningsdatum över days dagar samt vinnare och myndigheter
+    """
+    rng = np.random.default_rng(seed)
+    cpv = rng.integers(0, groups, rows)
+    scale = rng.uniform(11, 17, groups)[cpv]
+    winners = rng.zipf(1.6, rows) % max(rows // 20, 1)
+    authorities = rng.integers(0, max(rows // 200, 1), rows)
+    return pd.DataFrame({
+        'id': np.arange(1, rows + 1, dtype='int64'),
+        'cpv_codes': pd.Categorical(np.char.add('CPV', cpv.astype(str))),
+        'value': np.round(rng.lognormal(scale, 1.2)).astype('float64'),
+        'award_date': np.datetime64('2025-01-01') + rng.integers(0, days, rows).astype('timedelta64[D]'),
+        'winner_name': np.char.add('Leverantör ', winners.astype(str)),
+        'contracting_authority': np.char.add('Myndighet ', authorities.astype(str))
+    })
+
+
+def legacy_advanced(df: pd.DataFrame) -> List[int]:
+    """Tidigare AdvancedAnomalyDetector.detect_price_anomalies (loop + iterrows)"""
+    flagged = []
+    for cpv_group in df['cpv_codes'].unique():
+        group_data = df[df['cpv_codes'] == cpv_group]
+        if len(group_data) < 3:
+            continue
+        values = group_data['value']
+        mean_val = values.mean()
+        std_val = values.std()
+        q1 = values.quantile(0.25)
+        q3 = values.quantile(0.75)
+        iqr = q3 - q1
+        upper_bound = q3 + 1.5 * iqr
+        lower_bound = q1 - 1.5 * iqr
+        for _, row in group_data.iterrows():
+            value = row['value']
+            z_score = abs(value - mean_val) / std_val if std_val > 0 else 0
+            is_outlier = (value > upper_bound or value < lower_bound) or z_score > 2.5
+            if is_outlier and value > mean_val * 1.5:
+                flagged.append(int(row['id']))
+    return flagged
+
+
+def vectorized_advanced(df: pd.DataFrame) -> List[int]:
+    """Vektoriserad motsvarighet"""
+    stats = group_value_stats(df, 'cpv_codes')
+    z = z_scores(df['value'], stats)
+    flagged = ((stats['count'] >= 3)
+               & iqr_or_z_outliers(df['value'], stats, z, iqr_factor=1.5, z_threshold=2.5)
+               & (df['value'] > stats['mean'] * 1.5))
+    order = group_order(df, 'cpv_codes')
+    return df['id'].iloc[order][flagged.iloc[order]].tolist()
+
+
+def legacy_real(df: pd.DataFrame) -> List[int]:
+    """Tidigare RealAnomalyDetector.detect_price_anomalies (loop + iterrows)"""
+    flagged = []
+    for cpv_code in df['cpv_codes'].unique():
+        cpv_df = df[df['cpv_codes'] == cpv_code].copy()
+        if len(cpv_df) < 5:
+            continue
+        mean_value = cpv_df['value'].mean()
+        std_value = cpv_df['value'].std()
+        outliers = cpv_df[
+            (cpv_df['value'] > mean_value + 3 * std_value) |
+            (cpv_df['value'] < mean_value - 3 * std_value)
+        ]
+        for _, row in outliers.iterrows():
+            flagged.append(int(row['id']))
+    return flagged
+
+
+def vectorized_real(df: pd.DataFrame) -> List[int]:
+    """Vektoriserad motsvarighet"""
+    stats = group_value_stats(df, 'cpv_codes', quantiles=False)
+    flagged = (stats['count'] >= 5) & sigma_outliers(df['value'], stats, sigmas=3.0)
+    order = group_order(df, 'cpv_codes')
+    return df['id'].iloc[order][flagged.iloc[order]].tolist()
+
+
+def legacy_timing(df: pd.DataFrame) -> List[int]:
+    """Tidigare RealAnomalyDetector.detect_timing_anomalies (filter per misstänkt datum + iterrows)"""
+    flagged = []
+    date_counts = df['award_date'].dt.date.value_counts()
+    suspicious_dates = date_counts[date_counts > 5]
+    for date, count in suspicious_dates.items():
+        contracts_on_date = df[df['award_date'].dt.date == date]
+        winner_concentration = contracts_on_date['winner_name'].value_counts()
+        authority_concentration = contracts_on_date['contracting_authority'].value_counts()
+        if winner_concentration.iloc[0] > 2 or authority_concentration.iloc[0] > 3:
+            for _, contract in contracts_on_date.iterrows():
+                flagged.append(int(contract['id']))
+    return flagged
+
+
+def vectorized_timing(df: pd.DataFrame) -> List[int]:
+    """En sortering och ett svep över datumen"""
+    clusters = timing_clusters(df, days=1)
+    return df['id'].iloc[clusters['position']].tolist()
+
+
+def timed(fn: Callable, *args) -> Tuple[float, object]:
+    """Kör fn och returnera (sekunder, resultat)"""
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def compare(name: str, legacy: Callable, vectorized: Callable, df: pd.DataFrame, skip_legacy: bool):
+    """Mät båda varianterna och kontrollera att de flaggar samma rader"""
+    vectorized_time, vectorized_ids = timed(vectorized, df)
+    if skip_legacy:
+        print(f"{name:<28} vectorized {vectorized_time:8.2f}s  ({len(vectorized_ids)} flagged)")
+        return
+    legacy_time, legacy_ids = timed(legacy, df)
+    status = 'identical' if legacy_ids == vectorized_ids else 'MISMATCH'
+    print(f"{name:<28} legacy {legacy_time:8.2f}s  vectorized {vectorized_time:6.2f}s  "
+          f"speedup {legacy_time / vectorized_time:6.1f}x  ({len(vectorized_ids)} flagged, {status})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark för anomalidetektering')
+    parser.add_argument('--rows', type=int, default=1000000, help='Antal syntetiska kontrakt')
+    parser.add_argument('--groups', type=int, default=400, help='Antal CPV-grupper')
+    parser.add_argument('--days', type=int, default=365, help='Antal dagar som tilldelningarna sprids över')
+    parser.add_argument('--skip-legacy', action='store_true', help='Mät endast den vektoriserade motorn')
+    args = parser.parse_args()
+
+    df = synthetic_procurements(args.rows, args.groups, days=args.days)
+    print(f"Synthetic table: {len(df)} rows, {args.groups} CPV groups, {args.days} days")
+
+    compare('advanced (IQR + z-score)', legacy_advanced, vectorized_advanced, df, args.skip_legacy)
+    compare('real (3 sigma)', legacy_real, vectorized_real, df, args.skip_legacy)
+    compare('timing (same day)', legacy_timing, vectorized_timing, df, args.skip_legacy)
+
+
+if __name__ == '__main__':
+    main()
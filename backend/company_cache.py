@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Företagscache för Bolagsverket-uppslag i Nyhetsportalen
+Två nivåer: LRU i processen och genomskrivning till companies/board_members.
+Poster har TTL, företag som inte finns (404) cachas negativt och samtidiga
+uppslag av samma organisationsnummer delar på ett enda anrop uppströms.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+from migrations import apply_migrations
+from person_index import index_company
+
+logger = logging.getLogger(__name__)
+
+COMPANY_CACHE_TTL_SECONDS = float(os.environ.get('COMPANY_CACHE_TTL_HOURS', 24 * 7)) * 3600
+COMPANY_NEGATIVE_TTL_SECONDS = float(os.environ.get('COMPANY_NEGATIVE_TTL_HOURS', 24)) * 3600
+COMPANY_CACHE_MAX_ENTRIES = int(os.environ.get('COMPANY_CACHE_MAX_ENTRIES', 10000))
+
+# Uppströmsfunktion: (företag, styrelse) eller None om företaget inte finns
+CompanyFetch = Callable[[str], Optional[Tuple[Dict, List[Dict]]]]
+
+COMPANY_COLUMNS = ['name', 'business_area', 'address', 'revenue', 'employees']
+BOARD_COLUMNS = ['name', 'role', 'appointment_date', 'personal_nr']
+
+# Markerar att en nyckel saknas i LRU (None betyder cachad 404)
+_MISSING = object()
+
+
+def clean_org_nr(org_nr: str) -> str:
+    """Organisationsnummer utan bindestreck och mellanslag (Bolagsverkets URL-format)"""
+    return org_nr.replace('-', '').replace(' ', '')
+
+
+def format_org_nr(org_nr: str) -> str:
+    """Organisationsnummer i formatet NNNNNN-NNNN, som i procurements.winner_org_nr"""
+    digits = clean_org_nr(org_nr)
+    if len(digits) == 10 and digits.isdigit():
+        return f'{digits[:6]}-{digits[6:]}'
+    return digits
+
+
+class CompanyCache:
+    """Cache för företagsuppslag framför Bolagsverket"""
+
+    def __init__(self, pool, ttl: float = COMPANY_CACHE_TTL_SECONDS,
+                 negative_ttl: float = COMPANY_NEGATIVE_TTL_SECONDS,
+                 max_entries: int = COMPANY_CACHE_MAX_ENTRIES):
+        self.pool = pool
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, Tuple[float, Optional[Dict]]]' = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'database_hits': 0, 'negative_hits': 0, 'upstream_fetches': 0,
+                       'coalesced': 0, 'stale_served': 0, 'evictions': 0}
+        apply_migrations(pool)
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _remember(self, org_nr: str, value: Optional[Dict], expires_in: float):
+        """Spara i LRU med återstående livslängd"""
+        if expires_in <= 0:
+            return
+        with self._lock:
+            self._entries[org_nr] = (time.monotonic() + expires_in, value)
+            self._entries.move_to_end(org_nr)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def _recall(self, org_nr: str):
+        with self._lock:
+            entry = self._entries.get(org_nr)
+            if entry is None:
+                return _MISSING
+            if time.monotonic() >= entry[0]:
+                del self._entries[org_nr]
+                return _MISSING
+            self._entries.move_to_end(org_nr)
+            self._stats['memory_hits'] += 1
+            return entry[1]
+
+    def read_company(self, conn, org_nr: str) -> Optional[Tuple[Dict, float]]:
+        """Sparat företag med styrelse och ålder i sekunder"""
+        cursor = conn.execute('''
+            SELECT *, (julianday('now') - julianday(updated_at)) * 86400 AS age_seconds
+            FROM companies WHERE org_nr = ?
+        ''', (org_nr,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        company = dict(zip([description[0] for description in cursor.description], row))
+        age = company.pop('age_seconds') or 0.0
+
+        cursor = conn.execute('SELECT * FROM board_members WHERE company_org_nr = ? ORDER BY id', (org_nr,))
+        columns = [description[0] for description in cursor.description]
+        company['board_members'] = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        return company, age
+
+    def write_company(self, conn, org_nr: str, company: Dict, board_members: List[Dict]):
+        """Genomskrivning: uppdatera företaget, ersätt styrelsen och dess rader i personindexet"""
+        conn.execute(f'''
+            INSERT INTO companies (org_nr, {', '.join(COMPANY_COLUMNS)}, updated_at)
+            VALUES (?, {', '.join('?' for _ in COMPANY_COLUMNS)}, CURRENT_TIMESTAMP)
+            ON CONFLICT(org_nr) DO UPDATE SET
+                {', '.join(f'{column} = excluded.{column}' for column in COMPANY_COLUMNS)},
+                updated_at = CURRENT_TIMESTAMP
+        ''', (org_nr, *(company.get(column) for column in COMPANY_COLUMNS)))
+        conn.execute('DELETE FROM board_members WHERE company_org_nr = ?', (org_nr,))
+        conn.executemany(f'''
+            INSERT INTO board_members (company_org_nr, {', '.join(BOARD_COLUMNS)})
+            VALUES (?, {', '.join('?' for _ in BOARD_COLUMNS)})
+        ''', [(org_nr, *(member.get(column) for column in BOARD_COLUMNS))
+              for member in board_members if member.get('name')])
+        index_company(conn, org_nr)
+        conn.execute('DELETE FROM company_lookup_misses WHERE org_nr = ?', (org_nr,))
+
+    def _miss_age(self, conn, org_nr: str) -> Optional[float]:
+        row = conn.execute('''
+            SELECT (julianday('now') - julianday(checked_at)) * 86400
+            FROM company_lookup_misses WHERE org_nr = ?
+        ''', (org_nr,)).fetchone()
+        return row[0] if row else None
+
+    def _load(self, org_nr: str, fetch: Optional[CompanyFetch]) -> Optional[Dict]:
+        """Databas, negativ cache och sist Bolagsverket"""
+        with self.pool.connection() as conn:
+            stored = self.read_company(conn, org_nr)
+            miss_age = None if stored else self._miss_age(conn, org_nr)
+
+        if stored and stored[1] < self.ttl:
+            self._count('database_hits')
+            self._remember(org_nr, stored[0], self.ttl - stored[1])
+            return stored[0]
+        if miss_age is not None and miss_age < self.negative_ttl:
+            self._count('negative_hits')
+            self._remember(org_nr, None, self.negative_ttl - miss_age)
+            return None
+        if fetch is None:
+            # Utan uppströmskälla används även inaktuella poster
+            return stored[0] if stored else None
+
+        try:
+            self._count('upstream_fetches')
+            result = fetch(org_nr)
+        except Exception:
+            if stored:
+                self._count('stale_served')
+                logger.warning(f"Bolagsverket lookup failed for {org_nr}, serving cached company")
+                return stored[0]
+            raise
+
+        if result is None:
+            with self.pool.connection() as conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO company_lookup_misses (org_nr, checked_at)
+                    VALUES (?, CURRENT_TIMESTAMP)
+                ''', (org_nr,))
+            self._remember(org_nr, None, self.negative_ttl)
+            return None
+
+        company, board_members = result
+        if not company.get('name'):
+            # Utan namn kan företaget inte sparas (companies.name är NOT NULL)
+            company = dict(company, org_nr=org_nr, board_members=board_members)
+            self._remember(org_nr, company, self.ttl)
+            return company
+
+        with self.pool.connection() as conn:
+            self.write_company(conn, org_nr, company, board_members)
+            company = self.read_company(conn, org_nr)[0]
+        self._remember(org_nr, company, self.ttl)
+        return company
+
+    def get(self, org_nr: str, fetch: Optional[CompanyFetch] = None) -> Optional[Dict]:
+        """
+        Företag med styrelse, eller None om Bolagsverket svarat att det inte finns.
+        Utan fetch läses endast cachen. Samtidiga uppslag av samma nummer väntar
+        på det första anropets resultat.
+        """
+        value = self._recall(org_nr)
+        if value is not _MISSING:
+            return value
+
+        with self._lock:
+            future = self._inflight.get(org_nr)
+            leader = future is None
+            if leader:
+                future = self._inflight[org_nr] = Future()
+            else:
+                self._stats['coalesced'] += 1
+        if not leader:
+            return future.result()
+
+        try:
+            value = self._load(org_nr, fetch)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[org_nr]
+
+    def write_batch(self, found: Dict[str, Tuple[Dict, List[Dict]]], missing: List[str]):
+        """Skriv många uppslag i en transaktion (batchberikning) och släpp dem ur LRU"""
+        with self.pool.connection() as conn:
+            for org_nr, (company, board_members) in found.items():
+                if company.get('name'):
+                    self.write_company(conn, org_nr, company, board_members)
+            conn.executemany('''
+                INSERT OR REPLACE INTO company_lookup_misses (org_nr, checked_at)
+                VALUES (?, CURRENT_TIMESTAMP)
+            ''', [(org_nr,) for org_nr in missing])
+        with self._lock:
+            for org_nr in [*found, *missing]:
+                self._entries.pop(org_nr, None)
+
+    def invalidate(self, org_nr: str):
+        """Ta bort ett företag från LRU (databasposten ligger kvar)"""
+        with self._lock:
+            self._entries.pop(org_nr, None)
+
+    def stats(self) -> Dict:
+        """Statistik för övervakning"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['inflight'] = len(self._inflight)
+        stats['ttl_seconds'] = self.ttl
+        stats['negative_ttl_seconds'] = self.negative_ttl
+        stats['max_entries'] = self.max_entries
+        with self.pool.connection() as conn:
+            stats['stored_companies'] = conn.execute('SELECT COUNT(*) FROM companies').fetchone()[0]
+            stats['stored_misses'] = conn.execute('SELECT COUNT(*) FROM company_lookup_misses').fetchone()[0]
+        return stats
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Batchberikning av företagsdata för Nyhetsportalen
+Samlar upphandlingsvinnare (winner_org_nr) som saknas i companies, hämtar företag
+och styrelse parallellt via hämtmotorn (inom Bolagsverkets gränser) och skriver
+resultatet batchvis genom företagscachen. Körs som jobbet enrich_companies i jobbkön.
+"""
+
+import os
+import time
+import logging
+from typing import Callable, Dict, List, Optional
+
+from company_cache import CompanyCache, CompanyFetch, COMPANY_NEGATIVE_TTL_SECONDS
+from db_pool import chunked
+from fetch_engine import fetch_engine
+
+logger = logging.getLogger(__name__)
+
+ENRICHMENT_BATCH_SIZE = int(os.environ.get('ENRICHMENT_BATCH_SIZE', 100))
+
+# Vinnare utan sparat företag och utan färsk 404
+BACKLOG_SQL = '''
+    SELECT DISTINCT p.winner_org_nr FROM procurements p
+    WHERE p.winner_org_nr IS NOT NULL AND p.winner_org_nr != ''
+      AND NOT EXISTS (SELECT 1 FROM companies c WHERE c.org_nr = p.winner_org_nr)
+      AND NOT EXISTS (SELECT 1 FROM company_lookup_misses m
+                      WHERE m.org_nr = p.winner_org_nr
+                        AND (julianday('now') - julianday(m.checked_at)) * 86400 < ?)
+'''
+
+
+class CompanyEnrichment:
+    """Berikar companies/board_members för alla upphandlingsvinnare"""
+
+    def __init__(self, pool, cache: CompanyCache, fetch: CompanyFetch,
+                 batch_size: int = ENRICHMENT_BATCH_SIZE, negative_ttl: float = COMPANY_NEGATIVE_TTL_SECONDS):
+        self.pool = pool
+        self.cache = cache
+        self.fetch = fetch
+        self.batch_size = batch_size
+        self.negative_ttl = negative_ttl
+
+    def pending(self, limit: Optional[int] = None) -> List[str]:
+        """Organisationsnummer som väntar på berikning"""
+        sql = BACKLOG_SQL + (' LIMIT ?' if limit else '')
+        params = (self.negative_ttl, limit) if limit else (self.negative_ttl,)
+        with self.pool.connection() as conn:
+            return [row[0] for row in conn.execute(sql, params)]
+
+    def backlog_size(self) -> int:
+        """Antal vinnare som väntar på berikning"""
+        with self.pool.connection() as conn:
+            return conn.execute(f'SELECT COUNT(*) FROM ({BACKLOG_SQL})', (self.negative_ttl,)).fetchone()[0]
+
+    def run(self, limit: Optional[int] = None,
+            progress: Optional[Callable[[float, str], None]] = None) -> Dict:
+        """
+        Berika upp till limit vinnare. Varje batch hämtas parallellt och skrivs
+        i en transaktion; misslyckade uppslag ligger kvar i backloggen till nästa körning.
+        progress anropas efter varje batch med andel klara vinnare.
+        """
+        org_nrs = self.pending(limit)
+        start = time.perf_counter()
+        result = {'total': len(org_nrs), 'processed': 0, 'found': 0, 'not_found': 0, 'failed': 0, 'batches': 0}
+
+        for batch in chunked(org_nrs, self.batch_size):
+            results = fetch_engine.map(self.fetch, batch)
+
+            found, missing, failed = {}, [], 0
+            for org_nr, fetched in zip(batch, results):
+                if isinstance(fetched, Exception):
+                    failed += 1
+                    logger.warning(f"Company enrichment failed for {org_nr}: {fetched}")
+                elif fetched is None:
+                    missing.append(org_nr)
+                else:
+                    found[org_nr] = fetched
+            self.cache.write_batch(found, missing)
+
+            result['processed'] += len(batch)
+            result['found'] += len(found)
+            result['not_found'] += len(missing)
+            result['failed'] += failed
+            result['batches'] += 1
+            if progress:
+                progress(result['processed'] / result['total'], f"{result['processed']}/{result['total']} företag")
+
+        result.update(seconds=round(time.perf_counter() - start, 3), backlog=self.backlog_size())
+        result['per_second'] = round(result['processed'] / result['seconds'], 2) if result['seconds'] else 0.0
+        logger.info(f"Company enrichment: {result['found']} found, {result['not_found']} not found, "
+                    f"{result['failed']} failed in {result['seconds']:.1f} seconds "
+                    f"({result['per_second']}/s), backlog {result['backlog']}")
+        return result
+
+    def status(self) -> Dict:
+        """Aktuell backlogg"""
+        return {'backlog': self.backlog_size()}
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Marknadskoncentration per köpare för Nyhetsportalen
+HHI, toppandelar och kontrakts-/värdeandelar för alla myndigheter och kommuner på en
+gång, över flera rullande fönster (90/365/1095 dagar). Raderna grupperas en gång per
+(köpare, leverantör, fönster) och fönstren summeras kumulativt. Resultatet sparas i
+concentration_stats och räknas om endast för köpare som fått nya kontrakt.
+"""
+
+import os
+import time
+import logging
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from db_pool import chunked, placeholders
+from incremental_state import IncrementalState
+from migrations import BUMP_CACHE_GENERATION
+
+logger = logging.getLogger(__name__)
+
+CONCENTRATION_WINDOWS = tuple(sorted(
+    int(days) for days in os.environ.get('CONCENTRATION_WINDOWS', '90,365,1095').split(',')
+))
+CONCENTRATION_TOP_K = int(os.environ.get('CONCENTRATION_TOP_K', 3))
+
+# Köpartyp -> kolumn i procurements
+SCOPES = {'authority': 'contracting_authority', 'municipality': 'municipality'}
+
+STAT_COLUMNS = ['contracts', 'total_value', 'suppliers', 'hhi', 'value_hhi', 'top_supplier',
+                'top_contracts', 'top_share', 'top_value_share', 'top_k_share']
+
+CONCENTRATION_SQL = '''
+    SELECT id, contracting_authority, municipality, winner_name, value, award_date
+    FROM procurements WHERE award_date >= ?
+'''
+
+
+def _pair_stats(pairs: pd.DataFrame, top_k: int) -> pd.DataFrame:
+    """
+    Koncentrationsmått per köpare ur aggregat per (buyer, winner).
+    Kontrakt utan känd vinnare (winner -1) räknas i totalen men inte i andelarna.
+    """
+    by_buyer = pairs.groupby('buyer', sort=True)
+    contracts = by_buyer['contracts'].sum()
+    total_value = by_buyer['value'].sum()
+
+    known = pairs[pairs['winner'] >= 0].copy()
+    buyer_contracts = contracts.reindex(known['buyer']).to_numpy()
+    buyer_value = total_value.reindex(known['buyer']).to_numpy()
+    known['share'] = known['contracts'] / buyer_contracts
+    # Värdeandel 0 hos köpare utan kända belopp
+    known['value_share'] = np.nan_to_num(known['value'].to_numpy() / np.where(buyer_value > 0, buyer_value, np.nan))
+    known['share_squared'] = known['share'] ** 2
+    known['value_share_squared'] = known['value_share'] ** 2
+    by_known = known.groupby('buyer', sort=True)
+    stats = pd.DataFrame({
+        'contracts': contracts,
+        'total_value': total_value,
+        'suppliers': by_known.size(),
+        'hhi': by_known['share_squared'].sum() * 10000,
+        'value_hhi': by_known['value_share_squared'].sum() * 10000
+    })
+
+    # Störst först; lika många kontrakt i förekomstordning (som value_counts)
+    ranked = known.sort_values(['buyer', 'contracts'], ascending=[True, False], kind='stable')
+    rank = ranked.groupby('buyer').cumcount()
+    top = ranked[rank.to_numpy() == 0].set_index('buyer')
+    stats['top_winner'] = top['winner']
+    stats['top_contracts'] = top['contracts']
+    stats['top_share'] = top['share']
+    stats['top_value_share'] = top['value_share']
+    stats['top_k_share'] = ranked[rank.to_numpy() < top_k].groupby('buyer')['share'].sum()
+
+    fill = {'suppliers': 0, 'hhi': 0.0, 'value_hhi': 0.0, 'top_contracts': 0,
+            'top_share': 0.0, 'top_value_share': 0.0, 'top_k_share': 0.0}
+    stats = stats.fillna(fill)
+    return stats.astype({'suppliers': 'int64', 'top_contracts': 'int64'})
+
+
+def _finish(stats: pd.DataFrame, buyers: pd.Index, winners: pd.Index) -> pd.DataFrame:
+    """Ersätt koder med namn"""
+    stats = stats.reset_index()
+    stats['buyer'] = buyers.take(stats['buyer'].to_numpy()).astype(object)
+    top = stats['top_winner']
+    stats['top_supplier'] = pd.Series(
+        winners.take(top.fillna(0).astype('int64').to_numpy()).astype(object), index=stats.index
+    ).where(top.notna(), None)
+    return stats[['buyer', *STAT_COLUMNS]]
+
+
+def _codes(df: pd.DataFrame, buyer_column: str):
+    """Heltalskoder för köpare och vinnare (-1 för saknad vinnare)"""
+    buyer_codes, buyers = pd.factorize(df[buyer_column])
+    winner_codes, winners = pd.factorize(df['winner_name'])
+    return buyer_codes, pd.Index(buyers), winner_codes, pd.Index(winners)
+
+
+def buyer_concentration(df: pd.DataFrame, buyer_column: str, top_k: int = CONCENTRATION_TOP_K) -> pd.DataFrame:
+    """Koncentration per köpare över hela ramen (en rad per köpare, köpare utan värde utelämnas)"""
+    df = df[df[buyer_column].notna()]
+    if df.empty:
+        return pd.DataFrame(columns=['buyer', *STAT_COLUMNS])
+    buyer_codes, buyers, winner_codes, winners = _codes(df, buyer_column)
+    pairs = pd.DataFrame({
+        'buyer': buyer_codes, 'winner': winner_codes, 'value': df['value'].to_numpy(dtype='float64')
+    }).groupby(['buyer', 'winner'], sort=True).agg(contracts=('value', 'size'), value=('value', 'sum')).reset_index()
+    return _finish(_pair_stats(pairs, top_k), buyers, winners)
+
+
+def windowed_concentration(df: pd.DataFrame, buyer_column: str, today: pd.Timestamp,
+                           windows: Sequence[int] = CONCENTRATION_WINDOWS,
+                           top_k: int = CONCENTRATION_TOP_K) -> pd.DataFrame:
+    """
+    Koncentration per köpare för varje fönster (award_date >= today - fönster).
+    Varje rad tilldelas det minsta fönster den ryms i och grupperas en gång;
+    större fönster får sina aggregat genom kumulativ summering.
+    """
+    windows = sorted(windows)
+    ages = (today - df['award_date']).dt.days
+    in_range = (df[buyer_column].notna() & ages.notna() & (ages <= windows[-1])).to_numpy()
+    df = df[in_range]
+    if df.empty:
+        return pd.DataFrame(columns=['window_days', 'buyer', *STAT_COLUMNS])
+
+    buyer_codes, buyers, winner_codes, winners = _codes(df, buyer_column)
+    buckets = np.searchsorted(windows, ages[in_range].to_numpy(), side='left')
+    pairs = pd.DataFrame({
+        'buyer': buyer_codes, 'winner': winner_codes, 'bucket': buckets,
+        'value': df['value'].to_numpy(dtype='float64')
+    }).groupby(['buyer', 'winner', 'bucket'], sort=True).agg(
+        contracts=('value', 'size'), value=('value', 'sum')
+    ).reset_index()
+
+    frames = []
+    for index, window in enumerate(windows):
+        window_pairs = pairs[pairs['bucket'] <= index].groupby(['buyer', 'winner'], sort=True)[
+            ['contracts', 'value']].sum().reset_index()
+        stats = _finish(_pair_stats(window_pairs, top_k), buyers, winners)
+        stats.insert(0, 'window_days', window)
+        frames.append(stats)
+    return pd.concat(frames, ignore_index=True)
+
+
+def top_query(scope: str, window_days: int, limit: int, min_contracts: int,
+              order_by: str) -> Tuple[str, List]:
+    """SQL för de mest koncentrerade köparna (order_by kontrolleras av anroparen)"""
+    return f'''
+        SELECT buyer, window_days, {', '.join(STAT_COLUMNS)}, as_of FROM concentration_stats
+        WHERE scope = ? AND window_days = ? AND contracts >= ?
+        ORDER BY {order_by} DESC, buyer LIMIT ?
+    ''', [scope, window_days, min_contracts, limit]
+
+
+class ConcentrationEngine:
+    """Håller concentration_stats aktuell för alla köpare och fönster"""
+
+    def __init__(self, pool, windows: Sequence[int] = CONCENTRATION_WINDOWS, top_k: int = CONCENTRATION_TOP_K):
+        self.pool = pool
+        self.windows = sorted(windows)
+        self.top_k = top_k
+        self.state = IncrementalState(pool, name='concentration')
+        self.init_table()
+
+    def init_table(self):
+        """Skapa resultattabellen"""
+        with self.pool.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS concentration_stats (
+                    scope TEXT NOT NULL,
+                    buyer TEXT NOT NULL,
+                    window_days INTEGER NOT NULL,
+                    contracts INTEGER NOT NULL,
+                    total_value REAL,
+                    suppliers INTEGER NOT NULL,
+                    hhi REAL NOT NULL,
+                    value_hhi REAL NOT NULL,
+                    top_supplier TEXT,
+                    top_contracts INTEGER NOT NULL,
+                    top_share REAL NOT NULL,
+                    top_value_share REAL NOT NULL,
+                    top_k_share REAL NOT NULL,
+                    as_of TEXT NOT NULL,
+                    PRIMARY KEY (scope, buyer, window_days)
+                )
+            ''')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_concentration_stats_scope_window_hhi
+                ON concentration_stats (scope, window_days, hhi)
+            ''')
+
+    def _load(self, start: str, buyers: Optional[Dict[str, List[str]]]) -> pd.DataFrame:
+        """Rader inom största fönstret, för alla köpare eller endast angivna"""
+        frames = []
+        with self.pool.connection() as conn:
+            if buyers is None:
+                frames.append(pd.read_sql_query(CONCENTRATION_SQL, conn, params=(start,)))
+            else:
+                for scope, names in buyers.items():
+                    for batch in chunked(names):
+                        frames.append(pd.read_sql_query(
+                            CONCENTRATION_SQL + f' AND {SCOPES[scope]} IN ({placeholders(batch)})',
+                            conn, params=(start, *batch)))
+        df = pd.concat(frames, ignore_index=True).drop_duplicates('id')
+        df['value'] = pd.to_numeric(df['value'], errors='coerce')
+        df['award_date'] = pd.to_datetime(df['award_date'], errors='coerce', format='ISO8601')
+        return df
+
+    def _touched_buyers(self, since: Tuple[int, int]) -> Dict[str, List[str]]:
+        """Köpare per typ med nya eller uppdaterade rader efter högvattenmärket"""
+        with self.pool.connection() as conn:
+            return {
+                scope: [row[0] for row in conn.execute(f'''
+                    SELECT {column} FROM procurements WHERE id > ? AND {column} IS NOT NULL
+                    UNION
+                    SELECT {column} FROM procurements WHERE updated_seq > ? AND {column} IS NOT NULL
+                ''', since)]
+                for scope, column in SCOPES.items()
+            }
+
+    def refresh(self, full: bool = False) -> Dict:
+        """
+        Räkna om koncentrationen. Alla köpare räknas om första gången, med full=True och
+        när dagen bytts (fönstren har då flyttats); annars endast köpare med nya rader.
+        """
+        start = time.perf_counter()
+        today = date.today()
+        with self.pool.connection() as conn:
+            mark = self.state.current_mark()
+            as_of = conn.execute('SELECT MIN(as_of), MAX(as_of) FROM concentration_stats').fetchone()
+        last_mark = self.state.get_high_water_mark()
+
+        full = full or not last_mark[0] or as_of != (today.isoformat(), today.isoformat())
+        buyers = None if full else self._touched_buyers(last_mark)
+        if buyers is not None and not any(buyers.values()):
+            return {'mode': 'incremental', 'buyers': 0, 'rows_written': 0, 'seconds': 0.0}
+
+        window_start = (today - timedelta(days=self.windows[-1])).isoformat()
+        df = self._load(window_start, buyers)
+        rows = buyer_count = 0
+        with self.pool.connection() as conn:
+            if full:
+                conn.execute('DELETE FROM concentration_stats')
+            for scope, column in SCOPES.items():
+                if buyers is not None:
+                    names = buyers[scope]
+                    for batch in chunked(names):
+                        conn.execute(f'''
+                            DELETE FROM concentration_stats WHERE scope = ? AND buyer IN ({placeholders(batch)})
+                        ''', (scope, *batch))
+                    scoped = df[df[column].isin(names)]
+                else:
+                    scoped = df
+                stats = windowed_concentration(scoped, column, pd.Timestamp(today), self.windows, self.top_k)
+                stats = stats.astype(object).where(stats.notna(), None)
+                conn.executemany(f'''
+                    INSERT INTO concentration_stats
+                    (scope, window_days, buyer, {', '.join(STAT_COLUMNS)}, as_of)
+                    VALUES (?, ?, ?, {', '.join('?' for _ in STAT_COLUMNS)}, ?)
+                ''', [(scope, *row, today.isoformat()) for row in stats.itertuples(index=False, name=None)])
+                rows += len(stats)
+                buyer_count += stats['buyer'].nunique()
+            self.state.set_high_water_mark(mark)
+            conn.execute(BUMP_CACHE_GENERATION)
+
+        result = {
+            'mode': 'full' if full else 'incremental',
+            'buyers': buyer_count,
+            'rows_written': rows,
+            'seconds': round(time.perf_counter() - start, 3)
+        }
+        logger.info(f"Refreshed market concentration ({result['mode']}): {rows} rows "
+                    f"in {result['seconds']:.2f} seconds")
+        return result
+
+    def top(self, scope: str = 'authority', window_days: int = 365, limit: int = 50,
+            min_contracts: int = 10, order_by: str = 'hhi') -> List[Dict]:
+        """
+        Mest koncentrerade köpare i ett fönster, med HHI för alla fönster per köpare.
+        trend är HHI i kortaste minus längsta fönstret (positiv = ökande koncentration).
+        """
+        if scope not in SCOPES or window_days not in self.windows or order_by not in ('hhi', 'value_hhi', 'top_share'):
+            raise ValueError('Unknown scope, window or sort order')
+        with self.pool.connection() as conn:
+            cursor = conn.execute(*top_query(scope, window_days, limit, min_contracts, order_by))
+            columns = [description[0] for description in cursor.description]
+            results = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+            names = [result['buyer'] for result in results]
+            by_window: Dict[str, Dict[int, float]] = {name: {} for name in names}
+            for batch in chunked(names):
+                for buyer, window, hhi in conn.execute(f'''
+                    SELECT buyer, window_days, hhi FROM concentration_stats
+                    WHERE scope = ? AND buyer IN ({placeholders(batch)})
+                ''', (scope, *batch)):
+                    by_window[buyer][window] = hhi
+
+        shortest, longest = self.windows[0], self.windows[-1]
+        for result in results:
+            hhi = by_window[result['buyer']]
+            result['hhi_by_window'] = {str(window): hhi.get(window) for window in self.windows}
+            result['trend'] = (hhi[shortest] - hhi[longest]
+                               if shortest in hhi and longest in hhi else None)
+        return results
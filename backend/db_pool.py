@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Delad SQLite-anslutningspool för Nyhetsportalen
+En anslutning per tråd, WAL-journal och optimerade PRAGMA-inställningar
+"""
+
+import os
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# PRAGMA-inställningar som sätts på varje ny anslutning
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',       # Läsare blockeras inte av skrivare
+    'synchronous': 'NORMAL',     # Säkert i WAL-läge, betydligt färre fsync
+    'cache_size': -64000,        # 64 MB sidcache per anslutning
+    'mmap_size': 268435456,      # 256 MB minnesmappad I/O
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000         # Vänta upp till 5 s på skrivlås
+}
+
+# Antal förberedda SQL-satser som cachas per anslutning
+STATEMENT_CACHE_SIZE = 256
+
+# Max antal parametrar per IN-lista (under SQLites gräns)
+IN_CHUNK_SIZE = 500
+
+
+class ConnectionPool:
+    """Trådlokal anslutningspool för en SQLite-databas"""
+
+    def __init__(self, db_path: str, pragmas: Optional[Dict] = None):
+        self.db_path = db_path
+        self.pragmas = dict(DEFAULT_PRAGMAS, **(pragmas or {}))
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: Dict[int, tuple] = {}
+        self._pid = os.getpid()
+        self._stats = {
+            'connections_opened': 0,
+            'connections_closed': 0,
+            'checkouts': 0,
+            'reused': 0,
+            'commits': 0,
+            'rollbacks': 0
+        }
+
+    def _open(self) -> sqlite3.Connection:
+        """Öppna och konfigurera en ny anslutning"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.pragmas['busy_timeout'] / 1000,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            check_same_thread=False  # Används endast av ägartråden, men kan stängas av poolen
+        )
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def open_dedicated(self) -> sqlite3.Connection:
+        """Ny anslutning utanför poolen, t.ex. för en strömmande läsning; anroparen stänger den"""
+        conn = self._open()
+        with self._lock:
+            self._stats['connections_opened'] += 1
+        return conn
+
+    def close_dedicated(self, conn: sqlite3.Connection):
+        """Stäng en anslutning från open_dedicated"""
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._stats['connections_closed'] += 1
+
+    def _reset_after_fork(self):
+        """Släpp anslutningar som ärvts från föräldraprocessen (t.ex. gunicorn)"""
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = {}
+        self._pid = os.getpid()
+
+    def _prune_dead_threads(self):
+        """Stäng anslutningar vars trådar har avslutats"""
+        alive = {t.ident for t in threading.enumerate()}
+        for ident in [i for i in self._connections if i not in alive]:
+            _, conn = self._connections.pop(ident)
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            self._stats['connections_closed'] += 1
+
+    def get_connection(self) -> sqlite3.Connection:
+        """Hämta trådens anslutning, skapa den vid behov"""
+        if os.getpid() != self._pid:
+            self._reset_after_fork()
+
+        conn = getattr(self._local, 'conn', None)
+        with self._lock:
+            self._stats['checkouts'] += 1
+            if conn is not None:
+                self._stats['reused'] += 1
+                return conn
+
+            self._prune_dead_threads()
+            thread = threading.current_thread()
+            # Trådidentiteter återanvänds; en post här tillhör en avslutad tråd med samma ident
+            stale = self._connections.pop(thread.ident, None)
+            if stale is not None:
+                try:
+                    stale[1].close()
+                except sqlite3.Error:
+                    pass
+                self._stats['connections_closed'] += 1
+            conn = self._open()
+            self._connections[thread.ident] = (thread.name, conn)
+            self._stats['connections_opened'] += 1
+
+        self._local.conn = conn
+        self._local.depth = 0
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """
+        Låna trådens anslutning. Committar vid lyckat avslut och gör rollback
+        vid undantag; nästlade anrop delar den yttersta transaktionen. Även
+        BaseException (t.ex. GeneratorExit) ger rollback, så att djupet alltid
+        återställs och ingen transaktion blir hängande med skrivlåset.
+        """
+        conn = self.get_connection()
+        self._local.depth += 1
+        committed = False
+        try:
+            yield conn
+            if self._local.depth == 1 and conn.in_transaction:
+                conn.commit()
+                with self._lock:
+                    self._stats['commits'] += 1
+            committed = True
+        finally:
+            self._local.depth -= 1
+            if not committed and self._local.depth == 0 and conn.in_transaction:
+                conn.rollback()
+                with self._lock:
+                    self._stats['rollbacks'] += 1
+
+    def close_all(self):
+        """Stäng alla anslutningar i poolen"""
+        with self._lock:
+            for _, conn in self._connections.values():
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+                self._stats['connections_closed'] += 1
+            self._connections = {}
+            self._local = threading.local()
+
+    def stats(self) -> Dict:
+        """Statistik för övervakning"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['open_connections'] = len(self._connections)
+            stats['threads'] = sorted(name for name, _ in self._connections.values())
+        stats['db_path'] = self.db_path
+        stats['pragmas'] = self.pragmas
+        stats['reuse_ratio'] = round(stats['reused'] / stats['checkouts'], 4) if stats['checkouts'] else 0.0
+        return stats
+
+
+# Globalt register med en pool per databasfil
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str) -> ConnectionPool:
+    """Hämta (eller skapa) den delade poolen för en databasfil"""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(db_path)
+            _pools[key] = pool
+            logger.info(f"Created SQLite connection pool for {db_path}")
+        return pool
+
+
+def all_pool_stats() -> Dict[str, Dict]:
+    """Statistik för samtliga pooler"""
+    with _pools_lock:
+        pools = list(_pools.items())
+    return {key: pool.stats() for key, pool in pools}
+
+
+def chunked(values: List, size: int = IN_CHUNK_SIZE) -> Iterable[List]:
+    """Dela en lista i bitar som ryms i en IN-lista"""
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def placeholders(values: List) -> str:
+    """'?, ?, ?' för en IN-lista"""
+    return ', '.join('?' * len(values))
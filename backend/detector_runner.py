@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Parallell körning av anomalidetektorer för Nyhetsportalen
+Kör oberoende detektorer samtidigt i trådar eller egna processer med tidsgräns och tidtagning per detektor.
+Endast processläget kan avbryta en detektor som överskrider tidsgränsen; en tråd kan
+inte avbrytas i Python, så den räknar klart i bakgrunden och resultatet kastas.
+"""
+
+import os
+import time
+import logging
+import multiprocessing
+from multiprocessing.connection import wait as wait_connections
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+EXECUTOR_KINDS = ('thread', 'process', 'serial')
+
+# Standardinställningar, kan överstyras per körning
+DEFAULT_EXECUTOR = os.environ.get('ANOMALY_EXECUTOR', 'thread')
+DEFAULT_MAX_WORKERS = int(os.environ.get('ANOMALY_MAX_WORKERS', min(6, os.cpu_count() or 1)))
+DEFAULT_TIMEOUT_SECONDS = float(os.environ.get('ANOMALY_DETECTOR_TIMEOUT', 300))
+
+
+def _timed_call(fn: Callable, *args) -> Tuple[List[Dict], float]:
+    """Kör en detektor och mät dess egen körtid (körs i arbetaren)"""
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def _process_main(writer, fn: Callable, args: tuple):
+    """Kör en detektor i en egen process och skicka (status, resultat) till föräldern"""
+    try:
+        writer.send(('ok', _timed_call(fn, *args)))
+    except Exception as e:
+        writer.send(('error', str(e)))
+    finally:
+        writer.close()
+
+
+class DetectorRunner:
+    """Kör en uppsättning detektorer över samma analyskontext"""
+
+    def __init__(self, executor: Optional[str] = None, max_workers: Optional[int] = None,
+                 timeout: Optional[float] = None):
+        self.executor = executor or DEFAULT_EXECUTOR
+        if self.executor not in EXECUTOR_KINDS:
+            raise ValueError(f"Unknown executor '{self.executor}', expected one of {EXECUTOR_KINDS}")
+        self.max_workers = max_workers or DEFAULT_MAX_WORKERS
+        self.timeout = timeout or DEFAULT_TIMEOUT_SECONDS
+
+    def run(self, detectors: List[Tuple[str, Callable]], *args) -> Tuple[List[Dict], Dict]:
+        """
+        Kör detektorerna med args och returnera (anomalier, tidtagning).
+        Anomalierna returneras i detektorernas ordning oavsett vilken som blev klar först.
+        En detektor som fallerar eller överskrider tidsgränsen bidrar inte med några anomalier.
+        I processläget måste detektorerna och args gå att pickla (om processer inte forkas).
+        """
+        start = time.perf_counter()
+        results: Dict[str, List[Dict]] = {}
+        timings: Dict[str, Dict] = {}
+
+        if self.executor == 'serial':
+            for name, fn in detectors:
+                try:
+                    results[name], seconds = _timed_call(fn, *args)
+                    timings[name] = {'status': 'ok', 'seconds': round(seconds, 3)}
+                except Exception as e:
+                    logger.error(f"Detector {name} failed: {e}")
+                    timings[name] = {'status': 'error', 'error': str(e)}
+        elif self.executor == 'thread':
+            self._run_threads(detectors, args, results, timings)
+        else:
+            self._run_processes(detectors, args, results, timings)
+
+        anomalies = []
+        for name, _ in detectors:
+            found = results.get(name, [])
+            timings[name]['anomalies'] = len(found)
+            anomalies.extend(found)
+
+        summary = {
+            'executor': self.executor,
+            'max_workers': self.max_workers if self.executor != 'serial' else 1,
+            'wall_seconds': round(time.perf_counter() - start, 3),
+            'detectors': timings
+        }
+        return anomalies, summary
+
+    @staticmethod
+    def _record(name: str, status: str, payload, results: Dict[str, List[Dict]], timings: Dict[str, Dict]):
+        """Lagra en detektors utfall: ('ok', (anomalier, sekunder)) eller ('error', meddelande)"""
+        if status == 'ok':
+            results[name], seconds = payload
+            timings[name] = {'status': 'ok', 'seconds': round(seconds, 3)}
+        else:
+            logger.error(f"Detector {name} failed: {payload}")
+            timings[name] = {'status': 'error', 'error': payload}
+
+    def _timed_out(self, name: str, timings: Dict[str, Dict]):
+        """Markera en detektor som avbruten vid tidsgränsen"""
+        logger.error(f"Detector {name} timed out after {self.timeout:.0f} seconds")
+        timings[name] = {'status': 'timeout', 'seconds': round(self.timeout, 3)}
+
+    def _run_threads(self, detectors: List[Tuple[str, Callable]], args: tuple,
+                     results: Dict[str, List[Dict]], timings: Dict[str, Dict]):
+        """
+        Kör detektorerna i en trådpool; tidsgränsen räknas från att körningen startade.
+        Detektorer som inte hunnit starta avbryts, men en tråd som redan kör kan inte
+        avbrytas: den räknar klart i bakgrunden och resultatet kastas.
+        """
+        pool = ThreadPoolExecutor(max_workers=min(self.max_workers, len(detectors)))
+        deadline = time.monotonic() + self.timeout
+        try:
+            futures = {pool.submit(_timed_call, fn, *args): name for name, fn in detectors}
+            pending = set(futures)
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        status, payload = 'ok', future.result()
+                    except Exception as e:
+                        status, payload = 'error', str(e)
+                    self._record(futures[future], status, payload, results, timings)
+
+            for future in pending:
+                self._timed_out(futures[future], timings)
+        finally:
+            # Vänta inte på detektorer som överskridit tidsgränsen
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run_processes(self, detectors: List[Tuple[str, Callable]], args: tuple,
+                       results: Dict[str, List[Dict]], timings: Dict[str, Dict]):
+        """
+        Kör varje detektor i en egen process, högst max_workers samtidigt. Processer
+        som fortfarande kör vid tidsgränsen avslutas; ej startade räknas som timeout.
+        """
+        deadline = time.monotonic() + self.timeout
+        queued = list(detectors)
+        running: Dict = {}  # läsände -> (namn, process)
+        try:
+            while queued or running:
+                while queued and len(running) < self.max_workers:
+                    name, fn = queued.pop(0)
+                    reader, writer = multiprocessing.Pipe(duplex=False)
+                    process = multiprocessing.Process(target=_process_main, args=(writer, fn, args),
+                                                      name=f'detector-{name}', daemon=True)
+                    process.start()
+                    writer.close()
+                    running[reader] = (name, process)
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                for reader in wait_connections(list(running), timeout=remaining):
+                    name, process = running.pop(reader)
+                    try:
+                        status, payload = reader.recv()
+                    except EOFError:
+                        process.join()
+                        status, payload = 'error', f'process exited with code {process.exitcode}'
+                    reader.close()
+                    process.join()
+                    self._record(name, status, payload, results, timings)
+        finally:
+            for reader, (name, process) in running.items():
+                process.terminate()
+                process.join()
+                reader.close()
+                self._timed_out(name, timings)
+            for name, _ in queued:
+                self._timed_out(name, timings)
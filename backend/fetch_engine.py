@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Parallell hämtmotor för externa API:er (TED, Bolagsverket)
+Begränsad trådpool med samtidighetsgräns per värd, token bucket och omförsök med jitter
+"""
+
+import os
+import time
+import random
+import threading
+import logging
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Statuskoder som är värda ett nytt försök
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Standardgränser per värd: (max samtidiga anrop, anrop per sekund, burst)
+DEFAULT_HOST_LIMITS = {
+    'ted.europa.eu': (
+        int(os.environ.get('TED_MAX_CONCURRENCY', 4)),
+        float(os.environ.get('TED_RATE_PER_SEC', 5)),
+        10
+    ),
+    'data.bolagsverket.se': (
+        int(os.environ.get('BOLAGSVERKET_MAX_CONCURRENCY', 4)),
+        float(os.environ.get('BOLAGSVERKET_RATE_PER_SEC', 10)),
+        20
+    )
+}
+FALLBACK_HOST_LIMIT = (4, 10.0, 20)
+
+
+class TokenBucket:
+    """Trådsäker token bucket för hastighetsbegränsning"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """Blockera tills en token finns; returnerar väntetid i sekunder"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                delay = (tokens - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class FetchEngine:
+    """Kör HTTP-anrop parallellt inom gränser per värd"""
+
+    def __init__(self, max_workers: int = 8, host_limits: Optional[Dict[str, Tuple]] = None,
+                 max_retries: int = 4, backoff_base: float = 0.5, backoff_max: float = 30.0):
+        self.max_workers = max_workers
+        self.host_limits = dict(DEFAULT_HOST_LIMITS, **(host_limits or {}))
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fetch')
+        self._lock = threading.Lock()
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._stats = {'requests': 0, 'retries': 0, 'failures': 0, 'throttled_seconds': 0.0}
+
+    def _host_controls(self, host: str) -> Tuple[threading.BoundedSemaphore, TokenBucket]:
+        """Semafor och token bucket för en värd (skapas vid första anrop)"""
+        with self._lock:
+            if host not in self._semaphores:
+                concurrency, rate, burst = self.host_limits.get(host, FALLBACK_HOST_LIMIT)
+                self._semaphores[host] = threading.BoundedSemaphore(concurrency)
+                self._buckets[host] = TokenBucket(rate, burst)
+            return self._semaphores[host], self._buckets[host]
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Exponentiell backoff med full jitter; respekterar Retry-After"""
+        if retry_after:
+            try:
+                return min(self.backoff_max, float(retry_after))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def request(self, session: requests.Session, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Utför ett anrop med värdgränser och omförsök.
+        Svar med status som inte är värda ett nytt försök returneras direkt.
+        """
+        host = urlparse(url).hostname or ''
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.limit(url):
+                    response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_retries:
+                    with self._lock:
+                        self._stats['failures'] += 1
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(f"{method} {host} failed ({e}), retrying in {delay:.1f}s")
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                    return response
+                delay = self._backoff(attempt, response.headers.get('Retry-After'))
+                logger.warning(f"{method} {host} returned {response.status_code}, retrying in {delay:.1f}s")
+
+            with self._lock:
+                self._stats['retries'] += 1
+            time.sleep(delay)
+
+    @contextmanager
+    def limit(self, url: str):
+        """Värdens token bucket och samtidighetsgräns runt ett anrop mot url"""
+        semaphore, bucket = self._host_controls(urlparse(url).hostname or '')
+        waited = bucket.acquire()
+        with self._lock:
+            self._stats['requests'] += 1
+            self._stats['throttled_seconds'] += waited
+        with semaphore:
+            yield
+
+    def get(self, session: requests.Session, url: str, **kwargs) -> requests.Response:
+        """GET med värdgränser och omförsök"""
+        return self.request(session, 'GET', url, **kwargs)
+
+    def map(self, fn: Callable, items: Iterable) -> List:
+        """
+        Kör fn över items parallellt och returnera resultaten i samma ordning.
+        Undantag från enskilda anrop returneras på sin plats i listan.
+        Anropa inte map inifrån en funktion som själv körs via map.
+        """
+        futures = [self._executor.submit(fn, item) for item in items]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def stats(self) -> Dict:
+        """Statistik för övervakning"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['max_workers'] = self.max_workers
+        stats['hosts'] = sorted(self._semaphores)
+        return stats
+
+
+# Delad instans för hela processen
+fetch_engine = FetchEngine(max_workers=int(os.environ.get('FETCH_MAX_WORKERS', 8)))
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Kontroll av TED-skördaren mot en lokal stubbserver
+Servern svarar med deterministiska notiser per datumskiva och sida. Skörden körs
+via /api/harvest i en temporär databas: paus efter max_pages, fel mitt i en skiva,
+återupptagning från markören och en omkörning som inte ska ändra något.
+
+Körs manuellt: python harvest_stub.py
+"""
+
+import os
+import sys
+import json
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+WINDOW = {'from': '2025-01-01', 'to': '2025-02-14'}
+NOTICES_PER_DAY = 12
+
+
+class StubTED(BaseHTTPRequestHandler):
+    """GET /notices med TED:s sidindelning; fail_once ger 404 en gång för (datum, sida)"""
+    requests_seen: Counter = Counter()
+    fail_once = set()
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        day_from = datetime.strptime(query['publication-date-from'][0], '%Y-%m-%d')
+        day_to = datetime.strptime(query['publication-date-to'][0], '%Y-%m-%d')
+        page, size = int(query['page'][0]), int(query['page-size'][0])
+
+        key = (query['publication-date-from'][0], page)
+        if key in self.fail_once:
+            self.fail_once.discard(key)
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.requests_seen[key] += 1
+
+        notices = []
+        day = day_from
+        while day <= day_to:
+            notices.extend(notice(day, n) for n in range(NOTICES_PER_DAY))
+            day += timedelta(days=1)
+        body = json.dumps({'results': notices[(page - 1) * size:page * size]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def notice(day: datetime, n: int) -> dict:
+    """En TED-notis i det format RealDataCollector tolkar"""
+    return {
+        'notice_id': f'stub-{day:%Y%m%d}-{n}',
+        'title': {'sv': f'Stubbkontrakt {n}'},
+        'buyer': [{'buyer_name': f'Myndighet {n % 4}', 'address': {'city': 'Uppsala'}}],
+        'award': [{'contractors': [{'name': f'Leverantör {n % 5}'}], 'value': {'amount': 10000 * (n + 1)}}],
+        'object': [{'cpv_code_main': f'{45000000 + n}'}],
+        'dispatch_date': f'{day:%Y-%m-%d}'
+    }
+
+
+def check(name: str, ok: bool, detail=''):
+    print(f"{'PASS' if ok else 'FAIL'}  {name} {detail}")
+    return ok
+
+
+def main() -> int:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubTED)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # app läser konfiguration och skapar databasen i arbetskatalogen vid import
+    os.environ['TED_API_URL'] = f'http://127.0.0.1:{server.server_port}'
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(tempfile.mkdtemp(prefix='harvest_stub_'))
+    import app as portal
+    client = portal.app.test_client()
+
+    days = (datetime.strptime(WINDOW['to'], '%Y-%m-%d') - datetime.strptime(WINDOW['from'], '%Y-%m-%d')).days + 1
+    expected = days * NOTICES_PER_DAY
+    results = []
+
+    for body in ({'days_back': -1}, {'days_back': 'x'}, {'max_pages': 0}, {'resume': 'no'},
+                 {'from': '2025-02-01', 'to': '2025-01-01'}, {'from': 'igår'}, [1]):
+        status = client.post('/api/harvest', json=body).status_code
+        results.append(check(f'400 for {body}', status == 400, status))
+
+    first = client.post('/api/harvest', json={**WINDOW, 'max_pages': 2}).get_json()
+    results.append(check('pauses after max_pages', first['status'] == 'running' and first['pages'] == 2, first))
+
+    # Andra skivan (från 2025-01-31) fallerar på sida 1 första gången
+    StubTED.fail_once.add(('2025-01-31', 1))
+    failed = client.post('/api/harvest', json=WINDOW)
+    results.append(check('fails on stub error', failed.status_code == 500, failed.status_code))
+
+    done = client.post('/api/harvest', json=WINDOW).get_json()
+    with portal.db_manager.connection() as conn:
+        stored = conn.execute("SELECT COUNT(*) FROM procurements WHERE ted_id LIKE 'stub-%'").fetchone()[0]
+    results.append(check('resumes to done', done['status'] == 'done', done))
+    results.append(check('stores every notice once', stored == expected, f'{stored}/{expected}'))
+    refetched = {key: count for key, count in StubTED.requests_seen.items() if count > 1}
+    results.append(check('no page fetched twice', not refetched, refetched))
+
+    again = client.post('/api/harvest', json={**WINDOW, 'resume': False}).get_json()
+    results.append(check('rerun changes nothing', again['inserted'] == 0 and again['updated'] == 0, again))
+
+    server.shutdown()
+    return 0 if all(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Inkrementellt analystillstånd för Nyhetsportalen
+Högvattenmärke och löpande aggregat per CPV-grupp, myndighet och dag i sidotabeller.
+Märket är ett par: högsta procurements.id (nya rader) och högsta updated_seq
+(rader som uppdaterats på plats, migrering 8). En uppdatering som flyttar en rad
+till en annan grupp räknas om för den nya gruppen; den gamla rättas vid nästa
+fullständiga körning.
+"""
+
+import logging
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from db_pool import chunked, placeholders
+from migrations import apply_migrations, add_column
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalState:
+    """Håller sidotabeller för inkrementell anomalianalys uppdaterade"""
+
+    def __init__(self, pool, name: str = 'advanced_analysis'):
+        self.pool = pool
+        self.name = name
+        apply_migrations(pool)
+        self.init_tables()
+
+    def init_tables(self):
+        """Skapa sidotabeller"""
+        with self.pool.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS analysis_state (
+                    name TEXT PRIMARY KEY,
+                    last_rowid INTEGER NOT NULL DEFAULT 0,
+                    last_seq INTEGER NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            add_column('analysis_state', 'last_seq', 'INTEGER NOT NULL DEFAULT 0')(conn)
+
+            # Värdestatistik per CPV-grupp (prisanomalier)
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS cpv_group_stats (
+                    cpv_codes TEXT PRIMARY KEY,
+                    contract_count INTEGER NOT NULL,
+                    mean_value REAL,
+                    std_value REAL,
+                    q1_value REAL,
+                    q3_value REAL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Kopplingar myndighet-leverantör (nätverksanomalier)
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS authority_winner_stats (
+                    contracting_authority TEXT NOT NULL,
+                    winner_name TEXT NOT NULL,
+                    contract_count INTEGER NOT NULL,
+                    total_value REAL,
+                    first_contract TEXT,
+                    last_contract TEXT,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (contracting_authority, winner_name)
+                )
+            ''')
+
+            # Tilldelningar per myndighet och dag (tidskluster)
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS authority_day_stats (
+                    contracting_authority TEXT NOT NULL,
+                    award_date TEXT NOT NULL,
+                    contract_count INTEGER NOT NULL,
+                    total_value REAL,
+                    winners TEXT,
+                    PRIMARY KEY (contracting_authority, award_date)
+                )
+            ''')
+
+    def get_high_water_mark(self) -> Tuple[int, int]:
+        """(högsta procurements.id, högsta updated_seq) som redan analyserats"""
+        with self.pool.connection() as conn:
+            row = conn.execute('SELECT last_rowid, last_seq FROM analysis_state WHERE name = ?',
+                               (self.name,)).fetchone()
+        return (row[0], row[1]) if row else (0, 0)
+
+    def set_high_water_mark(self, mark: Tuple[int, int]):
+        """Flytta fram högvattenmärket"""
+        with self.pool.connection() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO analysis_state (name, last_rowid, last_seq, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (self.name, int(mark[0]), int(mark[1])))
+
+    def current_mark(self) -> Tuple[int, int]:
+        """Högvattenmärke för tabellens nuvarande innehåll"""
+        with self.pool.connection() as conn:
+            max_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM procurements').fetchone()[0]
+            max_seq = conn.execute('''
+                SELECT COALESCE(MAX(updated_seq), 0) FROM procurements WHERE updated_seq IS NOT NULL
+            ''').fetchone()[0]
+        return max_id, max_seq
+
+    @staticmethod
+    def mark_of(rows: pd.DataFrame, since: Tuple[int, int]) -> Tuple[int, int]:
+        """Märket efter rader som lästs med load_new_rows(since)"""
+        if rows.empty:
+            return since
+        return (max(since[0], int(rows['id'].max())),
+                max(since[1], int(rows['updated_seq'].fillna(0).max())))
+
+    def load_new_rows(self, since: Tuple[int, int]) -> pd.DataFrame:
+        """Rader som tillkommit eller uppdaterats efter högvattenmärket"""
+        with self.pool.connection() as conn:
+            return pd.read_sql_query('''
+                SELECT id, contracting_authority, winner_name, value, cpv_codes, award_date, updated_seq
+                FROM procurements WHERE id > ?
+                UNION
+                SELECT id, contracting_authority, winner_name, value, cpv_codes, award_date, updated_seq
+                FROM procurements WHERE updated_seq > ?
+                ORDER BY id
+            ''', conn, params=since)
+
+    def refresh_cpv_group_stats(self, cpv_groups: Optional[List[str]] = None):
+        """Räkna om statistik för angivna CPV-grupper (None = alla)"""
+        with self.pool.connection() as conn:
+            if cpv_groups is None:
+                conn.execute('DELETE FROM cpv_group_stats')
+                frames = [pd.read_sql_query('''
+                    SELECT cpv_codes, value FROM procurements
+                    WHERE value > 0 AND cpv_codes IS NOT NULL AND cpv_codes != ''
+                ''', conn)]
+            else:
+                frames = []
+                for batch in chunked(cpv_groups):
+                    conn.execute(f'DELETE FROM cpv_group_stats WHERE cpv_codes IN ({placeholders(batch)})', batch)
+                    frames.append(pd.read_sql_query(f'''
+                        SELECT cpv_codes, value FROM procurements
+                        WHERE value > 0 AND cpv_codes IN ({placeholders(batch)})
+                    ''', conn, params=batch))
+
+            df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['cpv_codes', 'value'])
+            if df.empty:
+                return
+
+            grouped = df.groupby('cpv_codes')['value']
+            stats = pd.DataFrame({
+                'contract_count': grouped.size(),
+                'mean_value': grouped.mean(),
+                'std_value': grouped.std(),
+                'q1_value': grouped.quantile(0.25),
+                'q3_value': grouped.quantile(0.75)
+            }).reset_index()
+            stats = stats.astype(object).where(stats.notna(), None)
+
+            conn.executemany('''
+                INSERT INTO cpv_group_stats
+                (cpv_codes, contract_count, mean_value, std_value, q1_value, q3_value)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', stats.itertuples(index=False, name=None))
+
+    def refresh_authority_winner_stats(self, authorities: Optional[List[str]] = None):
+        """Räkna om kopplingar för angivna myndigheter (None = alla)"""
+        insert_sql = '''
+            INSERT INTO authority_winner_stats
+            (contracting_authority, winner_name, contract_count, total_value, first_contract, last_contract)
+            SELECT contracting_authority, winner_name, COUNT(*), SUM(value),
+                   MIN(award_date), MAX(award_date)
+            FROM procurements
+            WHERE contracting_authority IS NOT NULL AND winner_name IS NOT NULL
+        '''
+        with self.pool.connection() as conn:
+            if authorities is None:
+                conn.execute('DELETE FROM authority_winner_stats')
+                conn.execute(insert_sql + ' GROUP BY contracting_authority, winner_name')
+                return
+            for batch in chunked(authorities):
+                conn.execute(f'''
+                    DELETE FROM authority_winner_stats
+                    WHERE contracting_authority IN ({placeholders(batch)})
+                ''', batch)
+                conn.execute(insert_sql + f'''
+                    AND contracting_authority IN ({placeholders(batch)})
+                    GROUP BY contracting_authority, winner_name
+                ''', batch)
+
+    def refresh_authority_day_stats(self, authority_days: Optional[List[Tuple[str, str]]] = None):
+        """Räkna om dagsaggregat för angivna (myndighet, datum) (None = alla)"""
+        insert_sql = '''
+            INSERT INTO authority_day_stats
+            (contracting_authority, award_date, contract_count, total_value, winners)
+            SELECT contracting_authority, award_date, COUNT(*), SUM(value), GROUP_CONCAT(winner_name)
+            FROM procurements
+            WHERE award_date IS NOT NULL AND contracting_authority IS NOT NULL
+        '''
+        with self.pool.connection() as conn:
+            if authority_days is None:
+                conn.execute('DELETE FROM authority_day_stats')
+                conn.execute(insert_sql + ' GROUP BY contracting_authority, award_date')
+                return
+            conn.executemany('''
+                DELETE FROM authority_day_stats WHERE contracting_authority = ? AND award_date = ?
+            ''', authority_days)
+            conn.executemany(insert_sql + '''
+                AND contracting_authority = ? AND award_date = ?
+                GROUP BY contracting_authority, award_date
+            ''', authority_days)
+
+    def rebuild(self):
+        """Bygg om alla sidotabeller och sätt högvattenmärket till senaste rad"""
+        with self.pool.connection():
+            mark = self.current_mark()
+            self.refresh_cpv_group_stats()
+            self.refresh_authority_winner_stats()
+            self.refresh_authority_day_stats()
+            self.set_high_water_mark(mark)
+        logger.info(f"Rebuilt incremental analysis state up to row {mark[0]}, change {mark[1]}")
+
+    def cpv_stats_for(self, cpv_groups: List[str]) -> pd.DataFrame:
+        """Lagrad statistik för CPV-grupper"""
+        frames = []
+        with self.pool.connection() as conn:
+            for batch in chunked(cpv_groups):
+                frames.append(pd.read_sql_query(f'''
+                    SELECT * FROM cpv_group_stats WHERE cpv_codes IN ({placeholders(batch)})
+                ''', conn, params=batch))
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def authority_winner_stats_for(self, pairs: List[Tuple[str, str]]) -> pd.DataFrame:
+        """Lagrade kopplingar för (myndighet, leverantör)-par"""
+        authorities = sorted({authority for authority, _ in pairs})
+        frames = []
+        with self.pool.connection() as conn:
+            for batch in chunked(authorities):
+                frames.append(pd.read_sql_query(f'''
+                    SELECT * FROM authority_winner_stats
+                    WHERE contracting_authority IN ({placeholders(batch)})
+                ''', conn, params=batch))
+        if not frames:
+            return pd.DataFrame()
+        df = pd.concat(frames, ignore_index=True)
+        wanted = pd.MultiIndex.from_tuples(pairs)
+        return df[pd.MultiIndex.from_frame(df[['contracting_authority', 'winner_name']]).isin(wanted)]
+
+    def authority_day_stats_for(self, authority_days: List[Tuple[str, str]]) -> pd.DataFrame:
+        """Lagrade dagsaggregat för (myndighet, datum)-par"""
+        rows = []
+        columns = None
+        with self.pool.connection() as conn:
+            for authority, award_date in authority_days:
+                cursor = conn.execute('''
+                    SELECT * FROM authority_day_stats WHERE contracting_authority = ? AND award_date = ?
+                ''', (authority, award_date))
+                columns = [description[0] for description in cursor.description]
+                rows.extend(cursor.fetchall())
+        return pd.DataFrame(rows, columns=columns)
+
+    def day_count_distribution(self, min_count: int = 3) -> Tuple[float, float]:
+        """Medel och standardavvikelse för antal kontrakt per myndighet och dag"""
+        with self.pool.connection() as conn:
+            n, total, total_sq = conn.execute('''
+                SELECT COUNT(*), SUM(contract_count), SUM(contract_count * contract_count)
+                FROM authority_day_stats
+                WHERE contract_count >= ?
+            ''', (min_count,)).fetchone()
+        if not n:
+            return 0.0, float('nan')
+        mean = total / n
+        # Stickprovsstandardavvikelse, som pandas .std()
+        std = np.sqrt(max(0.0, (total_sq - n * mean * mean) / (n - 1))) if n > 1 else float('nan')
+        return mean, std
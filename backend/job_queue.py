@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Persistent jobbkö med arbetarpool för Nyhetsportalens schemalagda körningar
+Jobb sparas i SQLite (job_queue) och överlever omstarter. Ett jobb som redan
+väntar läggs inte till igen, och ett jobbnamn körs aldrig parallellt med sig självt.
+Kö- och körtid registreras per jobb för latensstatistik, och jobb kan rapportera
+förlopp som läses via get().
+"""
+
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from migrations import add_column
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 3))
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', 5))
+JOB_HISTORY_DAYS = int(os.environ.get('JOB_HISTORY_DAYS', 7))
+
+# Antal senaste körningar per jobb som latensstatistiken räknas på
+LATENCY_WINDOW = 100
+
+JobHandler = Callable[[Dict], Optional[Dict]]
+
+JOB_COLUMNS = ['id', 'name', 'status', 'attempts', 'progress', 'progress_message',
+               'enqueued_at', 'started_at', 'finished_at', 'result', 'error']
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _owner() -> str:
+    """Processen som kör ett jobb (värd:pid)"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _process_alive(owner: Optional[str]) -> bool:
+    """Sant om ägarprocessen kan leva; processer på andra värdar antas leva"""
+    if not owner:
+        return False
+    host, _, pid = owner.rpartition(':')
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    return True
+
+
+def _timestamp(value: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(value).isoformat() if value is not None else None
+
+
+class JobQueue:
+    """SQLite-baserad jobbkö som körs av en pool av arbetartrådar"""
+
+    def __init__(self, pool, max_workers: int = JOB_WORKERS, poll_interval: float = JOB_POLL_SECONDS):
+        self.pool = pool
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.handlers: Dict[str, JobHandler] = {}
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+        self._workers: List[threading.Thread] = []
+        self._current = threading.local()
+        self.init_table()
+
+    def init_table(self):
+        """Skapa kötabellen; väntande jobb är unika per dedup_key"""
+        with self.pool.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS job_queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    dedup_key TEXT NOT NULL,
+                    payload TEXT,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    enqueued_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    result TEXT,
+                    error TEXT,
+                    owner TEXT,
+                    progress REAL,
+                    progress_message TEXT
+                )
+            ''')
+            # Tabeller skapade före förloppsrapporteringen
+            for column, definition in (('owner', 'TEXT'), ('progress', 'REAL'), ('progress_message', 'TEXT')):
+                add_column('job_queue', column, definition)(conn)
+            conn.execute('''
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_job_queue_queued_dedup
+                ON job_queue (dedup_key) WHERE status = 'queued'
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_job_queue_status_id ON job_queue (status, id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_job_queue_name_finished ON job_queue (name, finished_at)')
+
+    def register(self, name: str, handler: JobHandler):
+        """Koppla ett jobbnamn till en funktion som tar payload och returnerar ett resultat"""
+        self.handlers[name] = handler
+
+    def enqueue(self, name: str, payload: Optional[Dict] = None, dedup_key: Optional[str] = None) -> Optional[int]:
+        """Lägg ett jobb i kön; None om ett likadant jobb redan väntar"""
+        if name not in self.handlers:
+            raise ValueError(f"Unknown job '{name}'")
+        with self.pool.connection() as conn:
+            cursor = conn.execute('''
+                INSERT OR IGNORE INTO job_queue (name, dedup_key, payload, enqueued_at)
+                VALUES (?, ?, ?, ?)
+            ''', (name, dedup_key or name, json.dumps(payload or {}), time.time()))
+            job_id = cursor.lastrowid if cursor.rowcount else None
+        if job_id is None:
+            logger.info(f"Job {name} already queued, skipping")
+        else:
+            with self._wakeup:
+                self._wakeup.notify()
+        return job_id
+
+    def submit(self, name: str, payload: Optional[Dict] = None,
+               dedup_key: Optional[str] = None) -> Tuple[int, bool]:
+        """
+        Lägg ett jobb i kön och returnera (id, coalesced). Om ett likadant jobb
+        redan väntar eller körs returneras det jobbets id i stället för ett nytt.
+        """
+        if name not in self.handlers:
+            raise ValueError(f"Unknown job '{name}'")
+        dedup_key = dedup_key or name
+        with self.pool.connection() as conn:
+            # Skrivlåset tas före kontrollen, så att två processer inte båda hittar
+            # inget aktivt jobb och den ena krockar med dedup-indexet
+            if not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('''
+                SELECT id FROM job_queue WHERE dedup_key = ? AND status IN ('queued', 'running')
+                ORDER BY id LIMIT 1
+            ''', (dedup_key,)).fetchone()
+            if row is None:
+                job_id = conn.execute('''
+                    INSERT INTO job_queue (name, dedup_key, payload, enqueued_at) VALUES (?, ?, ?, ?)
+                ''', (name, dedup_key, json.dumps(payload or {}), time.time())).lastrowid
+        if row is not None:
+            logger.info(f"Job {name} already active as #{row[0]}, coalescing")
+            return row[0], True
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id, False
+
+    def _claim(self) -> Optional[Dict]:
+        """
+        Ta äldsta väntande jobb vars namn inte redan körs. Bara jobb med en registrerad
+        funktion i den här processen tas, så att webbprocessen lämnar schemaläggarens jobb.
+        """
+        names = list(self.handlers)
+        if not names:
+            return None
+        with self.pool.connection() as conn:
+            cursor = conn.execute(f'''
+                UPDATE job_queue SET status = 'running', started_at = ?, attempts = attempts + 1,
+                                     owner = ?, progress = NULL, progress_message = NULL
+                WHERE id = (
+                    SELECT q.id FROM job_queue q
+                    WHERE q.status = 'queued' AND q.name IN ({', '.join('?' for _ in names)})
+                      AND NOT EXISTS (SELECT 1 FROM job_queue r WHERE r.status = 'running' AND r.name = q.name)
+                    ORDER BY q.id LIMIT 1
+                )
+                RETURNING id, name, payload, enqueued_at
+            ''', (time.time(), _owner(), *names))
+            rows = cursor.fetchall()
+        if not rows:
+            return None
+        job_id, name, payload, enqueued_at = rows[0]
+        return {'id': job_id, 'name': name, 'payload': json.loads(payload or '{}'), 'enqueued_at': enqueued_at}
+
+    def _finish(self, job_id: int, status: str, result: Optional[Dict] = None, error: Optional[str] = None):
+        with self.pool.connection() as conn:
+            conn.execute('''
+                UPDATE job_queue SET status = ?, finished_at = ?, result = ?, error = ?,
+                                     progress = CASE WHEN ? = 'done' THEN 1.0 ELSE progress END
+                WHERE id = ?
+            ''', (status, time.time(), json.dumps(result, default=str) if result is not None else None,
+                  error, status, job_id))
+        # Ett jobb med samma namn kan ha väntat på att det här skulle bli klart
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def run_job(self, job: Dict):
+        """Kör ett hämtat jobb och registrera utfallet"""
+        wait = time.time() - job['enqueued_at']
+        start = time.perf_counter()
+        logger.info(f"Job {job['name']} #{job['id']} started after {wait:.1f}s in queue")
+        self._current.job_id = job['id']
+        try:
+            result = self.handlers[job['name']](job['payload'])
+        except Exception as e:
+            logger.error(f"Job {job['name']} #{job['id']} failed: {e}")
+            self._finish(job['id'], 'failed', error=str(e))
+        else:
+            logger.info(f"Job {job['name']} #{job['id']} finished in {time.perf_counter() - start:.1f}s")
+            self._finish(job['id'], 'done', result=result)
+        finally:
+            self._current.job_id = None
+
+    def _set_progress(self, job_id: Optional[int], fraction: float, message: Optional[str] = None):
+        if job_id is None:
+            return
+        with self.pool.connection() as conn:
+            conn.execute('UPDATE job_queue SET progress = ?, progress_message = ? WHERE id = ?',
+                         (max(0.0, min(1.0, fraction)), message, job_id))
+
+    def progress(self, fraction: float, message: Optional[str] = None):
+        """Rapportera förlopp (0–1) för jobbet som körs i den här tråden"""
+        self._set_progress(getattr(self._current, 'job_id', None), fraction, message)
+
+    def reporter(self) -> Callable[[float, Optional[str]], None]:
+        """Förloppsfunktion bunden till aktuellt jobb; kan anropas från andra trådar"""
+        job_id = getattr(self._current, 'job_id', None)
+        return lambda fraction, message=None: self._set_progress(job_id, fraction, message)
+
+    def _worker(self):
+        while not self._stopping.is_set():
+            job = self._claim()
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+            self.run_job(job)
+
+    def recover(self) -> int:
+        """
+        Jobb som avbröts av en omstart läggs tillbaka i kön. Jobb som körs av
+        en annan levande process (t.ex. en annan webbarbetare) lämnas orörda.
+        """
+        with self.pool.connection() as conn:
+            running = conn.execute("SELECT id, owner FROM job_queue WHERE status = 'running'").fetchall()
+            interrupted = [job_id for job_id, owner in running if not _process_alive(owner)]
+            if not interrupted:
+                return 0
+            ids = ', '.join('?' for _ in interrupted)
+            # Ett avbrutet jobb vars namn redan väntar igen behövs inte två gånger
+            conn.execute(f'''
+                UPDATE job_queue SET status = 'failed', finished_at = ?, error = 'interrupted'
+                WHERE id IN ({ids})
+                  AND dedup_key IN (SELECT dedup_key FROM job_queue WHERE status = 'queued')
+            ''', (time.time(), *interrupted))
+            count = conn.execute(f'''
+                UPDATE job_queue SET status = 'queued', started_at = NULL, owner = NULL
+                WHERE status = 'running' AND id IN ({ids})
+            ''', interrupted).rowcount
+        if count:
+            logger.warning(f"Requeued {count} interrupted jobs")
+        return count
+
+    def prune(self, days: int = JOB_HISTORY_DAYS) -> int:
+        """Ta bort avslutade jobb äldre än days dagar"""
+        with self.pool.connection() as conn:
+            return conn.execute('''
+                DELETE FROM job_queue WHERE status IN ('done', 'failed') AND finished_at < ?
+            ''', (time.time() - days * 86400,)).rowcount
+
+    def start(self):
+        """Starta arbetartrådarna (gör inget om de redan körs)"""
+        if self._workers:
+            return
+        self.recover()
+        self._stopping.clear()
+        for index in range(self.max_workers):
+            worker = threading.Thread(target=self._worker, name=f'job-worker-{index}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        logger.info(f"Job queue started with {self.max_workers} workers")
+
+    def workers_alive(self) -> int:
+        """Antal arbetartrådar som lever i den här processen"""
+        return sum(worker.is_alive() for worker in self._workers)
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stoppa arbetarna efter pågående jobb"""
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+
+    def _describe(self, row) -> Dict:
+        job = dict(zip(JOB_COLUMNS, row))
+        started, finished = job['started_at'], job['finished_at']
+        job['wait_seconds'] = round((started or time.time()) - job['enqueued_at'], 3)
+        job['run_seconds'] = round((finished or time.time()) - started, 3) if started else None
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        for column in ('enqueued_at', 'started_at', 'finished_at'):
+            job[column] = _timestamp(job[column])
+        return job
+
+    def get(self, job_id: int) -> Optional[Dict]:
+        """Status, förlopp och tider för ett jobb"""
+        with self.pool.connection() as conn:
+            row = conn.execute(f'SELECT {", ".join(JOB_COLUMNS)} FROM job_queue WHERE id = ?',
+                               (job_id,)).fetchone()
+        return self._describe(row) if row else None
+
+    def recent(self, limit: int = 50, name: Optional[str] = None) -> List[Dict]:
+        """Senaste jobben, nyast först"""
+        where = 'WHERE name = ?' if name else ''
+        params = (name, limit) if name else (limit,)
+        with self.pool.connection() as conn:
+            rows = conn.execute(f'''
+                SELECT {", ".join(JOB_COLUMNS)} FROM job_queue {where} ORDER BY id DESC LIMIT ?
+            ''', params).fetchall()
+        return [self._describe(row) for row in rows]
+
+    def stats(self) -> Dict:
+        """Köstatus och latens (väntetid i kö, körtid) per jobbnamn"""
+        with self.pool.connection() as conn:
+            counts = conn.execute('SELECT status, COUNT(*) FROM job_queue GROUP BY status').fetchall()
+            names = [row[0] for row in conn.execute('SELECT DISTINCT name FROM job_queue ORDER BY name')]
+            jobs = {}
+            for name in names:
+                rows = conn.execute('''
+                    SELECT status, started_at - enqueued_at, finished_at - started_at, finished_at
+                    FROM job_queue WHERE name = ? AND finished_at IS NOT NULL
+                    ORDER BY finished_at DESC LIMIT ?
+                ''', (name, LATENCY_WINDOW)).fetchall()
+                waits = [row[1] for row in rows]
+                runs = [row[2] for row in rows]
+                jobs[name] = {
+                    'runs': len(rows),
+                    'failures': sum(1 for row in rows if row[0] == 'failed'),
+                    'last_finished': datetime.fromtimestamp(rows[0][3]).isoformat() if rows else None,
+                    'wait_seconds': {'avg': round(sum(waits) / len(waits), 3), 'max': round(max(waits), 3)}
+                    if waits else None,
+                    'run_seconds': {'avg': round(sum(runs) / len(runs), 3), 'p95': round(_percentile(runs, 0.95), 3),
+                                    'max': round(max(runs), 3)} if runs else None
+                }
+        return {
+            'workers': self.max_workers,
+            'status_counts': dict(counts),
+            'jobs': jobs
+        }
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Versionerade schemamigreringar för Nyhetsportalen
+Varje migrering körs en gång i egen transaktion och registreras i schema_migrations.
+
+Körs manuellt: python migrations.py [databas]
+"""
+
+import sys
+import logging
+from typing import Callable, List, Tuple, Union
+
+from person_index import rebuild_index
+
+logger = logging.getLogger(__name__)
+
+def _month(column: str) -> str:
+    """Tilldelningsmånad (YYYY-MM, '' för saknat datum) som SQL-uttryck"""
+    return f"COALESCE(substr({column}, 1, 7), '')"
+
+
+def mark_dirty_months(select: str) -> str:
+    """
+    Triggersats som markerar månaderna från select (kolumnen month) som ändrade.
+    Skriven utan OR IGNORE, eftersom ett yttre UPSERT/REPLACE ersätter triggerns konfliktval.
+    """
+    return f'''INSERT INTO snapshot_dirty_months (award_month)
+               SELECT DISTINCT month FROM ({select}) AS changed
+               WHERE NOT EXISTS (SELECT 1 FROM snapshot_dirty_months WHERE award_month = changed.month);'''
+
+
+def add_column(table: str, column: str, definition: str) -> Callable:
+    """Migreringssteg som lägger till en kolumn om den saknas"""
+    def step(conn):
+        columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+        if column not in columns:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    return step
+
+
+# Vinnarens organisationsnummer utan bindestreck och mellanslag
+_ORG_DIGITS = "replace(replace(winner_org_nr, '-', ''), ' ', '')"
+
+# Ger raden NEW nästa sekvensnummer i anomaliflödet (MAX läses via idx_anomalies_seq)
+_NEXT_ANOMALY_SEQ = '''UPDATE anomalies SET seq = (SELECT COALESCE(MAX(seq), 0) + 1 FROM anomalies)
+                       WHERE id = NEW.id;'''
+
+
+# Kolumner som anomalianalysen läser; ändras någon av dem analyseras raden om
+ANALYSED_COLUMNS = ['title', 'contracting_authority', 'winner_name', 'winner_org_nr', 'value',
+                    'cpv_codes', 'award_date', 'municipality']
+
+# Ger raden NEW nästa ändringssekvens (MAX läses via idx_procurements_updated_seq)
+_NEXT_PROCUREMENT_SEQ = '''UPDATE procurements SET updated_seq =
+                               (SELECT COALESCE(MAX(updated_seq), 0) + 1 FROM procurements
+                                WHERE updated_seq IS NOT NULL)
+                           WHERE id = NEW.id;'''
+
+# Svarscachens generation (migrering 9); svar från äldre generationer används inte.
+# Körs en gång per skrivtransaktion av den som skriver procurements, anomalies eller concentration_stats
+BUMP_CACHE_GENERATION = 'UPDATE cache_generation SET generation = generation + 1 WHERE id = 1'
+
+# (version, beskrivning, steg); ett steg är en SQL-sats eller en funktion som tar anslutningen
+Migration = Tuple[int, str, List[Union[str, Callable]]]
+
+MIGRATIONS: List[Migration] = [
+    (1, 'Secondary indexes for route filters, sort orders and detector grouping', [
+        # /api/procurements: filter på kommun, sortering på datum
+        'CREATE INDEX IF NOT EXISTS idx_procurements_municipality_award_date '
+        'ON procurements (municipality, award_date)',
+        'CREATE INDEX IF NOT EXISTS idx_procurements_award_date ON procurements (award_date)',
+        # Detektorer och sidotabeller grupperar på myndighet och leverantör
+        'CREATE INDEX IF NOT EXISTS idx_procurements_authority_winner '
+        'ON procurements (contracting_authority, winner_name)',
+        'CREATE INDEX IF NOT EXISTS idx_procurements_cpv_codes ON procurements (cpv_codes)',
+        # /api/anomalies och /api/anomaly-stats
+        'CREATE INDEX IF NOT EXISTS idx_anomalies_type_detected_risk '
+        'ON anomalies (anomaly_type, detected_at, risk_score)',
+        'CREATE INDEX IF NOT EXISTS idx_anomalies_detected_risk ON anomalies (detected_at, risk_score)',
+        'CREATE INDEX IF NOT EXISTS idx_anomalies_risk_score ON anomalies (risk_score)',
+        'CREATE INDEX IF NOT EXISTS idx_anomalies_procurement_id ON anomalies (procurement_id)',
+        # /api/companies/<org_nr>
+        'CREATE INDEX IF NOT EXISTS idx_board_members_company_org_nr ON board_members (company_org_nr)',
+        'ANALYZE'
+    ]),
+    (2, 'Change tracking by award month for the columnar snapshot', [
+        # Månader vars snapshot-partition måste skrivas om ('' = saknat datum)
+        '''CREATE TABLE IF NOT EXISTS snapshot_dirty_months (
+               award_month TEXT PRIMARY KEY
+           )''',
+        f"CREATE INDEX IF NOT EXISTS idx_procurements_award_month ON procurements ({_month('award_date')})",
+        'CREATE INDEX IF NOT EXISTS idx_procurements_winner_org_nr ON procurements (winner_org_nr)',
+        # Importens heta väg: triggern körs bara när månaden inte redan är markerad
+        f'''CREATE TRIGGER IF NOT EXISTS procurements_snapshot_insert AFTER INSERT ON procurements
+           WHEN NOT EXISTS (SELECT 1 FROM snapshot_dirty_months WHERE award_month = {_month('NEW.award_date')})
+           BEGIN INSERT INTO snapshot_dirty_months (award_month) VALUES ({_month('NEW.award_date')}); END''',
+        f'''CREATE TRIGGER IF NOT EXISTS procurements_snapshot_update AFTER UPDATE ON procurements
+           BEGIN {mark_dirty_months(f"SELECT {_month('OLD.award_date')} AS month "
+                                    f"UNION SELECT {_month('NEW.award_date')}")} END''',
+        f'''CREATE TRIGGER IF NOT EXISTS procurements_snapshot_delete AFTER DELETE ON procurements
+           BEGIN {mark_dirty_months(f"SELECT {_month('OLD.award_date')} AS month")} END''',
+        # Företagsdata ingår i snapshoten via winner_org_nr
+        f'''CREATE TRIGGER IF NOT EXISTS companies_snapshot_insert AFTER INSERT ON companies
+           BEGIN {mark_dirty_months(f"SELECT {_month('award_date')} AS month FROM procurements "
+                                    f"WHERE winner_org_nr = NEW.org_nr")} END''',
+        f'''CREATE TRIGGER IF NOT EXISTS companies_snapshot_update AFTER UPDATE ON companies
+           BEGIN {mark_dirty_months(f"SELECT {_month('award_date')} AS month FROM procurements "
+                                    f"WHERE winner_org_nr IN (OLD.org_nr, NEW.org_nr)")} END''',
+        f'''CREATE TRIGGER IF NOT EXISTS companies_snapshot_delete AFTER DELETE ON companies
+           BEGIN {mark_dirty_months(f"SELECT {_month('award_date')} AS month FROM procurements "
+                                    f"WHERE winner_org_nr = OLD.org_nr")} END'''
+    ]),
+    (3, 'Negative cache for company lookups; snapshot tracking only on changed company data', [
+        # Organisationsnummer som Bolagsverket svarat 404 på
+        '''CREATE TABLE IF NOT EXISTS company_lookup_misses (
+               org_nr TEXT PRIMARY KEY,
+               checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+           )''',
+        # Företagscachen förnyar updated_at; snapshoten påverkas bara om data ändrats
+        'DROP TRIGGER IF EXISTS companies_snapshot_update',
+        f'''CREATE TRIGGER IF NOT EXISTS companies_snapshot_update AFTER UPDATE ON companies
+           WHEN OLD.org_nr IS NOT NEW.org_nr OR OLD.name IS NOT NEW.name
+             OR OLD.business_area IS NOT NEW.business_area OR OLD.revenue IS NOT NEW.revenue
+             OR OLD.employees IS NOT NEW.employees
+           BEGIN {mark_dirty_months(f"SELECT {_month('award_date')} AS month FROM procurements "
+                                    f"WHERE winner_org_nr IN (OLD.org_nr, NEW.org_nr)")} END'''
+    ]),
+    (4, 'Normalise winner_org_nr to NNNNNN-NNNN so it joins companies.org_nr', [
+        f'''UPDATE procurements SET winner_org_nr = substr({_ORG_DIGITS}, 1, 6) || '-' || substr({_ORG_DIGITS}, 7)
+           WHERE length({_ORG_DIGITS}) = 10 AND {_ORG_DIGITS} NOT GLOB '*[^0-9]*'
+             AND winner_org_nr != substr({_ORG_DIGITS}, 1, 6) || '-' || substr({_ORG_DIGITS}, 7)'''
+    ]),
+    (5, 'Change feed: monotonic sequence numbers on anomalies and consumer cursors', [
+        add_column('anomalies', 'seq', 'INTEGER'),
+        # Befintliga rader får sekvens i insättningsordning
+        'UPDATE anomalies SET seq = id WHERE seq IS NULL',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_anomalies_seq ON anomalies (seq)',
+        # Nya rader och rader vars innehåll ändras hamnar sist i flödet
+        f'''CREATE TRIGGER IF NOT EXISTS anomalies_feed_insert AFTER INSERT ON anomalies
+           WHEN NEW.seq IS NULL
+           BEGIN {_NEXT_ANOMALY_SEQ} END''',
+        f'''CREATE TRIGGER IF NOT EXISTS anomalies_feed_update
+           AFTER UPDATE OF procurement_id, anomaly_type, description, risk_score ON anomalies
+           WHEN OLD.procurement_id IS NOT NEW.procurement_id OR OLD.anomaly_type IS NOT NEW.anomaly_type
+             OR OLD.description IS NOT NEW.description OR OLD.risk_score IS NOT NEW.risk_score
+           BEGIN {_NEXT_ANOMALY_SEQ} END''',
+        # Läsposition per konsument (t.ex. schemaläggarens larm)
+        '''CREATE TABLE IF NOT EXISTS feed_cursors (
+               name TEXT PRIMARY KEY,
+               seq INTEGER NOT NULL,
+               updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+           )'''
+    ]),
+    (6, 'Edit counter so the supplier graph can tell appended rows from rewritten or deleted ones', [
+        '''CREATE TABLE IF NOT EXISTS procurement_edits (
+               id INTEGER PRIMARY KEY CHECK (id = 1),
+               edits INTEGER NOT NULL
+           )''',
+        'INSERT INTO procurement_edits (id, edits) SELECT 1, 0 WHERE NOT EXISTS (SELECT 1 FROM procurement_edits)',
+        # Nya rader läses via id; endast ändrade grafkolumner och borttag räknas
+        '''CREATE TRIGGER IF NOT EXISTS procurements_graph_update
+           AFTER UPDATE OF contracting_authority, winner_name, value, award_date ON procurements
+           WHEN OLD.contracting_authority IS NOT NEW.contracting_authority
+             OR OLD.winner_name IS NOT NEW.winner_name OR OLD.value IS NOT NEW.value
+             OR OLD.award_date IS NOT NEW.award_date
+           BEGIN UPDATE procurement_edits SET edits = edits + 1 WHERE id = 1; END''',
+        '''CREATE TRIGGER IF NOT EXISTS procurements_graph_delete AFTER DELETE ON procurements
+           BEGIN UPDATE procurement_edits SET edits = edits + 1 WHERE id = 1; END'''
+    ]),
+    (7, 'Inverted person index over board members (person -> companies, roles, dates)', [
+        '''CREATE TABLE IF NOT EXISTS person_index (
+               person_key TEXT NOT NULL,
+               board_member_id INTEGER NOT NULL,
+               name_key TEXT NOT NULL,
+               company_org_nr TEXT NOT NULL,
+               name TEXT NOT NULL,
+               role TEXT,
+               appointment_date TEXT,
+               PRIMARY KEY (person_key, board_member_id)
+           ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_person_index_name_key ON person_index (name_key)',
+        'CREATE INDEX IF NOT EXISTS idx_person_index_company ON person_index (company_org_nr)',
+        # Normaliseringen görs i Python; befintliga styrelser indexeras en gång här
+        rebuild_index
+    ]),
+    (8, 'Change sequence on procurements so incremental analysis sees rows updated in place', [
+        add_column('procurements', 'updated_seq', 'INTEGER'),
+        # Endast uppdaterade rader har sekvens; nya rader läses via id
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_procurements_updated_seq '
+        'ON procurements (updated_seq) WHERE updated_seq IS NOT NULL',
+        f'''CREATE TRIGGER IF NOT EXISTS procurements_change_seq
+           AFTER UPDATE OF {', '.join(ANALYSED_COLUMNS)} ON procurements
+           WHEN {' OR '.join(f'OLD.{column} IS NOT NEW.{column}' for column in ANALYSED_COLUMNS)}
+           BEGIN {_NEXT_PROCUREMENT_SEQ} END'''
+    ]),
+    (9, 'Shared response-cache generation bumped by every write to cached tables', [
+        # Alla processer (gunicorn-arbetare, schemaläggaren) ser samma generation
+        '''CREATE TABLE IF NOT EXISTS cache_generation (
+               id INTEGER PRIMARY KEY CHECK (id = 1),
+               generation INTEGER NOT NULL
+           )''',
+        'INSERT INTO cache_generation (id, generation) SELECT 1, 0 WHERE NOT EXISTS (SELECT 1 FROM cache_generation)'
+    ]),
+    (10, 'Anomaly sort indexes on COALESCE(risk_score, 0) so keyset pages keep unscored rows', [
+        'DROP INDEX IF EXISTS idx_anomalies_type_detected_risk',
+        'DROP INDEX IF EXISTS idx_anomalies_detected_risk',
+        'CREATE INDEX IF NOT EXISTS idx_anomalies_type_detected_risk_key '
+        'ON anomalies (anomaly_type, detected_at, COALESCE(risk_score, 0))',
+        'CREATE INDEX IF NOT EXISTS idx_anomalies_detected_risk_key '
+        'ON anomalies (detected_at, COALESCE(risk_score, 0))',
+        'ANALYZE'
+    ]),
+    (11, 'Fingerprint of the secret person keys were derived with', [
+        # PersonIndex bygger om indexet när fingeravtrycket saknas eller inte stämmer
+        '''CREATE TABLE IF NOT EXISTS person_index_keys (
+               id INTEGER PRIMARY KEY CHECK (id = 1),
+               fingerprint TEXT NOT NULL
+           )'''
+    ]),
+    (12, 'Detector details (JSON) stored with each anomaly', [
+        add_column('anomalies', 'details', 'TEXT')
+    ]),
+    (13, 'Drop per-row cache generation triggers; writers bump once per transaction', [
+        # Tidiga versioner av migrering 9 skapade triggers per rad och händelse
+        *[f'DROP TRIGGER IF EXISTS {table}_cache_{event}'
+          for table in ('procurements', 'anomalies') for event in ('insert', 'update', 'delete')]
+    ]),
+    (14, 'Repeat-detection index so the change feed finds an earlier identical anomaly by lookup', [
+        # Aggregerade anomalier saknar procurement_id; utan typ och beskrivning i nyckeln
+        # läste varje prob alla NULL-rader
+        'CREATE INDEX IF NOT EXISTS idx_anomalies_repeat '
+        'ON anomalies (anomaly_type, procurement_id, description, seq)',
+        'ANALYZE anomalies'
+    ])
+]
+
+def init_migrations_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def current_version(pool) -> int:
+    """Högsta tillämpade migreringsversion"""
+    with pool.connection() as conn:
+        init_migrations_table(conn)
+        return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_migrations').fetchone()[0]
+
+
+def apply_migrations(pool, migrations: List[Migration] = MIGRATIONS) -> List[int]:
+    """Kör migreringar som inte redan tillämpats; returnerar tillämpade versioner"""
+    applied = []
+    version = current_version(pool)
+    for migration_version, description, steps in sorted(migrations, key=lambda m: m[0]):
+        if migration_version <= version:
+            continue
+        with pool.connection() as conn:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute('INSERT INTO schema_migrations (version, description) VALUES (?, ?)',
+                         (migration_version, description))
+        logger.info(f"Applied schema migration {migration_version}: {description}")
+        applied.append(migration_version)
+    return applied
+
+
+def main():
+    from db_pool import get_pool
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    pool = get_pool(sys.argv[1] if len(sys.argv) > 1 else 'nyhetsportalen.db')
+
+    applied = apply_migrations(pool)
+    print(f"Schema version {current_version(pool)} ({len(applied)} migrations applied now)")
+
+
+if __name__ == '__main__':
+    main()
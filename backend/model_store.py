@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Modellager för Nyhetsportalens ML-detektion
+Sparar tränad scaler och IsolationForest på disk med ett datafingeravtryck,
+så att rutinmässig poängsättning bara behöver köra decision_function på nya rader.
+"""
+
+import os
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+import joblib
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# När en sparad modell ska tränas om
+MODEL_MAX_AGE_HOURS = float(os.environ.get('ML_MODEL_MAX_AGE_HOURS', 24 * 7))
+REFIT_GROWTH_RATIO = float(os.environ.get('ML_REFIT_GROWTH_RATIO', 0.25))
+DRIFT_THRESHOLD = float(os.environ.get('ML_DRIFT_THRESHOLD', 0.5))
+DRIFT_MIN_ROWS = 50
+
+
+def data_fingerprint(frame: pd.DataFrame) -> str:
+    """Fingeravtryck för träningsdata: antal rader, högsta id och värdesumma"""
+    summary = f"{len(frame)}|{int(frame['id'].max()) if len(frame) else 0}|{float(frame['value'].sum()):.2f}"
+    return hashlib.sha1(summary.encode()).hexdigest()
+
+
+class StoredModel:
+    """En tränad scaler och modell med metadata"""
+
+    def __init__(self, scaler, model, metadata: Dict):
+        self.scaler = scaler
+        self.model = model
+        self.metadata = metadata
+
+    def score(self, X: pd.DataFrame) -> np.ndarray:
+        """decision_function på redan byggda features (negativt = avvikande)"""
+        return self.model.decision_function(self.scaler.transform(X))
+
+    def drift(self, X: pd.DataFrame, exclude: Iterable[str] = ()) -> float:
+        """
+        Största medelförskjutning per feature i träningens standardavvikelser.
+        exclude anger features som väntas förskjutas, t.ex. tid för nya rader.
+        """
+        if len(X) < DRIFT_MIN_ROWS:
+            return 0.0
+        shift = np.abs(self.scaler.transform(X).mean(axis=0))
+        keep = ~X.columns.isin(list(exclude))
+        return float(shift[keep].max()) if keep.any() else 0.0
+
+
+class ModelStore:
+    """Tränade modeller på disk, metadata i SQLite"""
+
+    def __init__(self, pool, directory: str):
+        self.pool = pool
+        self.directory = directory
+        self._cache: Dict[str, StoredModel] = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.init_table()
+
+    def init_table(self):
+        """Skapa metadatatabell"""
+        with self.pool.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS ml_models (
+                    name TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    path TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    feature_columns TEXT NOT NULL,
+                    trained_rows INTEGER NOT NULL,
+                    trained_max_id INTEGER NOT NULL,
+                    scored_max_id INTEGER NOT NULL,
+                    refit_reason TEXT,
+                    trained_at TIMESTAMP NOT NULL
+                )
+            ''')
+
+    def _metadata(self, name: str) -> Optional[Dict]:
+        with self.pool.connection() as conn:
+            cursor = conn.execute('SELECT * FROM ml_models WHERE name = ?', (name,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([description[0] for description in cursor.description], row))
+
+    def load(self, name: str) -> Optional[StoredModel]:
+        """Senaste sparade modell (avpicklas en gång per version)"""
+        metadata = self._metadata(name)
+        if metadata is None:
+            return None
+        with self._lock:
+            cached = self._cache.get(name)
+            if cached is None or cached.metadata['version'] != metadata['version']:
+                try:
+                    scaler, model = joblib.load(metadata['path'])
+                except (OSError, EOFError) as e:
+                    logger.warning(f"Stored model {name} could not be loaded: {e}")
+                    return None
+                cached = StoredModel(scaler, model, metadata)
+                self._cache[name] = cached
+            cached.metadata = metadata
+            return cached
+
+    def save(self, name: str, scaler, model, fingerprint: str, feature_columns: List[str],
+             trained_rows: int, trained_max_id: int, refit_reason: str) -> StoredModel:
+        """Spara en nytränad modell; filen skrivs atomiskt innan metadata uppdateras"""
+        previous = self._metadata(name)
+        version = previous['version'] + 1 if previous else 1
+        path = os.path.join(self.directory, f'{name}-v{version}.joblib')
+        tmp_path = path + '.tmp'
+        joblib.dump((scaler, model), tmp_path)
+        os.replace(tmp_path, path)
+
+        metadata = {
+            'name': name,
+            'version': version,
+            'path': path,
+            'fingerprint': fingerprint,
+            'feature_columns': ','.join(feature_columns),
+            'trained_rows': int(trained_rows),
+            'trained_max_id': int(trained_max_id),
+            'scored_max_id': int(trained_max_id),
+            'refit_reason': refit_reason,
+            'trained_at': datetime.now().isoformat()
+        }
+        with self.pool.connection() as conn:
+            conn.execute(f'''
+                INSERT OR REPLACE INTO ml_models ({', '.join(metadata)})
+                VALUES ({', '.join('?' for _ in metadata)})
+            ''', tuple(metadata.values()))
+
+        if previous and previous['path'] != path and os.path.exists(previous['path']):
+            os.remove(previous['path'])
+
+        stored = StoredModel(scaler, model, metadata)
+        with self._lock:
+            self._cache[name] = stored
+        logger.info(f"Saved model {name} v{version} trained on {trained_rows} rows ({refit_reason})")
+        return stored
+
+    def mark_scored(self, name: str, scored_max_id: int):
+        """Flytta fram högsta poängsatta id"""
+        with self.pool.connection() as conn:
+            conn.execute('UPDATE ml_models SET scored_max_id = MAX(scored_max_id, ?) WHERE name = ?',
+                         (int(scored_max_id), name))
+
+    def refit_reason(self, stored: Optional[StoredModel], feature_columns: List[str],
+                     frame: pd.DataFrame, X_new: pd.DataFrame,
+                     drift_exclude: Iterable[str] = ()) -> Optional[str]:
+        """
+        Varför modellen måste tränas om, eller None om den kan återanvändas.
+        frame är hela det träningsbara urvalet (id, value), X_new features för nya rader.
+        """
+        if stored is None:
+            return 'missing'
+        metadata = stored.metadata
+        if metadata['feature_columns'] != ','.join(feature_columns):
+            return 'features_changed'
+        if data_fingerprint(frame[frame['id'] <= metadata['trained_max_id']]) != metadata['fingerprint']:
+            return 'data_changed'
+        if datetime.now() - datetime.fromisoformat(metadata['trained_at']) > timedelta(hours=MODEL_MAX_AGE_HOURS):
+            return 'schedule'
+        if len(frame) - metadata['trained_rows'] > REFIT_GROWTH_RATIO * metadata['trained_rows']:
+            return 'growth'
+        if stored.drift(X_new, drift_exclude) > DRIFT_THRESHOLD:
+            return 'drift'
+        return None
+
+    def stats(self) -> List[Dict]:
+        """Metadata för alla sparade modeller"""
+        with self.pool.connection() as conn:
+            cursor = conn.execute('SELECT * FROM ml_models ORDER BY name')
+            columns = [description[0] for description in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Keyset-paginering (cursor) för Nyhetsportalens list-routes
+Nästa sida hämtas med ett opakt token som kodar sorteringsnyckeln för sista raden,
+så att djupa sidor kostar lika mycket som den första.
+"""
+
+import json
+import base64
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlencode
+
+from flask import Response, jsonify, request
+
+
+def encode_cursor(values: Sequence) -> str:
+    """Opakt token för en sorteringsnyckel"""
+    raw = json.dumps(list(values), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token: str, length: int) -> List:
+    """Avkoda ett token; ValueError om det är ogiltigt"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def _row_before(columns: Sequence[str], values: Sequence) -> Tuple[str, List]:
+    """Villkor för rader efter nyckeln i fallande ordning"""
+    if len(columns) == 1:
+        return f'{columns[0]} < ?', list(values)
+    return f"({', '.join(columns)}) < ({', '.join('?' for _ in columns)})", list(values)
+
+
+def keyset_query(base_sql: str, where: List[str], params: List, sort_columns: Sequence[str],
+                 cursor: Optional[List], limit: int, nullable_first: bool = False) -> Tuple[str, List]:
+    """
+    Bygg SQL för en sida sorterad fallande på sort_columns (sista kolumnen unik).
+    Med nullable_first kommer rader där första kolumnen är NULL sist, som i SQLites DESC-ordning.
+    """
+    def select(conditions: List[str], condition_params: List, columns: Sequence[str]) -> Tuple[str, List]:
+        sql = base_sql
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY ' + ', '.join(f'{column} DESC' for column in columns) + ' LIMIT ?'
+        return sql, [*params, *condition_params, limit]
+
+    if cursor is None:
+        return select(where, [], sort_columns)
+
+    first, rest = sort_columns[0], sort_columns[1:]
+    if not nullable_first:
+        condition, values = _row_before(sort_columns, cursor)
+        return select(where + [condition], values, sort_columns)
+
+    if cursor[0] is None:
+        # Redan inne bland raderna utan värde i första kolumnen
+        condition, values = _row_before(rest, cursor[1:])
+        return select(where + [f'{first} IS NULL', condition], values, rest)
+
+    condition, values = _row_before(sort_columns, cursor)
+    valued_sql, valued_params = select(where + [condition], values, sort_columns)
+    null_sql, null_params = select(where + [f'{first} IS NULL'], [], rest)
+    return (f'SELECT * FROM ({valued_sql}) UNION ALL SELECT * FROM ({null_sql}) LIMIT ?',
+            [*valued_params, *null_params, limit])
+
+
+def page_cursor() -> Optional[str]:
+    """Token från query-parametern cursor"""
+    return request.args.get('cursor') or None
+
+
+def paginated_response(results: List[Dict], key_columns: Sequence[str], limit: int) -> Response:
+    """
+    JSON-lista med nästa sidas token i X-Next-Cursor och Link.
+    Token sätts bara när sidan är full.
+    """
+    response = jsonify(results)
+    if limit > 0 and len(results) == limit:
+        token = encode_cursor([results[-1][column] for column in key_columns])
+        args = request.args.to_dict()
+        args['cursor'] = token
+        query = urlencode(args)
+        response.headers['X-Next-Cursor'] = token
+        response.headers['Link'] = f'<{request.path}?{query}>; rel="next"'
+    return response
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Inverterat personindex över styrelseledamöter för Nyhetsportalen
+Varje rad i board_members indexeras under en normaliserad personidentitet
+(person_index, migrering 7), så att alla företag, roller och tillträdesdatum för en
+person – och företagens upphandlingsvinster – hämtas med indexuppslag i stället
+för att skanna styrelsetabellen. Indexet skrivs om per företag när
+företagscachen sparar ett företag.
+
+Personnummer lagras aldrig: nyckeln är en HMAC med PERSON_KEY_SECRET, så den går inte
+att räkna tillbaka till numret utan hemligheten. Byts hemligheten byggs indexet om.
+"""
+
+import os
+import re
+import hmac
+import hashlib
+import logging
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+from db_pool import placeholders
+
+logger = logging.getLogger(__name__)
+
+# Serverhemlighet för personnummernycklar; utan den används personnummer inte som nyckel
+PERSON_KEY_SECRET = os.environ.get('PERSON_KEY_SECRET', '')
+if PERSON_KEY_SECRET.startswith('your_'):
+    # Platshållare från en kopierad exempelfil är offentlig och räknas som ej satt
+    logger.warning("Ignoring PERSON_KEY_SECRET: placeholder value from .env.example")
+    PERSON_KEY_SECRET = ''
+if not PERSON_KEY_SECRET:
+    logger.warning("PERSON_KEY_SECRET not set - board members are keyed by name only")
+
+PERSON_WINS_LIMIT = 50
+
+# Högst så många personer per namnsökning (vanliga namn delas av många)
+PERSON_MATCH_LIMIT = 25
+
+# Ord av bokstäver, med bindestreck/apostrof endast inuti ordet (Anna-Karin, O'Brien)
+_NAME_WORD = re.compile(r"[^\W\d_]+(?:['-][^\W\d_]+)*")
+
+
+def normalize_name(name: Optional[str]) -> str:
+    """Namn i gemener utan skiljetecken; 'Efternamn, Förnamn' vänds till 'förnamn efternamn'"""
+    if not name:
+        return ''
+    name = unicodedata.normalize('NFKC', name).casefold()
+    if name.count(',') == 1:
+        last, first = name.split(',')
+        name = f'{first} {last}'
+    return ' '.join(_NAME_WORD.findall(name))
+
+
+def normalize_personal_nr(personal_nr: Optional[str]) -> Optional[str]:
+    """Personnummer som tio siffror (ÅÅMMDDNNNN), None om det inte går att tolka"""
+    digits = re.sub(r'\D', '', personal_nr or '')
+    if len(digits) == 12:
+        digits = digits[2:]
+    return digits if len(digits) == 10 else None
+
+
+def _keyed_hash(value: str) -> str:
+    return hmac.new(PERSON_KEY_SECRET.encode(), value.encode(), hashlib.sha256).hexdigest()[:24]
+
+
+def key_fingerprint() -> str:
+    """Identifierar hemligheten nycklarna skapats med ('' utan hemlighet)"""
+    return _keyed_hash('person_index') if PERSON_KEY_SECRET else ''
+
+
+def person_key(name: Optional[str], personal_nr: Optional[str] = None) -> Optional[str]:
+    """
+    Personidentitet: HMAC av personnumret om det finns och en hemlighet är satt
+    (numret lagras då inte i indexet eller visas i API:t), annars det normaliserade namnet.
+    """
+    digits = normalize_personal_nr(personal_nr)
+    if digits and PERSON_KEY_SECRET:
+        return 'pnr:' + _keyed_hash(digits)
+    normalized = normalize_name(name)
+    return f'name:{normalized}' if normalized else None
+
+
+def _index_rows(rows) -> List[tuple]:
+    """board_members-rader (id, company_org_nr, name, role, appointment_date, personal_nr) till indexrader"""
+    indexed = []
+    for member_id, org_nr, name, role, appointment_date, personal_nr in rows:
+        key = person_key(name, personal_nr)
+        if key:
+            indexed.append((key, member_id, normalize_name(name), org_nr, name, role, appointment_date))
+    return indexed
+
+
+_MEMBER_SQL = 'SELECT id, company_org_nr, name, role, appointment_date, personal_nr FROM board_members'
+
+_INSERT_SQL = '''
+    INSERT OR REPLACE INTO person_index
+    (person_key, board_member_id, name_key, company_org_nr, name, role, appointment_date)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def index_company(conn, org_nr: str):
+    """Skriv om indexet för ett företags styrelse (anropas i samma transaktion som styrelsen skrivs)"""
+    conn.execute('DELETE FROM person_index WHERE company_org_nr = ?', (org_nr,))
+    conn.executemany(_INSERT_SQL, _index_rows(conn.execute(_MEMBER_SQL + ' WHERE company_org_nr = ?', (org_nr,))))
+
+
+def rebuild_index(conn):
+    """Bygg om hela indexet från board_members"""
+    conn.execute('DELETE FROM person_index')
+    cursor = conn.execute(_MEMBER_SQL + ' WHERE company_org_nr IS NOT NULL')
+    while True:
+        rows = cursor.fetchmany(10000)
+        if not rows:
+            break
+        conn.executemany(_INSERT_SQL, _index_rows(rows))
+
+
+COMPANY_WINS_SQL = '''
+    SELECT winner_org_nr, COUNT(*), SUM(value), MAX(award_date) FROM procurements
+    WHERE winner_org_nr IN ({marks}) GROUP BY winner_org_nr
+'''
+
+RECENT_WINS_SQL = '''
+    SELECT id, title, contracting_authority, winner_name, winner_org_nr, value, award_date
+    FROM procurements WHERE winner_org_nr IN ({marks})
+    ORDER BY award_date DESC, id DESC LIMIT ?
+'''
+
+
+def lookup_query(name: Optional[str] = None, personal_nr: Optional[str] = None,
+                 key: Optional[str] = None, match_limit: int = PERSON_MATCH_LIMIT) -> Tuple[str, tuple]:
+    """SQL för indexrader som matchar personnummer, personnyckel eller namn"""
+    if personal_nr:
+        if not PERSON_KEY_SECRET:
+            raise ValueError('Personal number lookup is disabled (PERSON_KEY_SECRET not set)')
+        key = person_key(None, personal_nr)
+        if key is None:
+            raise ValueError('Invalid personal number')
+    if key:
+        where, params = 'person_key = ?', (key,)
+    elif normalize_name(name):
+        where = 'person_key IN (SELECT DISTINCT person_key FROM person_index WHERE name_key = ? LIMIT ?)'
+        params = (normalize_name(name), match_limit)
+    else:
+        raise ValueError('A name, personal number or person key is required')
+    return f'''
+        SELECT person_key, company_org_nr, name, role, appointment_date FROM person_index
+        WHERE {where} ORDER BY person_key, company_org_nr, appointment_date
+    ''', params
+
+
+class PersonIndex:
+    """Uppslag från person till företag, roller och upphandlingsvinster"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.ensure_keys()
+
+    def ensure_keys(self) -> bool:
+        """Bygg om indexet om nycklarna skapats med en annan hemlighet; True om det byggdes om"""
+        fingerprint = key_fingerprint()
+        with self.pool.connection() as conn:
+            # Skrivlåset först, så att bara en process bygger om
+            if not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT fingerprint FROM person_index_keys WHERE id = 1').fetchone()
+            if row is not None and row[0] == fingerprint:
+                return False
+            rebuild_index(conn)
+            conn.execute('INSERT OR REPLACE INTO person_index_keys (id, fingerprint) VALUES (1, ?)',
+                         (fingerprint,))
+        logger.info("Rebuilt person index with the current person key secret")
+        return True
+
+    def lookup(self, name: Optional[str] = None, personal_nr: Optional[str] = None,
+               key: Optional[str] = None, wins_limit: int = PERSON_WINS_LIMIT,
+               match_limit: int = PERSON_MATCH_LIMIT) -> List[Dict]:
+        """
+        Personer som matchar personnummer, personnyckel eller namn. Ett namn kan
+        motsvara flera personer (olika personnummer); varje person returneras med
+        alla sina företag, även där namnet stavats annorlunda.
+        """
+        sql, params = lookup_query(name, personal_nr, key, match_limit)
+        with self.pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+            org_nrs = sorted({row[1] for row in rows})
+            companies, wins = {}, {}
+            if org_nrs:
+                marks = placeholders(org_nrs)
+                companies = dict(conn.execute(
+                    f'SELECT org_nr, name FROM companies WHERE org_nr IN ({marks})', org_nrs).fetchall())
+                for org_nr, count, total, last_win in conn.execute(COMPANY_WINS_SQL.format(marks=marks), org_nrs):
+                    wins[org_nr] = {'wins': count, 'total_value': total, 'last_win': last_win}
+
+            people: Dict[str, Dict] = {}
+            for key, org_nr, member_name, role, appointment_date in rows:
+                person = people.setdefault(key, {'person_key': key, 'names': [], 'companies': {}})
+                if member_name not in person['names']:
+                    person['names'].append(member_name)
+                company = person['companies'].setdefault(org_nr, {
+                    'org_nr': org_nr,
+                    'name': companies.get(org_nr),
+                    'roles': [],
+                    **wins.get(org_nr, {'wins': 0, 'total_value': None, 'last_win': None})
+                })
+                company['roles'].append({'role': role, 'appointment_date': appointment_date})
+
+            for person in people.values():
+                person['companies'] = list(person['companies'].values())
+                person_org_nrs = [company['org_nr'] for company in person['companies']]
+                person['total_wins'] = sum(company['wins'] for company in person['companies'])
+                person['total_value'] = sum(company['total_value'] or 0 for company in person['companies'])
+                cursor = conn.execute(RECENT_WINS_SQL.format(marks=placeholders(person_org_nrs)),
+                                      (*person_org_nrs, wins_limit))
+                columns = [description[0] for description in cursor.description]
+                person['procurements'] = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        return list(people.values())
+
+    def stats(self) -> Dict:
+        """Indexets storlek"""
+        with self.pool.connection() as conn:
+            entries, people, companies = conn.execute('''
+                SELECT COUNT(*), COUNT(DISTINCT person_key), COUNT(DISTINCT company_org_nr) FROM person_index
+            ''').fetchone()
+        return {'entries': entries, 'people': people, 'companies': companies}
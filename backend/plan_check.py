@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Kontroll av frågeplaner för API-routes
+SQL:en byggs med samma funktioner och konstanter som routes använder och planeras med
+EXPLAIN QUERY PLAN i en nymigrerad temporär databas. Ett SCAN-steg utan index ger FAIL
+och exitkod 1, utom de helskanningar som står i ALLOWED_SCANS; frågor i REQUIRED_INDEXES
+måste dessutom använda sitt index.
+
+Körs manuellt: python plan_check.py
+"""
+
+import os
+import sys
+import tempfile
+from typing import Dict, List, Tuple
+
+# Avsiktliga helskanningar: (fråga, plansteg) -> motivering
+ALLOWED_SCANS: Dict[Tuple[str, str], str] = {
+    ('export procurements', 'SCAN procurements'): 'ofiltrerad export läser hela tabellen i id-ordning',
+    ('export anomalies', 'SCAN a'): 'ofiltrerad export läser hela tabellen i id-ordning'
+}
+
+# Frågor som måste använda ett visst index: fråga -> indexnamn
+REQUIRED_INDEXES: Dict[str, str] = {
+    'anomaly changes without repeats': 'idx_anomalies_repeat'
+}
+
+
+def route_queries(portal) -> Dict[str, Tuple[str, List]]:
+    """Routes SQL och exempelparametrar, byggda som i app.py"""
+    from anomaly_feed import changes_query
+    from concentration import top_query
+    from export_stream import export_query
+    from person_index import lookup_query, COMPANY_WINS_SQL, RECENT_WINS_SQL
+    from shared_directors import MEMBERSHIP_SQL, AWARDS_SQL
+
+    org_nrs = ['556000-0000', '556000-0001']
+    queries = {
+        'procurements': portal.procurement_page_query(None, None, 50),
+        'procurements by municipality': portal.procurement_page_query('Stockholm', None, 50),
+        'procurements next page': portal.procurement_page_query(None, ['2024-01-01', 1000], 50),
+        'procurements next page by municipality':
+            portal.procurement_page_query('Stockholm', ['2024-01-01', 1000], 50),
+        'procurements next page without date': portal.procurement_page_query(None, [None, 1000], 50),
+        'anomalies': portal.anomaly_page_query(None, None, 100),
+        'anomalies by type': portal.anomaly_page_query('Prisavvikelse', None, 100),
+        'anomalies next page': portal.anomaly_page_query(None, ['2024-01-01', 5.0, 1000], 100),
+        'anomalies next page by type': portal.anomaly_page_query('Prisavvikelse', ['2024-01-01', 5.0, 1000], 100),
+        'anomaly changes': changes_query(1000, 2000, 100),
+        'anomaly changes without repeats': changes_query(1000, 2000, 100, min_risk=5.0, repeats=False),
+        'concentration top': top_query('authority', 365, 50, 10, 'hhi'),
+        'concentration top by municipality': top_query('municipality', 365, 50, 10, 'top_share'),
+        'shared director memberships': (MEMBERSHIP_SQL, []),
+        'shared director awards': (AWARDS_SQL.format(marks='?, ?'), org_nrs),
+        'person by key': lookup_query(key='name:anna andersson'),
+        'person by name': lookup_query(name='Anna Andersson'),
+        'person company wins': (COMPANY_WINS_SQL.format(marks='?, ?'), org_nrs),
+        'person recent wins': (RECENT_WINS_SQL.format(marks='?, ?'), [*org_nrs, 50]),
+        'company board': ('SELECT * FROM board_members WHERE company_org_nr = ? ORDER BY id', ['5560000000'])
+    }
+    for name, sql in portal.ANOMALY_STATS_SQL.items():
+        queries[f'anomaly stats {name}'] = (sql, [])
+    for dataset in portal.EXPORT_DATASETS:
+        queries[f'export {dataset}'] = export_query(dataset, {})
+    queries['export procurements by municipality'] = export_query('procurements', {'municipality': 'Stockholm'})
+    queries['export anomalies by type'] = export_query('anomalies', {'type': 'Prisavvikelse'})
+    return queries
+
+
+def plan(conn, sql: str, params) -> List[str]:
+    """Planstegen för en fråga"""
+    return [row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+
+def full_scans(steps: List[str]) -> List[str]:
+    """Plansteg som läser en tabell utan index"""
+    # 'SCAN (subquery-n)' läser en delfrågas resultat, inte en tabell
+    return [step for step in steps
+            if step.startswith('SCAN') and not step.startswith('SCAN (') and 'USING' not in step]
+
+
+def check(name: str, ok: bool, detail=''):
+    print(f"{'PASS' if ok else 'FAIL'}  {name} {detail}")
+    return ok
+
+
+def main() -> int:
+    # app skapar och migrerar databasen i arbetskatalogen vid import
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(tempfile.mkdtemp(prefix='plan_check_'))
+    import app as portal
+
+    results = []
+    with portal.db_manager.connection() as conn:
+        for name, (sql, params) in route_queries(portal).items():
+            steps = plan(conn, sql, params)
+            scans = [scan for scan in full_scans(steps) if (name, scan) not in ALLOWED_SCANS]
+            results.append(check(name, not scans, '; '.join(scans)))
+            if name in REQUIRED_INDEXES:
+                index = REQUIRED_INDEXES[name]
+                uses = any(f' {index} ' in step for step in steps)
+                results.append(check(f'{name} uses {index}', uses, '' if uses else '; '.join(steps)))
+    return 0 if all(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Vektoriserad prisavvikelsemotor för Nyhetsportalen
+Gruppstatistik per rad via groupby().transform och flaggning med booleska masker
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def group_value_stats(df: pd.DataFrame, group_column: str, value_column: str = 'value',
+                      quantiles: bool = True) -> pd.DataFrame:
+    """
+    Statistik för varje rads grupp, indexerad som df.
+    Ger count, mean, std (stickprov) och vid behov q1/q3.
+    """
+    grouped = df.groupby(group_column, observed=True, sort=False)[value_column]
+    stats = pd.DataFrame({
+        'count': grouped.transform('size'),
+        'mean': grouped.transform('mean'),
+        'std': grouped.transform('std')
+    }, index=df.index)
+    if quantiles:
+        stats['q1'] = grouped.transform('quantile', 0.25)
+        stats['q3'] = grouped.transform('quantile', 0.75)
+    return stats
+
+
+def z_scores(values: pd.Series, stats: pd.DataFrame) -> pd.Series:
+    """|x - medel| / std, 0 där std saknas eller är 0"""
+    std = stats['std']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = (values - stats['mean']).abs() / std
+    return z.where(std > 0, 0.0)
+
+
+def iqr_or_z_outliers(values: pd.Series, stats: pd.DataFrame, z: pd.Series,
+                      iqr_factor: float = 1.5, z_threshold: float = 2.5) -> pd.Series:
+    """Utanför IQR-gränserna eller över z-tröskeln"""
+    iqr = stats['q3'] - stats['q1']
+    upper = stats['q3'] + iqr_factor * iqr
+    lower = stats['q1'] - iqr_factor * iqr
+    return (values > upper) | (values < lower) | (z > z_threshold)
+
+
+def sigma_outliers(values: pd.Series, stats: pd.DataFrame, sigmas: float = 3.0) -> pd.Series:
+    """Mer än sigmas standardavvikelser från gruppmedel"""
+    return ((values > stats['mean'] + sigmas * stats['std']) |
+            (values < stats['mean'] - sigmas * stats['std']))
+
+
+def group_order(df: pd.DataFrame, group_column: str) -> np.ndarray:
+    """
+    Radordning grupp för grupp (grupper i förekomstordning, rader i ursprunglig ordning).
+    Ger samma ordning som en loop över unique() följd av filtrering per grupp.
+    """
+    codes, _ = pd.factorize(df[group_column])
+    return np.argsort(codes, kind='stable')
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Kolumnär snapshot av upphandlingstabellen för Nyhetsportalens analyser
+Materialiserar procurements (med företagsdata via winner_org_nr) till Arrow/Parquet-filer
+partitionerade per tilldelningsmånad. Endast månader som ändrats sedan förra körningen
+skrivs om; ändringarna registreras av triggers i snapshot_dirty_months (migrering 2).
+"""
+
+import os
+import time
+import shutil
+import logging
+import threading
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+    from pyarrow.fs import LocalFileSystem
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+from migrations import apply_migrations
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMATS = {'arrow': 'feather', 'parquet': 'parquet'}
+DEFAULT_SNAPSHOT_FORMAT = os.environ.get('SNAPSHOT_FORMAT', 'arrow')
+
+# Partition för upphandlingar utan tilldelningsdatum
+UNKNOWN_MONTH = 'unknown'
+
+MONTH_EXPRESSION = "COALESCE(substr(p.award_date, 1, 7), '')"
+
+# Fast schema så att alla partitioner har samma typer, även helt tomma kolumner
+SNAPSHOT_COLUMNS = [
+    ('id', 'p.id', 'int64'),
+    ('ted_id', 'p.ted_id', 'string'),
+    ('title', 'p.title', 'string'),
+    ('contracting_authority', 'p.contracting_authority', 'string'),
+    ('winner_name', 'p.winner_name', 'string'),
+    ('winner_org_nr', 'p.winner_org_nr', 'string'),
+    ('value', 'p.value', 'float64'),
+    ('currency', 'p.currency', 'string'),
+    ('award_date', 'p.award_date', 'string'),
+    ('municipality', 'p.municipality', 'string'),
+    ('cpv_codes', 'p.cpv_codes', 'string'),
+    ('source', 'p.source', 'string'),
+    ('created_at', 'p.created_at', 'string'),
+    ('title_length', 'length(p.title)', 'float64'),
+    ('company_name', 'c.name', 'string'),
+    ('company_business_area', 'c.business_area', 'string'),
+    ('company_revenue', 'c.revenue', 'float64'),
+    ('company_employees', 'c.employees', 'float64')
+]
+
+SNAPSHOT_SQL = f'''
+    SELECT {', '.join(f'{expression} AS {name}' for name, expression, _ in SNAPSHOT_COLUMNS)}
+    FROM procurements p
+    LEFT JOIN companies c ON c.org_nr = p.winner_org_nr
+    WHERE {MONTH_EXPRESSION} = ?
+'''
+
+
+def snapshot_schema():
+    """Arrow-schema för snapshotfilerna"""
+    return pa.schema([(name, pa.string() if dtype == 'string' else getattr(pa, dtype)())
+                      for name, _, dtype in SNAPSHOT_COLUMNS])
+
+
+class ProcurementSnapshot:
+    """Månadspartitionerad kolumnär kopia av procurements"""
+
+    def __init__(self, pool, directory: str, snapshot_format: str = DEFAULT_SNAPSHOT_FORMAT):
+        if snapshot_format not in SNAPSHOT_FORMATS:
+            raise ValueError(f"Unknown snapshot format '{snapshot_format}'")
+        self.pool = pool
+        self.directory = directory
+        self.format = snapshot_format
+        self._lock = threading.Lock()
+        apply_migrations(pool)
+        self.init_table()
+
+    def init_table(self):
+        """Skapa tabell över skrivna partitioner"""
+        with self.pool.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS snapshot_partitions (
+                    award_month TEXT PRIMARY KEY,
+                    row_count INTEGER NOT NULL,
+                    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+    def _partition_dir(self, month: str) -> str:
+        return os.path.join(self.directory, f'award_month={month or UNKNOWN_MONTH}')
+
+    def _write_partition(self, conn, month: str) -> int:
+        """Skriv om en månads partition atomiskt; tom månad tas bort"""
+        df = pd.read_sql_query(SNAPSHOT_SQL, conn, params=(month,))
+        partition_dir = self._partition_dir(month)
+        if df.empty:
+            shutil.rmtree(partition_dir, ignore_errors=True)
+            conn.execute('DELETE FROM snapshot_partitions WHERE award_month = ?', (month,))
+            return 0
+
+        for name, _, dtype in SNAPSHOT_COLUMNS:
+            if dtype == 'float64':
+                df[name] = pd.to_numeric(df[name], errors='coerce')
+            elif dtype == 'string':
+                df[name] = df[name].astype(object).where(df[name].isna(), df[name].astype(str))
+        
+        os.makedirs(partition_dir, exist_ok=True)
+        path = os.path.join(partition_dir, f'part.{self.format}')
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        table = pa.Table.from_pandas(df, schema=snapshot_schema(), preserve_index=False)
+        if self.format == 'arrow':
+            # Okomprimerad Arrow IPC kan minnesmappas utan avkodning
+            feather.write_feather(table, tmp_path, compression='uncompressed')
+        else:
+            pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+
+        conn.execute('''
+            INSERT OR REPLACE INTO snapshot_partitions (award_month, row_count, refreshed_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+        ''', (month, len(df)))
+        return len(df)
+
+    def refresh(self, full: bool = False) -> Dict:
+        """
+        Skriv om partitioner för ändrade månader (alla månader första gången eller med full=True).
+        Varje månad avmarkeras i samma transaktion som den läses, så en ändring under
+        körningen markerar månaden igen och tas med nästa gång.
+        """
+        if not PYARROW_AVAILABLE:
+            return {'success': False, 'error': 'pyarrow not installed'}
+
+        start = time.perf_counter()
+        with self._lock:
+            with self.pool.connection() as conn:
+                built = conn.execute('SELECT COUNT(*) FROM snapshot_partitions').fetchone()[0]
+                if built and not os.path.isdir(self.directory):
+                    # Katalogen har tagits bort; bygg om allt
+                    built = 0
+                months = {row[0] for row in conn.execute('SELECT award_month FROM snapshot_dirty_months')}
+                if full or not built:
+                    months.update(row[0] for row in conn.execute(
+                        "SELECT DISTINCT COALESCE(substr(award_date, 1, 7), '') FROM procurements"
+                    ))
+                    months.update(row[0] for row in conn.execute('SELECT award_month FROM snapshot_partitions'))
+            if not built:
+                shutil.rmtree(self.directory, ignore_errors=True)
+
+            rows = 0
+            for month in sorted(months):
+                with self.pool.connection() as conn:
+                    conn.execute('DELETE FROM snapshot_dirty_months WHERE award_month = ?', (month,))
+                    rows += self._write_partition(conn, month)
+
+        result = {
+            'success': True,
+            'mode': 'full' if full or not built else 'incremental',
+            'partitions_written': len(months),
+            'rows_written': rows,
+            'seconds': round(time.perf_counter() - start, 3)
+        }
+        if months:
+            logger.info(f"Refreshed procurement snapshot ({result['mode']}): {len(months)} partitions, "
+                        f"{rows} rows in {result['seconds']:.2f} seconds")
+        return result
+
+    def is_fresh(self) -> bool:
+        """Sant om snapshoten är byggd och inga månader väntar på omskrivning"""
+        with self.pool.connection() as conn:
+            built = conn.execute('SELECT COUNT(*) FROM snapshot_partitions').fetchone()[0]
+            dirty = conn.execute('SELECT COUNT(*) FROM snapshot_dirty_months').fetchone()[0]
+        return bool(built) and not dirty
+
+    def load(self, columns: Optional[List[str]] = None,
+             authorities: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Läs snapshoten som en DataFrame (endast angivna kolumner).
+        Arrow-filer minnesmappas; raderna returneras i id-ordning som i SQLite.
+        """
+        dataset = ds.dataset(self.directory, format=SNAPSHOT_FORMATS[self.format], schema=snapshot_schema(),
+                             filesystem=LocalFileSystem(use_mmap=True))
+        filter_expression = ds.field('contracting_authority').isin(authorities) if authorities is not None else None
+        read_columns = None if columns is None else list(dict.fromkeys(['id', *columns]))
+        table = dataset.to_table(columns=read_columns, filter=filter_expression)
+        df = table.sort_by('id').to_pandas()
+        return df if columns is None else df[columns]
+
+    def stats(self) -> Dict:
+        """Partitioner och väntande månader"""
+        with self.pool.connection() as conn:
+            partitions, rows = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(row_count), 0) FROM snapshot_partitions'
+            ).fetchone()
+            dirty = conn.execute('SELECT COUNT(*) FROM snapshot_dirty_months').fetchone()[0]
+        return {
+            'available': PYARROW_AVAILABLE,
+            'format': self.format,
+            'directory': self.directory,
+            'partitions': partitions,
+            'rows': rows,
+            'dirty_months': dirty
+        }
+
+
+_snapshots: Dict[str, ProcurementSnapshot] = {}
+_snapshots_lock = threading.Lock()
+
+
+def get_snapshot(pool, directory: str, snapshot_format: str = DEFAULT_SNAPSHOT_FORMAT) -> ProcurementSnapshot:
+    """Delad snapshot per katalog, så att alla skrivare i processen går genom samma lås"""
+    key = os.path.abspath(directory)
+    with _snapshots_lock:
+        if key not in _snapshots:
+            _snapshots[key] = ProcurementSnapshot(pool, key, snapshot_format)
+        return _snapshots[key]
+
+
+def default_snapshot_dir(db_path: str) -> str:
+    """Snapshotkatalog, som standard bredvid databasen"""
+    return os.environ.get('SNAPSHOT_DIR') or os.path.join(
+        os.path.dirname(os.path.abspath(db_path)), 'snapshots', 'procurements')
+
+
+def snapshot_enabled() -> bool:
+    """Snapshoten används om pyarrow finns och den inte stängts av"""
+    return PYARROW_AVAILABLE and os.environ.get('SNAPSHOT_ENABLED', 'True').lower() in ('1', 'true', 'yes')
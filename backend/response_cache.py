@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Svarscache för läsintensiva API-routes i Nyhetsportalen
+TTL/LRU-cache i processen nycklad på route och query-argument, ogiltigförklaras
+med en generationsräknare i SQLite (cache_generation, migrering 9) som triggers räknar
+upp vid varje skrivning. Alla processer som delar databasen ser samma generation.
+Stöder ETag/If-None-Match.
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, Dict, Tuple
+
+from flask import Response, request
+
+from migrations import BUMP_CACHE_GENERATION
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL_SECONDS = float(os.environ.get('CACHE_TIMEOUT_MINUTES', 30)) * 60
+DEFAULT_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 512))
+
+# Svarshuvuden från routen som sparas med svaret (t.ex. nästa sidas cursor)
+PASSTHROUGH_HEADERS = ('X-Next-Cursor', 'Link')
+
+
+class ResponseCache:
+    """Cache för färdigrenderade JSON-svar"""
+
+    def __init__(self, ttl: float = DEFAULT_TTL_SECONDS, max_entries: int = DEFAULT_MAX_ENTRIES, pool=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.pool = pool
+        self.local_generation = 0
+        self._entries: 'OrderedDict[Tuple, Tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'evictions': 0, 'invalidations': 0}
+
+    def bind(self, pool):
+        """Läs generationen från databasen bakom pool (utan pool gäller endast processens räknare)"""
+        self.pool = pool
+
+    @property
+    def generation(self) -> Tuple[int, int]:
+        """Aktuell generation: (databasens, processens)"""
+        shared = 0
+        if self.pool is not None:
+            with self.pool.connection() as conn:
+                row = conn.execute('SELECT generation FROM cache_generation WHERE id = 1').fetchone()
+            shared = row[0] if row else 0
+        return shared, self.local_generation
+
+    def bump(self, reason: str = ''):
+        """Ny generation; alla tidigare svar blir inaktuella (även i andra processer)"""
+        if self.pool is not None:
+            with self.pool.connection() as conn:
+                conn.execute(BUMP_CACHE_GENERATION)
+        with self._lock:
+            self.local_generation += 1
+            self._entries.clear()
+            self._stats['invalidations'] += 1
+        logger.info(f"Response cache invalidated (generation {self.generation}{', ' + reason if reason else ''})")
+
+    def _key(self) -> Tuple:
+        return (request.path, tuple(sorted(request.args.items(multi=True))))
+
+    def _lookup(self, key: Tuple, generation: Tuple[int, int]):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] != generation:
+                # Data har skrivits (i någon process) sedan svaret sparades
+                del self._entries[key]
+                self._stats['invalidations'] += 1
+                return None
+            if time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _store(self, key: Tuple, generation: Tuple[int, int], body: bytes, status: int, mimetype: str,
+               headers: Dict[str, str]) -> str:
+        etag = hashlib.sha1(body).hexdigest()
+        with self._lock:
+            # Svaret sparas med generationen det räknades fram under; skrevs data under
+            # tiden missar nästa uppslag eftersom generationen då har ändrats
+            self._entries[key] = (time.monotonic(), generation, body, status, mimetype, etag, headers)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+        return etag
+
+    def _respond(self, body: bytes, status: int, mimetype: str, etag: str,
+                 headers: Dict[str, str], state: str) -> Response:
+        if request.if_none_match.contains(etag):
+            with self._lock:
+                self._stats['not_modified'] += 1
+            response = Response(status=304)
+        else:
+            response = Response(body, status=status, mimetype=mimetype)
+        response.headers.update(headers)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Cache'] = state
+        return response
+
+    def cached(self, view: Callable) -> Callable:
+        """Dekorator för GET-routes vars svar endast ändras vid import eller analys"""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = self._key()
+            generation = self.generation
+            entry = self._lookup(key, generation)
+            if entry is not None:
+                with self._lock:
+                    self._stats['hits'] += 1
+                _, _, body, status, mimetype, etag, headers = entry
+                return self._respond(body, status, mimetype, etag, headers, 'HIT')
+
+            with self._lock:
+                self._stats['misses'] += 1
+            response = view(*args, **kwargs)
+            if isinstance(response, tuple) or response.status_code != 200:
+                return response
+
+            body = response.get_data()
+            headers = {name: response.headers[name] for name in PASSTHROUGH_HEADERS if name in response.headers}
+            etag = self._store(key, generation, body, response.status_code, response.mimetype, headers)
+            return self._respond(body, response.status_code, response.mimetype, etag, headers, 'MISS')
+        return wrapper
+
+    def invalidates(self, view: Callable) -> Callable:
+        """Dekorator för routes som skriver data; cachen töms efter anropet även vid fel"""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                return view(*args, **kwargs)
+            finally:
+                self.bump(request.path)
+        return wrapper
+
+    def stats(self) -> Dict:
+        """Statistik för övervakning"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        stats['generation'], stats['local_generation'] = self.generation
+        stats['ttl_seconds'] = self.ttl
+        stats['max_entries'] = self.max_entries
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        return stats
+
+
+# Delad instans för hela processen
+response_cache = ResponseCache()
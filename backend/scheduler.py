@@ -1,27 +1,39 @@
 #!/usr/bin/env python3
 """
 Automatisk datauppdatering för Nyhetsportalen
-Schemalagd insamling från riktiga svenska datakällor
+Schemalagd insamling från riktiga svenska datakällor.
+APScheduler lägger jobb i den persistenta kön (job_queue i app) som körs av arbetarpoolen här;
+insamling och analys anropas direkt i processen i stället för via API:et. Berikningsjobb
+körs även av webbprocessens arbetare.
 """
 
-import schedule
-import time
 import logging
 import requests
-from datetime import datetime
 import os
 from dotenv import load_dotenv
+from apscheduler.schedulers.blocking import BlockingScheduler
 
-# Ladda miljövariabler
+# Ladda miljövariabler (före app, som läser konfiguration vid import)
 load_dotenv()
 
+from app import (data_collector, db_manager, anomaly_feed, job_queue, BOLAGSVERKET_API_KEY,
+                 ADVANCED_ANOMALY_DETECTION)
+from alert_dispatcher import AlertDispatcher
+
 # Konfiguration
 API_BASE_URL = os.getenv('API_BASE_URL', 'http://localhost:5000')
 UPDATE_INTERVAL_HOURS = int(os.getenv('UPDATE_INTERVAL_HOURS', 6))
 AUTO_UPDATE_ENABLED = os.getenv('AUTO_UPDATE_ENABLED', 'True').lower() == 'true'
+# Timme (0-23) för nattlig sökning efter delade styrelser över hela historiken
+SHARED_DIRECTORS_HOUR = int(os.getenv('SHARED_DIRECTORS_HOUR', 2))
+
+# Larm gäller nya anomalier över tröskeln; läspositionen sparas i feed_cursors
+HIGH_RISK_THRESHOLD = 7
+ALERT_FEED = 'scheduler_alerts'
 
-# Logging
+# Logging (force: app har redan konfigurerat rotloggern vid import)
 logging.basicConfig(
+    force=True,
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
@@ -31,112 +43,141 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def update_procurement_data():
+alert_dispatcher = AlertDispatcher.from_env()
+
+def update_procurement_data(payload: dict) -> dict:
     """Uppdatera upphandlingsdata"""
-    try:
-        logger.info("Starting scheduled procurement data update")
-        
-        response = requests.post(f"{API_BASE_URL}/api/update-data", 
-                               json={'days_back': 7})
-        
-        if response.status_code == 200:
-            result = response.json()
-            logger.info(f"Update successful: {result['contracts_stored']} new contracts")
-            
-            # Skicka notifiering om många nya kontrakt
-            if result['contracts_stored'] > 10:
-                send_alert(f"Många nya upphandlingar: {result['contracts_stored']} kontrakt")
-                
-        else:
-            logger.error(f"Update failed: {response.status_code}")
-            
-    except Exception as e:
-        logger.error(f"Error during update: {e}")
+    days_back = payload.get('days_back', 7)
+    logger.info(f"Starting scheduled procurement data update ({days_back} days back)")
 
-def analyze_new_anomalies():
-    """Analysera nya anomalier"""
-    try:
-        logger.info("Analyzing for new anomalies")
-        
-        response = requests.get(f"{API_BASE_URL}/api/anomalies")
-        
-        if response.status_code == 200:
-            anomalies = response.json()
-            
-            # Kolla efter nya högrisk-anomalier
-            high_risk = [a for a in anomalies if a.get('risk_score', 0) > 7]
-            
-            if high_risk:
-                logger.warning(f"Found {len(high_risk)} high-risk anomalies")
-                send_alert(f"⚠️ {len(high_risk)} högrisk anomalier upptäckta!")
-                
-    except Exception as e:
-        logger.error(f"Error analyzing anomalies: {e}")
+    contracts = data_collector.get_swedish_procurements(days_back)
+    ingest = db_manager.store_procurements(contracts)
+    db_manager.refresh_snapshot()
+    db_manager.refresh_concentration()
+
+    stored_count = ingest['inserted'] + ingest['updated']
+    logger.info(f"Update successful: {stored_count} new contracts")
+
+    # Skicka notifiering om många nya kontrakt
+    if stored_count > 10:
+        send_alert(f"Många nya upphandlingar: {stored_count} kontrakt")
+
+    # Nya rader analyseras och nya vinnare berikas direkt efter importen
+    job_queue.enqueue('analyze_anomalies')
+    if BOLAGSVERKET_API_KEY:
+        job_queue.enqueue('enrich_companies')
+
+    return {'contracts_found': len(contracts), 'contracts_stored': stored_count,
+            'contracts_inserted': ingest['inserted'], 'contracts_updated': ingest['updated']}
+
+def analyze_new_anomalies(payload: dict) -> dict:
+    """Analysera och larma om nya högrisk-anomalier"""
+    logger.info("Analyzing for new anomalies")
+    # Första körningen larmar bara om det som hittas nu, inte om äldre anomalier
+    start_seq = anomaly_feed.latest_seq()
+
+    if ADVANCED_ANOMALY_DETECTION:
+        from app import advanced_detector
+        result = advanced_detector.run_incremental_analysis()
+    else:
+        from anomaly_detector import RealAnomalyDetector
+        result = RealAnomalyDetector(db_manager.db_path).run_full_analysis()
+
+    since = anomaly_feed.position(ALERT_FEED)
+    feed = anomaly_feed.read_all(start_seq if since is None else since,
+                                 min_risk=HIGH_RISK_THRESHOLD, repeats=False)
+    high_risk = feed['changes']
+
+    if high_risk:
+        logger.warning(f"Found {len(high_risk)} new high-risk anomalies")
+        top = sorted(high_risk, key=lambda anomaly: anomaly['risk_score'], reverse=True)[:3]
+        details = '\n'.join(f"• {anomaly['anomaly_type']}: {anomaly['description']} "
+                             f"(risk {anomaly['risk_score']:.1f})" for anomaly in top)
+        send_alert(f"⚠️ {len(high_risk)} nya högrisk-anomalier upptäckta!\n{details}")
+    anomaly_feed.advance(ALERT_FEED, feed['next_since'])
+
+    return {'new_high_risk': len(high_risk), 'feed_seq': feed['next_since'],
+            'stored_anomalies': result.get('stored_anomalies')}
+
+def detect_shared_directors(payload: dict) -> dict:
+    """Nattlig sökning efter konkurrerande leverantörer med gemensamma styrelseledamöter"""
+    if not ADVANCED_ANOMALY_DETECTION:
+        logger.info("Advanced anomaly detection disabled, skipping shared director scan")
+        return {'skipped': True}
+
+    from app import advanced_detector
+    anomalies = advanced_detector.detect_shared_directors()
+    # Högrisklarm går ut via anomaliflödet vid nästa analyze_anomalies
+    return {'anomalies': len(anomalies), 'stored_anomalies': advanced_detector.store_anomalies(anomalies)}
 
 def send_alert(message: str):
-    """Skicka varning via Slack/Discord"""
-    try:
-        slack_webhook = os.getenv('SLACK_WEBHOOK_URL')
-        if slack_webhook:
-            requests.post(slack_webhook, 
-                         json={'text': f"🚨 Nyhetsportalen Alert: {message}"})
-        
-        discord_webhook = os.getenv('DISCORD_WEBHOOK_URL')
-        if discord_webhook:
-            requests.post(discord_webhook,
-                         json={'content': f"🚨 Nyhetsportalen Alert: {message}"})
-            
-        logger.info(f"Alert sent: {message}")
-        
-    except Exception as e:
-        logger.error(f"Error sending alert: {e}")
+    """Lägg en varning i larmkön; skickas sammanfattad via Slack/Discord"""
+    alert_dispatcher.send(message)
 
-def health_check():
+def health_check(payload: dict) -> dict:
     """Kontrollera att API:et fungerar"""
     try:
-        response = requests.get(f"{API_BASE_URL}/")
+        response = requests.get(f"{API_BASE_URL}/", timeout=10)
         if response.status_code != 200:
             send_alert("❌ API är nere!")
             logger.error("API health check failed")
         else:
             logger.info("API health check passed")
-            
+        return {'status_code': response.status_code}
+
     except Exception as e:
         logger.error(f"Health check failed: {e}")
         send_alert("❌ Kan inte nå API!")
+        return {'error': str(e)}
+
+def prune_jobs(payload: dict) -> dict:
+    """Rensa gammal jobbhistorik"""
+    return {'deleted': job_queue.prune()}
+
+job_queue.register('update_procurements', update_procurement_data)
+job_queue.register('analyze_anomalies', analyze_new_anomalies)
+job_queue.register('detect_shared_directors', detect_shared_directors)
+job_queue.register('health_check', health_check)
+job_queue.register('prune_jobs', prune_jobs)
 
 def main():
     """Huvudfunktion för schemaläggning"""
     logger.info("Starting Nyhetsportalen scheduler")
-    
+
     if not AUTO_UPDATE_ENABLED:
         logger.info("Auto-update disabled, exiting")
         return
-    
-    # Schemalägg uppdateringar
-    schedule.every(UPDATE_INTERVAL_HOURS).hours.do(update_procurement_data)
-    schedule.every(1).hours.do(analyze_new_anomalies)
-    schedule.every(15).minutes.do(health_check)
-    
-    # Manuell första uppdatering
+
+    job_queue.start()
+
+    # Schemaläggaren lägger bara jobb i kön; arbetarna kör dem
+    scheduler = BlockingScheduler()
+    interval_job = dict(max_instances=1, coalesce=True, misfire_grace_time=300)
+    scheduler.add_job(job_queue.enqueue, 'interval', hours=UPDATE_INTERVAL_HOURS,
+                      args=['update_procurements', {'days_back': 7}], id='update_procurements', **interval_job)
+    scheduler.add_job(job_queue.enqueue, 'interval', hours=1,
+                      args=['analyze_anomalies'], id='analyze_anomalies', **interval_job)
+    scheduler.add_job(job_queue.enqueue, 'interval', minutes=15,
+                      args=['health_check'], id='health_check', **interval_job)
+    scheduler.add_job(job_queue.enqueue, 'interval', days=1,
+                      args=['prune_jobs'], id='prune_jobs', **interval_job)
+    scheduler.add_job(job_queue.enqueue, 'cron', hour=SHARED_DIRECTORS_HOUR,
+                      args=['detect_shared_directors'], id='detect_shared_directors', **interval_job)
+
+    # Manuell första uppdatering (analysen köas när importen är klar)
     logger.info("Running initial data update")
-    update_procurement_data()
-    analyze_new_anomalies()
-    
+    job_queue.enqueue('update_procurements', {'days_back': 7})
+
     logger.info(f"Scheduler started. Updates every {UPDATE_INTERVAL_HOURS} hours")
-    
-    # Huvudloop
-    while True:
-        try:
-            schedule.run_pending()
-            time.sleep(60)  # Kolla varje minut
-            
-        except KeyboardInterrupt:
-            logger.info("Scheduler stopped by user")
-            break
-        except Exception as e:
-            logger.error(f"Scheduler error: {e}")
-            time.sleep(300)  # Vänta 5 minuter vid fel
+
+    try:
+        scheduler.start()
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("Scheduler stopped by user")
+    finally:
+        job_queue.stop(timeout=30)
+        # Larm som väntar i sammanfattningsfönstret skickas innan processen avslutas
+        alert_dispatcher.stop(timeout=30)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Delade styrelseledamöter mellan konkurrerande leverantörer för Nyhetsportalen
+Personindexet (person×företag) och vinsterna (företag×myndighet) läses som glesa
+matriser. Produkten Pᵀ·P ger antal gemensamma ledamöter per företagspar, och för
+de paren ger radvis produkt av vinstmatrisen de myndigheter där båda vinner.
+Varje (myndighet, företagspar) blir en anomali i samma format som övriga detektorer.
+Endast ledamöter nycklade på personnummer räknas: namnnycklar slår ihop olika personer
+med samma namn och skulle ge falska larm.
+"""
+
+import os
+import time
+import logging
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from db_pool import chunked, placeholders
+
+logger = logging.getLogger(__name__)
+
+# Personer med fler styrelseuppdrag än så (proffsledamöter, revisorer) ger inga par:
+# de säger lite om samordning och står för merparten av produktens storlek
+SHARED_DIRECTOR_MAX_BOARDS = int(os.environ.get('SHARED_DIRECTOR_MAX_BOARDS', 25))
+# Minsta antal vinster per företag hos myndigheten för att paret ska räknas som konkurrenter där
+SHARED_DIRECTOR_MIN_CONTRACTS = int(os.environ.get('SHARED_DIRECTOR_MIN_CONTRACTS', 1))
+
+# Styrelseplatser (personnummernycklar, 'pnr:'-intervallet i primärnyckeln) i företag som
+# vunnit upphandlingar, med personens totala antal uppdrag
+MEMBERSHIP_SQL = '''
+    SELECT p.person_key, p.company_org_nr, p.name,
+           (SELECT COUNT(DISTINCT company_org_nr) FROM person_index b WHERE b.person_key = p.person_key)
+    FROM person_index p
+    WHERE p.person_key >= 'pnr:' AND p.person_key < 'pnr;'
+      AND p.company_org_nr IN (SELECT winner_org_nr FROM procurements)
+'''
+
+AWARDS_SQL = '''
+    SELECT winner_org_nr, contracting_authority, COUNT(*), SUM(value), MAX(award_date), MAX(winner_name)
+    FROM procurements
+    WHERE winner_org_nr IN ({marks}) AND contracting_authority IS NOT NULL
+    GROUP BY winner_org_nr, contracting_authority
+'''
+
+MEMBERSHIP_COLUMNS = ['person_key', 'company_org_nr', 'name', 'boards']
+AWARD_COLUMNS = ['winner_org_nr', 'contracting_authority', 'contracts', 'total_value', 'last_award', 'winner_name']
+
+
+def _pair_values(matrix: sparse.csr_matrix, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    """Matrisens värden för paren (rows[i], cols[i])"""
+    if not len(rows):
+        return np.zeros(0, dtype=matrix.dtype)
+    return np.asarray(matrix[rows, cols]).ravel()
+
+
+def shared_director_pairs(memberships: pd.DataFrame, awards: pd.DataFrame,
+                          max_boards: int = SHARED_DIRECTOR_MAX_BOARDS,
+                          min_contracts: int = SHARED_DIRECTOR_MIN_CONTRACTS) -> pd.DataFrame:
+    """
+    Företagspar med gemensamma ledamöter som båda vunnit hos samma myndighet.
+    memberships: person_key, company_org_nr, boards (personens antal uppdrag);
+    awards: winner_org_nr, contracting_authority, contracts, total_value.
+    En rad per (myndighet, par) med shared_people, shared_person_keys och båda
+    företagens kontrakt och värde hos myndigheten.
+    """
+    columns = ['authority', 'company_a', 'company_b', 'shared_people', 'shared_person_keys',
+               'contracts_a', 'contracts_b', 'value_a', 'value_b']
+    awards = awards[awards['contracts'] >= min_contracts]
+    awarded = pd.Index(pd.unique(awards['winner_org_nr']))
+    # Ledamöter med för många uppdrag tas bort före produkten
+    memberships = memberships[(awarded.get_indexer(memberships['company_org_nr']) >= 0)
+                              & (memberships['boards'] <= max_boards)]
+
+    person_codes, persons = pd.factorize(memberships['person_key'])
+    company_codes, companies = pd.factorize(memberships['company_org_nr'])
+    if not len(companies):
+        return pd.DataFrame(columns=columns)
+
+    membership = sparse.csr_matrix((np.ones(len(person_codes), dtype='int64'), (person_codes, company_codes)),
+                                   shape=(len(persons), len(companies)))
+    membership.data[:] = 1
+
+    # Pᵀ·P: gemensamma ledamöter per företagspar (övre triangeln, utan diagonalen)
+    shared = sparse.triu(membership.T @ membership, k=1).tocoo()
+    if not shared.nnz:
+        return pd.DataFrame(columns=columns)
+
+    award_company = companies.get_indexer(awards['winner_org_nr'])
+    awards, award_company = awards[award_company >= 0], award_company[award_company >= 0]
+    authority_codes, authorities = pd.factorize(awards['contracting_authority'])
+    contracts = sparse.csr_matrix((awards['contracts'].to_numpy('int64'), (award_company, authority_codes)),
+                                  shape=(len(companies), len(authorities)))
+    values = sparse.csr_matrix((awards['total_value'].fillna(0).to_numpy('float64'), (award_company, authority_codes)),
+                               shape=(len(companies), len(authorities)))
+
+    # Radvis produkt för varje par: myndigheter där båda företagen vunnit
+    a, b = shared.row, shared.col
+    common = contracts[a].multiply(contracts[b]).tocoo()
+    if not common.nnz:
+        return pd.DataFrame(columns=columns)
+    pair, authority = common.row, common.col
+
+    # Vilka ledamöter paren delar, för de par som faktiskt möts hos en myndighet
+    pairs, pair_index = np.unique(pair, return_inverse=True)
+    by_company = membership.T.tocsr()
+    overlap = by_company[a[pairs]].multiply(by_company[b[pairs]]).tocsr()
+    shared_keys = np.split(np.asarray(persons, dtype=object)[overlap.indices], overlap.indptr[1:-1])
+
+    return pd.DataFrame({
+        'authority': np.asarray(authorities, dtype=object)[authority],
+        'company_a': np.asarray(companies, dtype=object)[a[pair]],
+        'company_b': np.asarray(companies, dtype=object)[b[pair]],
+        'shared_people': shared.data[pair],
+        'shared_person_keys': [shared_keys[index] for index in pair_index],
+        'contracts_a': _pair_values(contracts, a[pair], authority),
+        'contracts_b': _pair_values(contracts, b[pair], authority),
+        'value_a': _pair_values(values, a[pair], authority),
+        'value_b': _pair_values(values, b[pair], authority)
+    }, columns=columns)
+
+
+class SharedDirectorDetector:
+    """Konkurrerande leverantörer med överlappande styrelser per myndighet"""
+
+    def __init__(self, pool, max_boards: int = SHARED_DIRECTOR_MAX_BOARDS,
+                 min_contracts: int = SHARED_DIRECTOR_MIN_CONTRACTS):
+        self.pool = pool
+        self.max_boards = max_boards
+        self.min_contracts = min_contracts
+
+    @staticmethod
+    def risk_score(shared_people: int, contracts_a: int, contracts_b: int) -> float:
+        """Gemensam styrelse och samma köpare ger 6; fler delade ledamöter och återkommande vinster höjer"""
+        score = 6 + 1.5 * (shared_people - 1)
+        if min(contracts_a, contracts_b) >= 3:
+            score += 1
+        return min(10, score)
+
+    def detect(self) -> List[Dict]:
+        """Anomalier för alla (myndighet, företagspar) med delade styrelseledamöter"""
+        start = time.perf_counter()
+        with self.pool.connection() as conn:
+            memberships = pd.DataFrame(conn.execute(MEMBERSHIP_SQL).fetchall(), columns=MEMBERSHIP_COLUMNS)
+            # Vinster behövs bara för företag där någon av ledamöterna sitter i ytterligare ett vinnande företag
+            eligible = memberships[memberships['boards'] <= self.max_boards].drop_duplicates(
+                ['person_key', 'company_org_nr'])
+            shared = eligible['person_key'].duplicated(keep=False)
+            candidates = sorted(set(eligible.loc[shared, 'company_org_nr']))
+            rows = []
+            for batch in chunked(candidates):
+                rows.extend(conn.execute(AWARDS_SQL.format(marks=placeholders(batch)), batch).fetchall())
+            awards = pd.DataFrame(rows, columns=AWARD_COLUMNS)
+
+        pairs = shared_director_pairs(memberships, awards, self.max_boards, self.min_contracts)
+        if pairs.empty:
+            logger.info(f"Shared director scan found no pairs in {time.perf_counter() - start:.2f} seconds")
+            return []
+
+        # Namn: företagsregistret i första hand, annars vinnarnamnet i upphandlingarna
+        org_nrs = sorted(set(pairs['company_a']) | set(pairs['company_b']))
+        names = awards.groupby('winner_org_nr')['winner_name'].max().to_dict()
+        with self.pool.connection() as conn:
+            for batch in chunked(org_nrs):
+                names.update(conn.execute(f'''
+                    SELECT org_nr, name FROM companies WHERE org_nr IN ({placeholders(batch)})
+                ''', batch).fetchall())
+        person_names = memberships.drop_duplicates('person_key').set_index('person_key')['name'].to_dict()
+        last_award = awards.set_index(['winner_org_nr', 'contracting_authority'])['last_award'].to_dict()
+
+        detected_at = datetime.now().isoformat()
+        anomalies = []
+        for row in pairs.itertuples(index=False):
+            name_a, name_b = names.get(row.company_a) or row.company_a, names.get(row.company_b) or row.company_b
+            people = 'styrelseledamot' if row.shared_people == 1 else 'styrelseledamöter'
+            anomalies.append({
+                'procurement_id': None,
+                'anomaly_type': 'Delad styrelse',
+                'description': f'{name_a} och {name_b} delar {row.shared_people} {people} '
+                               f'och vinner båda upphandlingar hos {row.authority}',
+                'risk_score': self.risk_score(row.shared_people, row.contracts_a, row.contracts_b),
+                'detected_at': detected_at,
+                'details': {
+                    'authority': row.authority,
+                    'shared_people': int(row.shared_people),
+                    'shared_person_names': [person_names.get(key) for key in row.shared_person_keys[:5]],
+                    'companies': [{
+                        'org_nr': org_nr,
+                        'name': name,
+                        'contracts': int(contracts),
+                        'total_value': float(value),
+                        'last_award': last_award.get((org_nr, row.authority))
+                    } for org_nr, name, contracts, value in (
+                        (row.company_a, name_a, row.contracts_a, row.value_a),
+                        (row.company_b, name_b, row.contracts_b, row.value_b)
+                    )]
+                }
+            })
+
+        anomalies.sort(key=lambda anomaly: (-anomaly['risk_score'], anomaly['details']['authority']))
+        logger.info(f"Shared director scan: {len(anomalies)} authority/pair findings from "
+                    f"{len(memberships)} board seats in {time.perf_counter() - start:.2f} seconds")
+        return anomalies
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+Bipartit graf myndighet×leverantör för Nyhetsportalen
+Relationerna hålls som glesa SciPy-matriser (antal kontrakt, värde, första och
+senaste kontrakt) så att grad, koncentration, sammanhängande komponenter och
+beroendegrad per kant räknas med matrisoperationer även för alla svenska köpare
+och hundratusentals leverantörer. Nya rader läggs till inkrementellt via id;
+ändrade eller borttagna rader (procurement_edits, migrering 6) ger full ombyggnad.
+Grafen hålls aktuell av en bakgrundstråd per process; läsningar väntar aldrig på den.
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from analysis_context import LOAD_CHUNK_SIZE
+from migrations import apply_migrations
+
+logger = logging.getLogger(__name__)
+
+# Hur ofta bakgrundstråden ser efter rader som skrivits av andra processer (t.ex. scheduler.py)
+GRAPH_POLL_SECONDS = float(os.environ.get('GRAPH_POLL_SECONDS', 60))
+
+GRAPH_SQL = '''
+    SELECT contracting_authority, winner_name, value, award_date FROM procurements
+    WHERE id > ? AND id <= ? AND contracting_authority IS NOT NULL AND winner_name IS NOT NULL
+'''
+
+SIDES = {'authority': 'contracting_authority', 'supplier': 'winner_name'}
+
+NODE_ORDER = ('contracts', 'total_value', 'partners', 'hhi', 'top_share')
+EDGE_ORDER = ('contracts', 'total_value', 'supplier_dependency', 'authority_share')
+
+# Första kontraktet lagras som FIRST_BASE - dagnummer, så att elementvis max ger
+# tidigaste datum och en saknad kant (implicit 0) aldrig vinner
+FIRST_BASE = 1 << 40
+
+
+def _day_numbers(dates: pd.Series) -> np.ndarray:
+    """Dagnummer sedan 1970-01-01 som float, NaN för saknat datum"""
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates, errors='coerce', format='ISO8601')
+    days = dates.to_numpy('datetime64[D]')
+    return np.where(np.isnat(days), np.nan, days.astype('int64'))
+
+
+def _day_strings(days: np.ndarray) -> List[Optional[str]]:
+    """Dagnummer (NaN = saknas) som 'YYYY-MM-DD'"""
+    missing = np.isnan(days)
+    dates = np.where(missing, 0, days).astype('int64').astype('datetime64[D]').astype(str)
+    return [None if gap else date for gap, date in zip(missing.tolist(), dates.tolist())]
+
+
+def _lookup(matrix: sparse.csr_matrix, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+    """Matrisens värden för paren (rows[i], cols[i])"""
+    if not len(rows):
+        return np.zeros(0, dtype=matrix.dtype)
+    return np.asarray(matrix[rows, cols]).ravel()
+
+
+def _row_top(matrix: sparse.csr_matrix):
+    """Största värdet per rad och dess kolumn (0, 0 för tomma rader), utan radvis Python-loop"""
+    lengths = np.diff(matrix.indptr)
+    top_value = np.zeros(matrix.shape[0], dtype=matrix.dtype)
+    top_column = np.zeros(matrix.shape[0], dtype='int64')
+    if matrix.nnz:
+        nonempty = lengths > 0
+        top_value[nonempty] = np.maximum.reduceat(matrix.data, matrix.indptr[:-1][nonempty])
+        rows = np.repeat(np.arange(matrix.shape[0]), lengths)
+        hits = np.flatnonzero(matrix.data == top_value[rows])
+        hit_rows, first = np.unique(rows[hits], return_index=True)
+        top_column[hit_rows] = matrix.indices[hits[first]]
+    return top_value, top_column
+
+
+class SupplierGraph:
+    """Glesa matriser över kontrakt mellan myndigheter (rader) och leverantörer (kolumner)"""
+
+    def __init__(self, pool=None):
+        self.pool = pool
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._pending = {'refresh': False, 'full': False}
+        self._thread: Optional[threading.Thread] = None
+        self._clear()
+        if pool is not None:
+            apply_migrations(pool)
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame) -> 'SupplierGraph':
+        """Graf direkt från en upphandlingsram (t.ex. AnalysisContext.frame), utan databas"""
+        graph = cls()
+        graph._add(frame)
+        return graph
+
+    def _clear(self):
+        self.nodes = {side: pd.Index([], dtype=object) for side in SIDES}
+        self.counts = sparse.csr_matrix((0, 0), dtype='int64')
+        self.values = sparse.csr_matrix((0, 0), dtype='float64')
+        self.first = sparse.csr_matrix((0, 0), dtype='int64')
+        self.last = sparse.csr_matrix((0, 0), dtype='int64')
+        self.last_rowid = 0
+        self.row_count = 0
+        self.edits = None
+        self._derived: Optional[Dict] = None
+
+    def _adopt(self, other: 'SupplierGraph'):
+        """Ta över en färdigbyggd graf i ett svep"""
+        with self._lock:
+            self.nodes, self.counts, self.values = other.nodes, other.counts, other.values
+            self.first, self.last = other.first, other.last
+            self.last_rowid, self.row_count, self.edits = other.last_rowid, other.row_count, other.edits
+            self._derived = None
+
+    @property
+    def ready(self) -> bool:
+        """Sant när grafen byggts minst en gång"""
+        return self.edits is not None
+
+    # Uppbyggnad
+
+    def _codes(self, side: str, names: pd.Series) -> np.ndarray:
+        """Nodnummer för namnen; okända namn läggs till sist"""
+        codes, uniques = pd.factorize(names)
+        uniques = np.asarray(uniques, dtype=object)
+        positions = self.nodes[side].get_indexer(uniques)
+        missing = positions < 0
+        if missing.any():
+            start = len(self.nodes[side])
+            self.nodes[side] = self.nodes[side].append(pd.Index(uniques[missing], dtype=object))
+            positions[missing] = np.arange(start, len(self.nodes[side]))
+        return positions[codes]
+
+    def _add(self, frame: pd.DataFrame) -> int:
+        """Lägg till kontrakt; returnerar antal rader som blev kanter"""
+        frame = frame.dropna(subset=list(SIDES.values()))
+        if frame.empty:
+            return 0
+
+        with self._lock:
+            edges = pd.DataFrame({
+                'authority': self._codes('authority', frame['contracting_authority']),
+                'supplier': self._codes('supplier', frame['winner_name']),
+                'value': pd.to_numeric(frame['value'], errors='coerce').fillna(0.0).to_numpy('float64'),
+                'day': _day_numbers(frame['award_date'])
+            }).groupby(['authority', 'supplier'], sort=False).agg(
+                contracts=('value', 'size'), value=('value', 'sum'), first=('day', 'min'), last=('day', 'max')
+            ).reset_index()
+
+            shape = (len(self.nodes['authority']), len(self.nodes['supplier']))
+            index = (edges['authority'].to_numpy(), edges['supplier'].to_numpy())
+
+            def delta(data) -> sparse.csr_matrix:
+                return sparse.csr_matrix((data, index), shape=shape)
+
+            first = np.where(edges['first'].isna(), 0, FIRST_BASE - edges['first'].fillna(0)).astype('int64')
+            last = (edges['last'].fillna(-1) + 1).astype('int64')  # 0 = saknat datum
+
+            for matrix in (self.counts, self.values, self.first, self.last):
+                matrix.resize(shape)
+            self.counts = self.counts + delta(edges['contracts'].to_numpy('int64'))
+            self.values = self.values + delta(edges['value'].to_numpy('float64'))
+            self.first = self.first.maximum(delta(first))
+            self.last = self.last.maximum(delta(last))
+            self._derived = None
+        return len(frame)
+
+    def refresh(self, full: bool = False) -> Dict:
+        """
+        Läs in rader som tillkommit sedan förra gången. Hela grafen byggs om första
+        gången, med full=True och när rader ändrats eller tagits bort sedan dess.
+        En full ombyggnad sker vid sidan av och ersätter grafen först när den är klar.
+        """
+        start = time.perf_counter()
+        with self._refresh_lock:
+            with self.pool.connection() as conn:
+                max_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM procurements').fetchone()[0]
+                edits = conn.execute('SELECT edits FROM procurement_edits WHERE id = 1').fetchone()[0]
+                if not full and self.edits == edits and max_id == self.last_rowid:
+                    return {'mode': 'unchanged', 'rows': 0, 'seconds': 0.0}
+                # Annat antal rader under high-water mark än senast betyder borttag som inte räknats
+                # (t.ex. utbytt databasfil)
+                known = conn.execute('SELECT COUNT(*) FROM procurements WHERE id <= ?',
+                                     (self.last_rowid,)).fetchone()[0]
+
+            full = full or self.edits != edits or known != self.row_count or max_id < self.last_rowid
+            target = SupplierGraph() if full else self
+            rows = 0
+            try:
+                with self.pool.connection() as conn:
+                    for chunk in pd.read_sql_query(GRAPH_SQL, conn, params=(target.last_rowid, max_id),
+                                                   chunksize=LOAD_CHUNK_SIZE):
+                        rows += target._add(chunk)
+                    row_count = conn.execute('SELECT COUNT(*) FROM procurements WHERE id <= ?',
+                                             (max_id,)).fetchone()[0]
+            except Exception:
+                if not full:
+                    # En halvt inläst graf får inte byggas vidare på
+                    self._adopt(SupplierGraph())
+                raise
+            with target._lock:
+                target.last_rowid, target.row_count, target.edits = max_id, row_count, edits
+            if full:
+                self._adopt(target)
+
+        result = {
+            'mode': 'full' if full else 'incremental',
+            'rows': rows,
+            'seconds': round(time.perf_counter() - start, 3)
+        }
+        logger.info(f"Refreshed supplier graph ({result['mode']}): {rows} contracts, "
+                    f"{self.counts.nnz} edges in {result['seconds']:.2f} seconds")
+        return result
+
+    # Bakgrundsuppdatering
+
+    def start(self, poll_interval: float = GRAPH_POLL_SECONDS):
+        """Bygg grafen och håll den aktuell i en bakgrundstråd (gör inget om den redan körs)"""
+        with self._wakeup:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._pending['refresh'] = True
+            self._thread = threading.Thread(target=self._refresher, args=(poll_interval,),
+                                            name='supplier-graph', daemon=True)
+            self._thread.start()
+
+    def request_refresh(self, full: bool = False):
+        """Be bakgrundstråden läsa in nya rader (t.ex. efter en import); väntar inte på den"""
+        with self._wakeup:
+            self._pending['refresh'] = True
+            self._pending['full'] = self._pending['full'] or full
+            self._wakeup.notify()
+
+    def _refresher(self, poll_interval: float):
+        while True:
+            with self._wakeup:
+                if not self._pending['refresh']:
+                    self._wakeup.wait(poll_interval)
+                full = self._pending['full']
+                self._pending.update(refresh=False, full=False)
+            try:
+                self.refresh(full)
+            except Exception as e:
+                logger.error(f"Error refreshing supplier graph: {e}")
+
+    # Härledda storheter, räknade en gång per grafversion
+
+    def _derive(self) -> Dict:
+        with self._lock:
+            if self._derived is not None:
+                return self._derived
+            counts = self.counts
+            n_authorities, n_suppliers = counts.shape
+            adjacency = sparse.bmat([[None, counts], [counts.T, None]], format='csr')
+            if adjacency.shape[0]:
+                n_components, labels = connected_components(adjacency, directed=False)
+            else:
+                n_components, labels = 0, np.zeros(0, dtype='int64')
+            self._derived = {
+                'authority_contracts': np.asarray(counts.sum(axis=1)).ravel(),
+                'supplier_contracts': np.asarray(counts.sum(axis=0)).ravel(),
+                'authority_value': np.asarray(self.values.sum(axis=1)).ravel(),
+                'supplier_value': np.asarray(self.values.sum(axis=0)).ravel(),
+                'components': n_components,
+                'authority_component': labels[:n_authorities],
+                'supplier_component': labels[n_authorities:],
+                'component_authorities': np.bincount(labels[:n_authorities], minlength=n_components),
+                'component_suppliers': np.bincount(labels[n_authorities:], minlength=n_components)
+            }
+            return self._derived
+
+    # Frågor
+
+    def summary(self, limit: int = 10) -> Dict:
+        """Storlek, high-water mark och de största sammanhängande komponenterna"""
+        with self._lock:
+            derived = self._derive()
+            sizes = derived['component_authorities'] + derived['component_suppliers']
+            largest = np.argsort(-sizes, kind='stable')[:limit]
+            return {
+                'authorities': len(self.nodes['authority']),
+                'suppliers': len(self.nodes['supplier']),
+                'edges': int(self.counts.nnz),
+                'contracts': int(derived['authority_contracts'].sum()),
+                'components': int(derived['components']),
+                'largest_components': [{
+                    'component': int(component),
+                    'authorities': int(derived['component_authorities'][component]),
+                    'suppliers': int(derived['component_suppliers'][component])
+                } for component in largest],
+                'last_rowid': self.last_rowid
+            }
+
+    def nodes_frame(self, side: str = 'authority', min_contracts: int = 1, order_by: str = 'contracts',
+                    limit: Optional[int] = None) -> pd.DataFrame:
+        """
+        Grad och koncentration per nod: partners (antal motparter), contracts, total_value,
+        hhi över motparternas kontraktsandelar, största motpart och dess andel, komponent.
+        """
+        if side not in SIDES or order_by not in NODE_ORDER:
+            raise ValueError(f"Unknown side or sort: {side}, {order_by}")
+        with self._lock:
+            derived = self._derive()
+            matrix = self.counts if side == 'authority' else self.counts.T.tocsr()
+            other = 'supplier' if side == 'authority' else 'authority'
+            contracts = derived[f'{side}_contracts']
+            shares = sparse.diags(1.0 / np.maximum(contracts, 1)) @ matrix
+            top_contracts, top = _row_top(matrix)
+            df = pd.DataFrame({
+                side: self.nodes[side],
+                'partners': np.diff(matrix.indptr),
+                'contracts': contracts,
+                'total_value': derived[f'{side}_value'],
+                'hhi': np.asarray(shares.multiply(shares).sum(axis=1)).ravel(),
+                f'top_{other}': self.nodes[other][top] if len(self.nodes[other]) else [],
+                'top_share': top_contracts / np.maximum(contracts, 1),
+                'component': derived[f'{side}_component']
+            })
+        df = df[df['contracts'] >= min_contracts]
+        df = df.sort_values([order_by, side], ascending=[False, True], kind='stable')
+        return df.head(limit) if limit else df
+
+    def edges_frame(self, authority: Optional[str] = None, supplier: Optional[str] = None,
+                    min_contracts: int = 1, order_by: str = 'contracts',
+                    limit: Optional[int] = None) -> pd.DataFrame:
+        """
+        Kanter med beroendegrad: authority_share är kantens andel av myndighetens kontrakt,
+        supplier_dependency (och supplier_value_dependency) andelen av leverantörens
+        kontrakt (värde) som kommer från myndigheten.
+        """
+        if order_by not in EDGE_ORDER:
+            raise ValueError(f"Unknown sort: {order_by}")
+        with self._lock:
+            derived = self._derive()
+            counts = self.counts
+            # Välj rad/kolumn före konvertering så att en enskild nod inte kräver hela grafen
+            rows = np.arange(counts.shape[0])
+            cols = np.arange(counts.shape[1])
+            for side, name in (('authority', authority), ('supplier', supplier)):
+                if name is not None:
+                    position = self.nodes[side].get_indexer([name])[0]
+                    selected = np.array([position] if position >= 0 else [], dtype='int64')
+                    rows, cols = (selected, cols) if side == 'authority' else (rows, selected)
+            sub = counts[rows][:, cols].tocoo()
+            a, s = rows[sub.row], cols[sub.col]
+            keep = sub.data >= min_contracts
+            a, s, contracts = a[keep], s[keep], sub.data[keep]
+            values = _lookup(self.values, a, s)
+            first = _lookup(self.first, a, s)
+            last = _lookup(self.last, a, s)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                df = pd.DataFrame({
+                    'authority': self.nodes['authority'][a],
+                    'supplier': self.nodes['supplier'][s],
+                    'contracts': contracts,
+                    'total_value': values,
+                    'authority_share': contracts / derived['authority_contracts'][a],
+                    'supplier_dependency': contracts / derived['supplier_contracts'][s],
+                    'supplier_value_dependency': np.where(derived['supplier_value'][s] > 0,
+                                                          values / derived['supplier_value'][s], np.nan),
+                    'first_contract': _day_strings(np.where(first > 0, FIRST_BASE - first, np.nan)),
+                    'last_contract': _day_strings(np.where(last > 0, last - 1, np.nan)),
+                    'component': derived['authority_component'][a]
+                })
+        df = df.sort_values([order_by, 'authority', 'supplier'], ascending=[False, True, True], kind='stable')
+        return df.head(limit) if limit else df
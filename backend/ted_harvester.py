@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Strömmande TED-skördare för Nyhetsportalen
+Går igenom alla TED-sidor i datumskivor och sparar en återupptagbar markör i SQLite
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Antal dagar per datumskiva; håller sidnumren låga även för flerårsintervall
+DEFAULT_SLICE_DAYS = 30
+
+
+class TEDHarvester:
+    """Skördar TED-notiser sida för sida med konstant minnesanvändning"""
+
+    def __init__(self, collector, db_manager, name: str = 'ted_contract_awards',
+                 slice_days: int = DEFAULT_SLICE_DAYS):
+        self.collector = collector
+        self.db_manager = db_manager
+        self.name = name
+        self.slice_days = slice_days
+
+    def harvest(self, start_date: datetime, end_date: datetime, resume: bool = True,
+                max_pages: Optional[int] = None) -> Dict:
+        """
+        Skörda alla notiser mellan start_date och end_date.
+        Varje sida lagras och markören flyttas fram i samma transaktion, så en
+        avbruten körning fortsätter från sista färdiga sida utan att hämta om.
+        """
+        window_from = start_date.strftime('%Y-%m-%d')
+        window_to = end_date.strftime('%Y-%m-%d')
+
+        cursor = self.db_manager.get_harvest_cursor(self.name) if resume else None
+        if (cursor and cursor['status'] != 'done'
+                and cursor['window_from'] == window_from and cursor['window_to'] == window_to):
+            slice_from = datetime.strptime(cursor['slice_from'], '%Y-%m-%d')
+            page = cursor['next_page']
+            contracts_seen = cursor['contracts_seen']
+            logger.info(f"Resuming TED harvest '{self.name}' at {cursor['slice_from']} page {page}")
+        else:
+            slice_from = datetime.strptime(window_from, '%Y-%m-%d')
+            page = 1
+            contracts_seen = 0
+
+        result = {
+            'name': self.name,
+            'window_from': window_from,
+            'window_to': window_to,
+            'pages': 0,
+            'contracts_seen': contracts_seen,
+            'inserted': 0,
+            'updated': 0,
+            'skipped': 0,
+            'status': 'running'
+        }
+        last_day = datetime.strptime(window_to, '%Y-%m-%d')
+
+        while slice_from <= last_day:
+            slice_to = min(slice_from + timedelta(days=self.slice_days - 1), last_day)
+
+            for page_no, contracts in self.collector.iter_ted_pages(slice_from, slice_to, page):
+                with self.db_manager.connection():
+                    stored = self.db_manager.store_procurements(contracts)
+                    result['contracts_seen'] += len(contracts)
+                    self.db_manager.save_harvest_cursor(
+                        self.name, window_from, window_to, slice_from.strftime('%Y-%m-%d'),
+                        page_no + 1, result['contracts_seen']
+                    )
+
+                result['pages'] += 1
+                for key in ('inserted', 'updated', 'skipped'):
+                    result[key] += stored[key]
+
+                if max_pages is not None and result['pages'] >= max_pages:
+                    logger.info(f"TED harvest '{self.name}' paused after {result['pages']} pages")
+                    return result
+
+            # Skivan klar, nästa börjar på sida 1
+            slice_from = slice_to + timedelta(days=1)
+            page = 1
+            self.db_manager.save_harvest_cursor(
+                self.name, window_from, window_to, slice_from.strftime('%Y-%m-%d'),
+                page, result['contracts_seen']
+            )
+
+        self.db_manager.save_harvest_cursor(
+            self.name, window_from, window_to, window_to, 1, result['contracts_seen'], status='done'
+        )
+        result['status'] = 'done'
+
+        logger.info(f"TED harvest '{self.name}' done: {result['pages']} pages, "
+                    f"{result['inserted']} inserted, {result['updated']} updated")
+        return result
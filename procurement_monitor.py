@@ -7,7 +7,6 @@ VARNING: Detta är endast en prototyp för utbildningssyfte.
 Verklig användning kräver juridisk granskning och GDPR-compliance.
 """
 
-import sqlite3
 import requests
 import pandas as pd
 import numpy as np
@@ -15,10 +14,17 @@ import logging
 import json
 import time
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 from dataclasses import dataclass, asdict
 from pathlib import Path
 import hashlib
+import uuid
+import sys
+
+# Delad anslutningspool finns i backend/
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'backend'))
+from db_pool import get_pool
+from fetch_engine import fetch_engine
 
 # Konfigurera logging
 logging.basicConfig(
@@ -69,159 +75,153 @@ class DatabaseManager:
     
     def __init__(self, db_path: str = "procurement_monitor.db"):
         self.db_path = db_path
+        self.pool = get_pool(db_path)
         self.init_database()
     
+    def connection(self):
+        """Lånar en poolad anslutning (context manager)"""
+        return self.pool.connection()
+    
     def init_database(self):
         """Initialiserar databas med nödvändiga tabeller"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Upphandlingar
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS procurements (
-                id TEXT PRIMARY KEY,
-                title TEXT,
-                municipality TEXT,
-                value REAL,
-                date TEXT,
-                winner_company TEXT,
-                winner_org_nr TEXT,
-                category TEXT,
-                source TEXT,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Företag
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS companies (
-                org_nr TEXT PRIMARY KEY,
-                name TEXT,
-                owners TEXT,  -- JSON array
-                board_members TEXT,  -- JSON array
-                registration_date TEXT,
-                last_updated TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Anomalier
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS anomalies (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                company_name TEXT,
-                company_org_nr TEXT,
-                municipality TEXT,
-                anomaly_type TEXT,
-                score REAL,
-                details TEXT,
-                evidence TEXT,  -- JSON array
-                detected_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        with self.connection() as conn:
+            cursor = conn.cursor()
+        
+            # Upphandlingar
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS procurements (
+                    id TEXT PRIMARY KEY,
+                    title TEXT,
+                    municipality TEXT,
+                    value REAL,
+                    date TEXT,
+                    winner_company TEXT,
+                    winner_org_nr TEXT,
+                    category TEXT,
+                    source TEXT,
+                    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+        
+            # Företag
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS companies (
+                    org_nr TEXT PRIMARY KEY,
+                    name TEXT,
+                    owners TEXT,  -- JSON array
+                    board_members TEXT,  -- JSON array
+                    registration_date TEXT,
+                    last_updated TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+        
+            # Anomalier
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS anomalies (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    company_name TEXT,
+                    company_org_nr TEXT,
+                    municipality TEXT,
+                    anomaly_type TEXT,
+                    score REAL,
+                    details TEXT,
+                    evidence TEXT,  -- JSON array
+                    detected_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
         
-        conn.commit()
-        conn.close()
         logger.info("Databas initialiserad")
 
     def store_procurement(self, procurement: Procurement):
         """Lagrar upphandling i databas"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO procurements 
-            (id, title, municipality, value, date, winner_company, winner_org_nr, category, source)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            procurement.id, procurement.title, procurement.municipality,
-            procurement.value, procurement.date.isoformat(),
-            procurement.winner_company, procurement.winner_org_nr,
-            procurement.category, procurement.source
-        ))
-        
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+        
+            cursor.execute('''
+                INSERT OR REPLACE INTO procurements 
+                (id, title, municipality, value, date, winner_company, winner_org_nr, category, source)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                procurement.id, procurement.title, procurement.municipality,
+                procurement.value, procurement.date.isoformat(),
+                procurement.winner_company, procurement.winner_org_nr,
+                procurement.category, procurement.source
+            ))
 
     def get_procurements_by_municipality(self, municipality: str, days: int = 365) -> pd.DataFrame:
         """Hämtar upphandlingar för en kommun"""
-        conn = sqlite3.connect(self.db_path)
+        with self.connection() as conn:
         
-        since_date = (datetime.now() - timedelta(days=days)).isoformat()
+            since_date = (datetime.now() - timedelta(days=days)).isoformat()
         
-        query = '''
-            SELECT * FROM procurements 
-            WHERE municipality = ? AND date >= ?
-            ORDER BY date DESC
-        '''
+            query = '''
+                SELECT * FROM procurements 
+                WHERE municipality = ? AND date >= ?
+                ORDER BY date DESC
+            '''
         
-        df = pd.read_sql_query(query, conn, params=(municipality, since_date))
-        conn.close()
+            df = pd.read_sql_query(query, conn, params=(municipality, since_date))
         
         return df
 
     def get_all_procurements(self, limit: int = 100) -> List[dict]:
         """Hämtar alla upphandlingar för web API"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT * FROM procurements 
-            ORDER BY date DESC 
-            LIMIT ?
-        ''', (limit,))
+            cursor.execute('''
+                SELECT * FROM procurements 
+                ORDER BY date DESC 
+                LIMIT ?
+            ''', (limit,))
         
-        columns = [description[0] for description in cursor.description]
-        rows = cursor.fetchall()
+            columns = [description[0] for description in cursor.description]
+            rows = cursor.fetchall()
         
-        procurements = []
-        for row in rows:
-            proc_dict = dict(zip(columns, row))
-            procurements.append(proc_dict)
+            procurements = []
+            for row in rows:
+                proc_dict = dict(zip(columns, row))
+                procurements.append(proc_dict)
         
-        conn.close()
         return procurements
 
     def store_anomaly(self, anomaly: AnomalyAlert):
         """Lagrar anomali i databas"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO anomalies 
-            (company_name, company_org_nr, municipality, anomaly_type, score, details, evidence)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            anomaly.company_name, anomaly.company_org_nr, anomaly.municipality,
-            anomaly.anomaly_type, anomaly.score, anomaly.details,
-            json.dumps(anomaly.evidence)
-        ))
-        
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+        
+            cursor.execute('''
+                INSERT INTO anomalies 
+                (company_name, company_org_nr, municipality, anomaly_type, score, details, evidence)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                anomaly.company_name, anomaly.company_org_nr, anomaly.municipality,
+                anomaly.anomaly_type, anomaly.score, anomaly.details,
+                json.dumps(anomaly.evidence)
+            ))
 
     def get_recent_anomalies(self, days: int = 7) -> List[dict]:
         """Hämtar senaste anomalier"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
         
-        since_date = (datetime.now() - timedelta(days=days)).isoformat()
+            since_date = (datetime.now() - timedelta(days=days)).isoformat()
         
-        cursor.execute('''
-            SELECT * FROM anomalies 
-            WHERE detected_at >= ?
-            ORDER BY score DESC, detected_at DESC
-        ''', (since_date,))
+            cursor.execute('''
+                SELECT * FROM anomalies 
+                WHERE detected_at >= ?
+                ORDER BY score DESC, detected_at DESC
+            ''', (since_date,))
         
-        columns = [description[0] for description in cursor.description]
-        rows = cursor.fetchall()
+            columns = [description[0] for description in cursor.description]
+            rows = cursor.fetchall()
         
-        anomalies = []
-        for row in rows:
-            anomaly_dict = dict(zip(columns, row))
-            anomaly_dict['evidence'] = json.loads(anomaly_dict['evidence'])
-            anomalies.append(anomaly_dict)
+            anomalies = []
+            for row in rows:
+                anomaly_dict = dict(zip(columns, row))
+                anomaly_dict['evidence'] = json.loads(anomaly_dict['evidence'])
+                anomalies.append(anomaly_dict)
         
-        conn.close()
         return anomalies
 
 class DataCollector:
@@ -241,12 +241,13 @@ class DataCollector:
         """
         logger.info("Samlar TED-data...")
         
-        # PLACEHOLDER: Simulerad data för demonstration
-        sample_procurements = []
-        
-        for i in range(10):
-            procurement = Procurement(
-                id=f"ted_{i}_{int(datetime.now().timestamp())}",
+        # PLACEHOLDER: Simulerad data för demonstration. Riktiga anrop ska gå via
+        # fetch_engine.get(self.session, ...), som håller värdens hastighets- och samtidighetsgränser.
+        # Kommunerna samlas parallellt, så id:t måste vara unikt även inom samma sekund
+        batch = uuid.uuid4().hex[:12]
+        sample_procurements = [
+            Procurement(
+                id=f"ted_{municipality or 'alla'}_{batch}_{i}",
                 title=f"IT-upphandling {i} - Systemutveckling",
                 municipality=municipality or "Stockholm",
                 value=np.random.uniform(100000, 5000000),
@@ -256,7 +257,9 @@ class DataCollector:
                 category="IT-tjänster",
                 source="TED"
             )
-            sample_procurements.append(procurement)
+            for i in range(10)
+        ]
+        for procurement in sample_procurements:
             self.db_manager.store_procurement(procurement)
         
         logger.info(f"Samlade {len(sample_procurements)} upphandlingar från TED")
@@ -268,11 +271,12 @@ class DataCollector:
         """
         logger.info("Samlar Visma Commerce-data...")
         
-        sample_procurements = []
-        
-        for i in range(15):
-            procurement = Procurement(
-                id=f"visma_{i}_{int(datetime.now().timestamp())}",
+        # PLACEHOLDER: Simulerad data (riktiga anrop via fetch_engine.get, se collect_ted_data).
+        # Kommunerna samlas parallellt, så id:t måste vara unikt även inom samma sekund
+        batch = uuid.uuid4().hex[:12]
+        sample_procurements = [
+            Procurement(
+                id=f"visma_{municipality or 'alla'}_{batch}_{i}",
                 title=f"Byggprojekt {i} - Kommunal anläggning",
                 municipality=municipality or "Göteborg",
                 value=np.random.uniform(50000, 2000000),
@@ -282,7 +286,9 @@ class DataCollector:
                 category="Byggentreprenad",
                 source="Visma"
             )
-            sample_procurements.append(procurement)
+            for i in range(15)
+        ]
+        for procurement in sample_procurements:
             self.db_manager.store_procurement(procurement)
         
         logger.info(f"Samlade {len(sample_procurements)} upphandlingar från Visma")
@@ -450,18 +456,25 @@ class ProcurementMonitor:
         
         self.municipalities = ["Stockholm", "Göteborg", "Malmö", "Uppsala", "Linköping"]
         
-    def daily_update(self):
-        """Utför daglig uppdatering av data"""
+    def daily_update(self, progress: Optional[Callable[[float, str], None]] = None):
+        """Utför daglig uppdatering av data; progress anropas med andel klara kommuner"""
         logger.info("Startar daglig uppdatering")
+        done = []
         
-        for municipality in self.municipalities:
+        # Kommunerna hämtas parallellt; varje källanrop går genom hämtmotorns gränser per värd
+        def collect(municipality):
             try:
                 self.data_collector.collect_ted_data(municipality)
                 self.data_collector.collect_visma_data(municipality)
-                time.sleep(1)
-                
-            except Exception as e:
-                logger.error(f"Fel vid insamling för {municipality}: {e}")
+            finally:
+                done.append(municipality)
+                if progress:
+                    progress(len(done) / len(self.municipalities), f"{municipality} klar")
+        
+        results = fetch_engine.map(collect, self.municipalities)
+        for municipality, result in zip(self.municipalities, results):
+            if isinstance(result, Exception):
+                logger.error(f"Fel vid insamling för {municipality}: {result}")
         
         logger.info("Daglig uppdatering klar")
     
@@ -477,11 +490,18 @@ class ProcurementMonitor:
             logger.error(f"Fel vid veckoanalys: {e}")
             return None
     
-    def run_full_cycle(self):
+    def run_full_cycle(self, progress: Optional[Callable[[float, str], None]] = None):
         """Kör en fullständig cykel av datainsamling och analys"""
         logger.info("Startar fullständig cykel")
-        self.daily_update()
+        def update_progress(fraction, message):
+            # Insamlingen räknas som 80 % av cykeln
+            if progress:
+                progress(0.8 * fraction, message)
+
+        self.daily_update(update_progress)
         time.sleep(2)
+        if progress:
+            progress(0.8, "Analyserar")
         report = self.weekly_analysis()
         logger.info("Fullständig cykel klar")
         return report